@@ -3,10 +3,126 @@ set -euo pipefail
 
 mkdir -p /opt/hytale/mods /opt/hytale/data /opt/hytale/logs
 
-if [[ -n "${HT_JAVA_OPTS:-}" ]]; then
+# Container memory limit in MiB (cgroup v2, then v1); empty when unlimited.
+cgroup_memory_mb() {
+  local value=""
+  if [[ -r /sys/fs/cgroup/memory.max ]]; then
+    value=$(cat /sys/fs/cgroup/memory.max)
+  elif [[ -r /sys/fs/cgroup/memory/memory.limit_in_bytes ]]; then
+    value=$(cat /sys/fs/cgroup/memory/memory.limit_in_bytes)
+  fi
+  # v1 reports "no limit" as a page-aligned number near 2^63.
+  if [[ "$value" =~ ^[0-9]+$ ]] && (( value < (1 << 50) )); then
+    echo $(( value / 1048576 ))
+  fi
+}
+
+# CPUs available to the container: the cpuset (nproc), capped by any CFS quota.
+cgroup_cpus() {
+  local cpus quota="" period=""
+  cpus=$(nproc)
+  if [[ -r /sys/fs/cgroup/cpu.max ]]; then
+    read -r quota period < /sys/fs/cgroup/cpu.max
+  elif [[ -r /sys/fs/cgroup/cpu/cpu.cfs_quota_us ]]; then
+    quota=$(cat /sys/fs/cgroup/cpu/cpu.cfs_quota_us)
+    period=$(cat /sys/fs/cgroup/cpu/cpu.cfs_period_us)
+  fi
+  if [[ "$quota" =~ ^[0-9]+$ && "$period" =~ ^[0-9]+$ && $period -gt 0 ]]; then
+    quota=$(( (quota + period - 1) / period ))
+    (( quota < cpus )) && cpus=$quota
+  fi
+  echo "$cpus"
+}
+
+# "6G", "6144M", "512m" -> MiB
+size_mb() {
+  local value=${1^^}
+  case "$value" in
+    *G) echo $(( ${value%G} * 1024 )) ;;
+    *M) echo "${value%M}" ;;
+    *) echo "$value" ;;
+  esac
+}
+
+# Sets JVM_FLAGS from HT_JVM_PROFILE (small|medium|large|auto) and the container limits.
+# Profiles give the heap share of the memory budget, a heap cap, the initial heap
+# (as a fraction of the max) and the GC; the rest of the budget is left for
+# metaspace, thread stacks and direct buffers.
+# Without a cgroup limit or HT_JVM_MEMORY the host's memory is shared with every other
+# instance, so the budget is capped at NO_LIMIT_BUDGET_MB (about the old fixed 10G heap
+# or less) and the heap is neither committed up front (Xms = Xmx) nor pre-touched.
+NO_LIMIT_BUDGET_MB=12288
+
+jvm_sizing() {
+  local profile=$1 memory source cpus percent cap xms_div reserve heap xms gc limited=1 host
+  memory=$(cgroup_memory_mb)
+  source="cgroup limit"
+  if [[ -n "${HT_JVM_MEMORY:-}" ]]; then
+    memory=$(size_mb "$HT_JVM_MEMORY")
+    source="HT_JVM_MEMORY"
+  elif [[ -z "$memory" ]]; then
+    limited=0
+    host=$(awk '/^MemTotal:/ { print int($2 / 1024) }' /proc/meminfo)
+    memory=$(( host < NO_LIMIT_BUDGET_MB ? host : NO_LIMIT_BUDGET_MB ))
+    source="no container limit; host $host MiB capped at $NO_LIMIT_BUDGET_MB, Xms=Xmx and pre-touch off; set mem_limit or HT_JVM_MEMORY"
+  fi
+  cpus=$(cgroup_cpus)
+
+  if [[ "$profile" == "auto" ]]; then
+    if (( memory < 4096 )); then
+      profile=small
+    elif (( memory < 12288 )); then
+      profile=medium
+    else
+      profile=large
+    fi
+    JVM_PROFILE="$profile (auto)"
+  else
+    JVM_PROFILE=$profile
+  fi
+
+  case "$profile" in
+    small) percent=60 cap=3072 xms_div=4 reserve=512 ;;
+    medium) percent=70 cap=8192 xms_div=2 reserve=768 ;;
+    large) percent=75 cap=31744 xms_div=1 reserve=1024 ;;
+    *)
+      echo "Unknown HT_JVM_PROFILE: $profile (use small, medium, large, auto or legacy)." >&2
+      return 1
+      ;;
+  esac
+  heap=$(( memory * percent / 100 ))
+  (( heap > memory - reserve )) && heap=$(( memory - reserve ))
+  (( heap > cap )) && heap=$cap
+  (( heap < 512 )) && heap=512
+  xms=$(( heap / xms_div ))
+  if (( ! limited && xms_div < 4 )); then
+    xms=$(( heap / 4 ))
+  fi
+
+  if [[ "$profile" == "small" && $cpus -le 1 ]]; then
+    gc="-XX:+UseSerialGC"
+  elif [[ "$profile" == "large" && $heap -ge 16384 ]]; then
+    gc="-XX:+UseZGC -XX:ConcGCThreads=$(( (cpus + 3) / 4 ))"
+  else
+    gc="-XX:+UseG1GC -XX:MaxGCPauseMillis=100 -XX:ParallelGCThreads=$cpus -XX:ConcGCThreads=$(( (cpus + 3) / 4 ))"
+    [[ "$profile" == "small" ]] && gc="-XX:+UseG1GC -XX:ParallelGCThreads=$(( cpus < 2 ? cpus : 2 )) -XX:ConcGCThreads=1"
+  fi
+  JVM_FLAGS="-Xms${xms}m -Xmx${heap}m $gc -XX:ActiveProcessorCount=$cpus"
+  if [[ "$profile" == "large" && $limited -eq 1 ]]; then
+    JVM_FLAGS+=" -XX:+AlwaysPreTouch"
+  fi
+  JVM_SOURCE="$memory MiB ($source), $cpus CPUs"
+}
+
+if [[ -n "${HT_JAVA_OPTS:-}" && -z "${HT_JVM_PROFILE:-}" ]]; then
   export JAVA_TOOL_OPTIONS="${JAVA_TOOL_OPTIONS:-} ${HT_JAVA_OPTS}"
+elif [[ "${HT_JVM_PROFILE:-}" == "legacy" ]]; then
+  export JAVA_TOOL_OPTIONS="${JAVA_TOOL_OPTIONS:-} -Xms10G -Xmx10G ${HT_JAVA_OPTS:-}"
 else
-  export JAVA_TOOL_OPTIONS="${JAVA_TOOL_OPTIONS:-} -Xms10G -Xmx10G"
+  jvm_sizing "${HT_JVM_PROFILE:-auto}" || exit 1
+  echo "JVM sizing: profile $JVM_PROFILE, $JVM_SOURCE -> $JVM_FLAGS${HT_JAVA_OPTS:+ (+ HT_JAVA_OPTS: $HT_JAVA_OPTS)}"
+  # HT_JAVA_OPTS comes last, so its flags override the computed ones.
+  export JAVA_TOOL_OPTIONS="${JAVA_TOOL_OPTIONS:-} $JVM_FLAGS ${HT_JAVA_OPTS:-}"
 fi
 
 if [[ ! -d /opt/hytale/server ]]; then
@@ -14,6 +130,53 @@ if [[ ! -d /opt/hytale/server ]]; then
   exit 1
 fi
 
+# Class-data sharing: the JVM dumps the classes it loaded into a dynamic CDS
+# archive when it exits cleanly and maps that archive on later starts. The
+# archive lives in data/cds, named after the server jar's hash, so a new build
+# gets a fresh one and the old file is removed.
+cds_flags() {
+  local dir=/opt/hytale/data/cds jar stamp key archive old
+  CDS_FLAGS=""
+  jar=${HT_SERVER_JAR:-}
+  if [[ -z "$jar" ]]; then
+    jar=$(find /opt/hytale/server -maxdepth 3 -name HytaleServer.jar -print -quit 2>/dev/null || true)
+  fi
+  if [[ -z "$jar" ]]; then
+    jar=$(find /opt/hytale/server -maxdepth 3 -name '*.jar' -printf '%s %p\n' 2>/dev/null | sort -rn | head -n1 | cut -d' ' -f2- || true)
+  fi
+  if [[ -z "$jar" || ! -f "$jar" ]]; then
+    echo "CDS: no server jar found under /opt/hytale/server; skipped (set HT_SERVER_JAR)."
+    return 0
+  fi
+  mkdir -p "$dir"
+  # Hashing a large jar takes a moment; reuse the last hash while the file is unchanged.
+  stamp="$jar $(stat -L -c '%s %Y %i' "$jar")"
+  if [[ -f "$dir/jar.key" && "$(sed -n 1p "$dir/jar.key")" == "$stamp" ]]; then
+    key=$(sed -n 2p "$dir/jar.key")
+  else
+    key=$(sha256sum "$jar" | cut -c1-16)
+    printf '%s\n%s\n' "$stamp" "$key" > "$dir/jar.key"
+  fi
+  archive="$dir/server-$key.jsa"
+  for old in "$dir"/server-*.jsa; do
+    if [[ -e "$old" && "$old" != "$archive" ]]; then rm -f "$old"; fi
+  done
+  if [[ -f "$archive" ]]; then
+    echo "CDS: using $archive ($(du -m "$archive" | cut -f1) MiB)"
+  else
+    echo "CDS: no archive for this server build yet; it is written at the next clean shutdown ($archive)"
+  fi
+  # AutoCreateSharedArchive (JDK 19+) also regenerates the archive if the JVM rejects it.
+  CDS_FLAGS="-XX:SharedArchiveFile=$archive -XX:+AutoCreateSharedArchive"
+}
+
+if [[ "${HT_CDS:-1}" != "0" ]]; then
+  cds_flags
+  if [[ -n "$CDS_FLAGS" ]]; then
+    export JAVA_TOOL_OPTIONS="$CDS_FLAGS ${JAVA_TOOL_OPTIONS:-}"
+  fi
+fi
+
 if [[ -n "${HT_SERVER_CMD:-}" ]]; then
   echo "Starting with HT_SERVER_CMD: $HT_SERVER_CMD"
   exec bash -lc "$HT_SERVER_CMD"
@@ -1,19 +1,38 @@
-﻿import sys
+﻿import json
+import os
+import shutil
+import sys
 import subprocess
-from dataclasses import dataclass
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
-from PyQt6.QtCore import Qt, QObject, QRunnable, QThreadPool, QUrl, pyqtSignal
+from PyQt6.QtCore import (
+    QAbstractTableModel,
+    QModelIndex,
+    QObject,
+    QRunnable,
+    QSortFilterProxyModel,
+    Qt,
+    QThreadPool,
+    QTimer,
+    QUrl,
+    pyqtSignal,
+)
 from PyQt6.QtGui import QDesktopServices, QFont
 from PyQt6.QtWidgets import (
     QApplication,
+    QComboBox,
     QDialog,
     QFormLayout,
     QGridLayout,
     QGroupBox,
     QHBoxLayout,
+    QHeaderView,
     QLabel,
     QLineEdit,
     QMainWindow,
@@ -21,12 +40,49 @@ from PyQt6.QtWidgets import (
     QPushButton,
     QPlainTextEdit,
     QSpinBox,
-    QTableWidget,
-    QTableWidgetItem,
+    QTableView,
     QVBoxLayout,
     QWidget,
 )
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+import capacity  # noqa: E402
+import console  # noqa: E402
+import docker_api  # noqa: E402
+import log_index  # noqa: E402
+import metrics  # noqa: E402
+import registry  # noqa: E402
+import tracing  # noqa: E402
+
+
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+
+# Live log viewer: lines kept per window, initial backlog, and UI flush rate.
+LOG_MAX_LINES = 5000
+LOG_TAIL_LINES = 200
+LOG_FRAME_MS = 50
+
+# Resource sparklines in the instance table: samples shown and refresh rate.
+SPARK_POINTS = 30
+METRICS_REFRESH_MS = 2000
+
+# Instance table columns, and how long row insertions settle before columns are resized.
+COLUMNS = ["Instance", "Container", "Status", "Port", "Image", "CPU", "Memory"]
+COL_NAME, COL_CONTAINER, COL_STATUS, COL_PORT, COL_IMAGE, COL_CPU, COL_MEM = range(len(COLUMNS))
+COLUMN_RESIZE_MS = 200
+
+# docker events actions that change the container state, and the state they lead to.
+EVENT_STATES = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+    "destroy": "not found",
+}
+
 
 @dataclass
 class InstanceInfo:
@@ -36,21 +92,7 @@ class InstanceInfo:
     host_port: str
     image: str
     server_cmd: str
-
-
-def parse_env_file(path: Path) -> Dict[str, str]:
-    data: Dict[str, str] = {}
-    if not path.exists():
-        return data
-    for line in path.read_text(encoding="utf-8").splitlines():
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if "=" not in line:
-            continue
-        key, value = line.split("=", 1)
-        data[key.strip()] = value.strip()
-    return data
+    project: str = ""
 
 
 def run_command(args: List[str], cwd: Optional[Path] = None) -> subprocess.CompletedProcess:
@@ -64,6 +106,13 @@ def run_command(args: List[str], cwd: Optional[Path] = None) -> subprocess.Compl
 
 
 def docker_available() -> bool:
+    client = docker_api.default_client(timeout=5.0)
+    if client is not None:
+        try:
+            if client.ping():
+                return True
+        finally:
+            client.close()
     try:
         result = run_command(["docker", "version", "--format", "{{.Server.Version}}"])
         return result.returncode == 0
@@ -71,22 +120,187 @@ def docker_available() -> bool:
         return False
 
 
-def docker_status(container_name: str) -> str:
-    if not container_name:
-        return "unknown"
-    try:
-        result = run_command(["docker", "inspect", "-f", "{{.State.Status}}", container_name])
-    except FileNotFoundError:
-        return "docker missing"
-    if result.returncode != 0:
-        return "not found"
-    return result.stdout.strip() or "unknown"
+class StatusEngine(QObject):
+    """Container state cache fed by one bulk container list and a single events stream.
+
+    Both go through the Engine API socket when it is usable (the `docker` CLI otherwise).
+    Lookups never touch Docker; all Docker traffic happens on a background thread.
+    """
+
+    snapshot_ready = pyqtSignal()
+    status_changed = pyqtSignal(str, str)
+
+    RETRY_SECONDS = 5.0
+
+    def __init__(self, parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._by_name: Dict[str, str] = {}
+        self._by_project: Dict[str, str] = {}
+        self._error = "unknown"
+        self._ready = False
+        self._stopping = threading.Event()
+        self._process: Optional[subprocess.Popen] = None
+        self._client = docker_api.default_client()
+        self._stream: Optional[docker_api.DockerStream] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="docker-status", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        process = self._process
+        if process is not None and process.poll() is None:
+            process.terminate()
+        stream = self._stream
+        if stream is not None:
+            stream.close()
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._ready
+
+    def status_for(self, instance: InstanceInfo) -> str:
+        with self._lock:
+            if self._error:
+                return self._error
+            if instance.container_name:
+                return self._by_name.get(instance.container_name, "not found")
+            return self._by_project.get(instance.project, "not found")
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            since = str(int(time.time()))
+            try:
+                self._load_snapshot()
+                self._follow_events(since)
+            except FileNotFoundError:
+                self._set_error("docker missing")
+            except (OSError, RuntimeError, docker_api.DockerError):
+                self._set_error("unknown")
+            self._stopping.wait(self.RETRY_SECONDS)
+
+    def _set_error(self, error: str) -> None:
+        with self._lock:
+            self._error = error
+            self._ready = True
+        self.snapshot_ready.emit()
+
+    def _load_snapshot(self) -> None:
+        if self._client is not None:
+            rows = [
+                (
+                    (container.get("Names") or ["/"])[0].lstrip("/"),
+                    container.get("State", ""),
+                    (container.get("Labels") or {}).get(COMPOSE_PROJECT_LABEL, ""),
+                )
+                for container in self._client.containers(all=True)
+            ]
+        else:
+            rows = self._list_with_cli()
+        by_name: Dict[str, str] = {}
+        by_project: Dict[str, str] = {}
+        for name, state, project in rows:
+            by_name[name] = state
+            if project:
+                by_project[project] = state
+        with self._lock:
+            self._by_name = by_name
+            self._by_project = by_project
+            self._error = ""
+            self._ready = True
+        self.snapshot_ready.emit()
+
+    def _list_with_cli(self) -> List[Tuple[str, str, str]]:
+        result = run_command([
+            "docker",
+            "ps",
+            "-a",
+            "--format",
+            '{{.Names}}\t{{.State}}\t{{.Label "%s"}}' % COMPOSE_PROJECT_LABEL,
+        ])
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip())
+        rows: List[Tuple[str, str, str]] = []
+        for line in result.stdout.splitlines():
+            parts = line.split("\t")
+            if len(parts) >= 3:
+                rows.append((parts[0], parts[1], parts[2]))
+        return rows
+
+    def _follow_events(self, since: str) -> None:
+        if self._client is not None:
+            self._stream = self._client.events(since=since, filters={"type": ["container"]})
+            try:
+                for line in self._stream:
+                    if self._stopping.is_set():
+                        break
+                    self._apply_event(line)
+            finally:
+                self._stream.close()
+                self._stream = None
+            return
+        self._process = subprocess.Popen(
+            [
+                "docker",
+                "events",
+                "--since",
+                since,
+                "--filter",
+                "type=container",
+                "--format",
+                "{{json .}}",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        try:
+            assert self._process.stdout is not None
+            for line in self._process.stdout:
+                if self._stopping.is_set():
+                    break
+                self._apply_event(line)
+        finally:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.wait()
+            self._process = None
+
+    def _apply_event(self, line: str) -> None:
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            return
+        action = str(event.get("Action") or event.get("status") or "")
+        state = EVENT_STATES.get(action)
+        if state is None:
+            return
+        attributes = (event.get("Actor") or {}).get("Attributes") or {}
+        name = attributes.get("name", "")
+        project = attributes.get(COMPOSE_PROJECT_LABEL, "")
+        with self._lock:
+            if name:
+                self._by_name[name] = state
+            if project:
+                self._by_project[project] = state
+        self.status_changed.emit(name, project)
 
 
 class WorkerSignals(QObject):
     finished = pyqtSignal(int, str, str)
 
 
+class TaskSignals(QObject):
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+
+
 class CommandWorker(QRunnable):
     def __init__(self, args: List[str], cwd: Optional[Path] = None) -> None:
         super().__init__()
@@ -96,12 +310,295 @@ class CommandWorker(QRunnable):
 
     def run(self) -> None:
         try:
-            result = run_command(self.args, self.cwd)
+            label = " ".join(Path(arg).name if "/" in arg else arg for arg in self.args[:3])
+            with tracing.span(f"gui {label}", cat="gui", detail=" ".join(self.args)[:300]) as span_args:
+                result = run_command(self.args, self.cwd)
+                span_args["rc"] = result.returncode
             self.signals.finished.emit(result.returncode, result.stdout, result.stderr)
         except FileNotFoundError as exc:
             self.signals.finished.emit(1, "", str(exc))
 
 
+class TaskWorker(QRunnable):
+    def __init__(self, func: Callable[[], Any]) -> None:
+        super().__init__()
+        self.func = func
+        self.signals = TaskSignals()
+
+    def run(self) -> None:
+        # An exception escaping a QRunnable aborts the application, so report it instead.
+        try:
+            result = self.func()
+        except Exception as exc:
+            name = getattr(self.func, "__name__", "task")
+            self.signals.error.emit(f"{name} failed: {exc}")
+            return
+        self.signals.result.emit(result)
+
+
+class LogStream:
+    """Follows the instance's container log on a background thread into a bounded buffer.
+
+    Uses an Engine API logs stream when the socket is usable, else `docker compose logs -f`.
+
+    The reader never touches Qt; the viewer drains pending lines on its own timer, so a
+    chatty server costs at most `max_lines` of memory no matter how far the UI falls behind.
+    """
+
+    def __init__(self, cwd: Path, max_lines: int = LOG_MAX_LINES, tail: int = LOG_TAIL_LINES) -> None:
+        self.cwd = cwd
+        self.tail = tail
+        self.dropped = 0
+        self.exit_code: Optional[int] = None
+        self._pending: Deque[str] = deque(maxlen=max_lines)
+        self._lock = threading.Lock()
+        self._process: Optional[subprocess.Popen] = None
+        self._stream: Optional[docker_api.DockerStream] = None
+        self._thread: Optional[threading.Thread] = None
+        # Guards _stopped/_process/_stream: stop() may run before the thread has opened either.
+        self._handle_lock = threading.Lock()
+        self._stopped = False
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f"logs-{self.cwd.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._handle_lock:
+            self._stopped = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+            if self._stream is not None:
+                self._stream.close()
+
+    def _attach(self, stream: Optional[docker_api.DockerStream] = None,
+                process: Optional[subprocess.Popen] = None) -> bool:
+        """Publishes the opened stream/process for stop(); closes it and returns False if already stopped."""
+        with self._handle_lock:
+            if self._stopped:
+                if stream is not None:
+                    stream.close()
+                if process is not None:
+                    process.terminate()
+                return False
+            self._stream = stream
+            self._process = process
+            return True
+
+    def drain(self) -> List[str]:
+        with self._lock:
+            lines = list(self._pending)
+            self._pending.clear()
+        return lines
+
+    def _run(self) -> None:
+        client = docker_api.default_client()
+        if client is not None:
+            try:
+                container = docker_api.instance_container(client, self.cwd)
+                if not container:
+                    raise docker_api.DockerError("Container not found")
+                stream = client.logs(container, follow=True, tail=self.tail)
+                if self._attach(stream=stream):
+                    for line in stream:
+                        self._push(line)
+                self.exit_code = 0
+            except (OSError, docker_api.DockerError) as exc:
+                self._push(str(exc))
+                self.exit_code = 1
+            finally:
+                client.close()
+            return
+        args = ["docker", "compose", "logs", "-f", "--no-color", "--tail", str(self.tail)]
+        try:
+            process = subprocess.Popen(
+                args,
+                cwd=str(self.cwd),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors="replace",
+            )
+        except FileNotFoundError as exc:
+            self._push(str(exc))
+            self.exit_code = 1
+            return
+        if self._attach(process=process):
+            assert process.stdout is not None
+            for line in process.stdout:
+                self._push(line.rstrip("\n"))
+        self.exit_code = process.wait()
+
+    def _push(self, line: str) -> None:
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.dropped += 1
+            self._pending.append(line)
+
+
+class LogViewerWindow(QWidget):
+    def __init__(self, instance: InstanceInfo) -> None:
+        super().__init__()
+        self.instance = instance
+        self.setWindowTitle(f"Logs - {instance.name}")
+        self.resize(900, 560)
+
+        self.view = QPlainTextEdit()
+        self.view.setReadOnly(True)
+        self.view.setFont(QFont("Consolas", 9))
+        self.view.setMaximumBlockCount(LOG_MAX_LINES)
+
+        self.status_label = QLabel("")
+        self.pause_btn = QPushButton("Pause")
+        self.pause_btn.setCheckable(True)
+        self.clear_btn = QPushButton("Clear")
+        self.clear_btn.clicked.connect(self.view.clear)
+
+        btn_row = QHBoxLayout()
+        btn_row.addWidget(self.status_label)
+        btn_row.addStretch(1)
+        btn_row.addWidget(self.pause_btn)
+        btn_row.addWidget(self.clear_btn)
+
+        # Commands go through the instance's persistent console session; their output
+        # shows up in the log stream above.
+        self.command_input = QLineEdit()
+        self.command_input.setPlaceholderText("Console command, e.g. /help")
+        self.command_input.returnPressed.connect(self.send_command)
+        self.command_status = QLabel("")
+        command_row = QHBoxLayout()
+        command_row.addWidget(self.command_input, 1)
+        command_row.addWidget(self.command_status)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.view)
+        layout.addLayout(command_row)
+        layout.addLayout(btn_row)
+        self.setLayout(layout)
+
+        self.stream = LogStream(instance.path)
+        self.stream.start()
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flush)
+        self.timer.start(LOG_FRAME_MS)
+
+    def flush(self) -> None:
+        if self.pause_btn.isChecked():
+            return
+        lines = self.stream.drain()
+        if lines:
+            self.view.appendPlainText("\n".join(lines))
+        status = f"{self.view.blockCount()} lines"
+        if self.stream.dropped:
+            status += f", {self.stream.dropped} dropped"
+        if self.stream.exit_code is not None:
+            status += f" (stream ended, code {self.stream.exit_code})"
+            if not lines:
+                self.timer.stop()
+        self.status_label.setText(status)
+
+    def send_command(self) -> None:
+        command = self.command_input.text().strip()
+        if not command:
+            return
+        self.command_input.clear()
+        instance_dir = self.instance.path
+
+        def task() -> Any:
+            started = time.perf_counter()
+            try:
+                console.send(instance_dir, [command], wait=False)
+            except (console.ConsoleError, OSError) as exc:
+                return f"{command}: {exc}"
+            return f"{command}: sent in {(time.perf_counter() - started) * 1000:.0f} ms"
+
+        worker = TaskWorker(task)
+        worker.signals.result.connect(self.command_status.setText)
+        QThreadPool.globalInstance().start(worker)
+
+    def closeEvent(self, event) -> None:
+        self.timer.stop()
+        self.stream.stop()
+        super().closeEvent(event)
+
+
+class LogSearchWindow(QWidget):
+    def __init__(self, instance: InstanceInfo, thread_pool: QThreadPool) -> None:
+        super().__init__()
+        self.instance = instance
+        self.thread_pool = thread_pool
+        self.setWindowTitle(f"Search Logs - {instance.name}")
+        self.resize(900, 560)
+
+        self.query = QLineEdit()
+        self.query.setPlaceholderText("keywords (all must match)")
+        self.query.returnPressed.connect(self.search)
+        self.level = QComboBox()
+        self.level.addItems(["Any", "DEBUG", "INFO", "WARN", "ERROR"])
+        self.since = QLineEdit()
+        self.since.setPlaceholderText("e.g. 2h or 2026-01-31 18:00")
+        self.since.returnPressed.connect(self.search)
+        self.limit = QSpinBox()
+        self.limit.setRange(1, 100000)
+        self.limit.setValue(500)
+        self.search_btn = QPushButton("Search")
+        self.search_btn.clicked.connect(self.search)
+
+        form = QHBoxLayout()
+        form.addWidget(self.query, 3)
+        form.addWidget(QLabel("Level"))
+        form.addWidget(self.level)
+        form.addWidget(QLabel("Since"))
+        form.addWidget(self.since, 1)
+        form.addWidget(QLabel("Limit"))
+        form.addWidget(self.limit)
+        form.addWidget(self.search_btn)
+
+        self.results = QPlainTextEdit()
+        self.results.setReadOnly(True)
+        self.results.setFont(QFont("Consolas", 9))
+        self.summary = QLabel("")
+
+        layout = QVBoxLayout()
+        layout.addLayout(form)
+        layout.addWidget(self.results)
+        layout.addWidget(self.summary)
+        self.setLayout(layout)
+
+    def search(self) -> None:
+        level = self.level.currentText()
+        args = {
+            "grep": self.query.text(),
+            "level": "" if level == "Any" else level,
+            "since": self.since.text(),
+            "limit": self.limit.value(),
+        }
+        instance_dir = self.instance.path
+
+        def task() -> Any:
+            started = time.perf_counter()
+            try:
+                records = log_index.search_instance(instance_dir, **args)
+            except Exception as exc:  # reported in the window instead of killing the worker
+                return [], str(exc), 0.0
+            return records, "", (time.perf_counter() - started) * 1000
+
+        self.search_btn.setEnabled(False)
+        self.summary.setText("Searching...")
+        worker = TaskWorker(task)
+        worker.signals.result.connect(self.on_results)
+        self.thread_pool.start(worker)
+
+    def on_results(self, result: Any) -> None:
+        records, error, elapsed_ms = result
+        self.search_btn.setEnabled(True)
+        if error:
+            self.summary.setText(error)
+            return
+        self.results.setPlainText("\n".join(record.format() for record in records))
+        self.summary.setText(f"{len(records)} results in {elapsed_ms:.0f} ms (index update included)")
+
+
 class CreateInstanceDialog(QDialog):
     def __init__(self, parent: QWidget) -> None:
         super().__init__(parent)
@@ -115,6 +612,10 @@ class CreateInstanceDialog(QDialog):
         self.server_url = QLineEdit("")
         self.server_sha = QLineEdit("")
         self.server_cmd = QLineEdit("")
+        self.cpu_cores = QSpinBox()
+        self.cpu_cores.setRange(1, 256)
+        self.cpu_cores.setValue(capacity.DEFAULT_CORES)
+        self.memory_limit = QLineEdit(f"{capacity.DEFAULT_MEMORY_MB // 1024}G")
 
         form = QFormLayout()
         form.addRow("Base name", self.base_name)
@@ -122,6 +623,8 @@ class CreateInstanceDialog(QDialog):
         form.addRow("Server URL", self.server_url)
         form.addRow("Server SHA256", self.server_sha)
         form.addRow("Server command", self.server_cmd)
+        form.addRow("CPU cores", self.cpu_cores)
+        form.addRow("Memory limit", self.memory_limit)
 
         self.create_btn = QPushButton("Create")
         self.cancel_btn = QPushButton("Cancel")
@@ -150,35 +653,178 @@ class CreateInstanceDialog(QDialog):
             "server_url": self.server_url.text().strip(),
             "server_sha256": self.server_sha.text().strip(),
             "server_cmd": self.server_cmd.text().strip(),
+            "cpu_cores": str(self.cpu_cores.value()),
+            "memory_limit": self.memory_limit.text().strip() or "6G",
         }
 
 
+class InstanceTableModel(QAbstractTableModel):
+    """Instance rows keyed by name; updates touch only the cells whose text changed."""
+
+    SORT_ROLE = Qt.ItemDataRole.UserRole
+
+    def __init__(self, parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self._instances: List[InstanceInfo] = []
+        self._cells: List[List[str]] = []
+        self._rows: Dict[str, int] = {}
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._instances)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section: int, orientation: Qt.Orientation, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole) -> Any:
+        if not index.isValid():
+            return None
+        text = self._cells[index.row()][index.column()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return text
+        if role == self.SORT_ROLE:
+            if index.column() == COL_PORT:
+                return int(text) if text.isdigit() else 1 << 20
+            return text.lower()
+        return None
+
+    def instance(self, row: int) -> Optional[InstanceInfo]:
+        return self._instances[row] if 0 <= row < len(self._instances) else None
+
+    def instances(self) -> List[InstanceInfo]:
+        return list(self._instances)
+
+    def find(self, name: str) -> Optional[InstanceInfo]:
+        row = self._rows.get(name)
+        return None if row is None else self._instances[row]
+
+    def set_instances(self, instances: List[InstanceInfo], status_for: Callable[[InstanceInfo], str]) -> bool:
+        """Replaces the row set in place; returns True when rows were added."""
+        wanted = {instance.name: instance for instance in instances}
+        for row in reversed(range(len(self._instances))):
+            if self._instances[row].name not in wanted:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self._instances[row]
+                del self._cells[row]
+                self.endRemoveRows()
+        self._rows = {instance.name: row for row, instance in enumerate(self._instances)}
+        added = [instance for instance in instances if instance.name not in self._rows]
+        for row, instance in enumerate(self._instances):
+            fresh = wanted[instance.name]
+            self._instances[row] = fresh
+            self._update_row(row, self._static_cells(fresh, status_for(fresh)))
+        if added:
+            first = len(self._instances)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            for instance in added:
+                self._rows[instance.name] = len(self._instances)
+                self._instances.append(instance)
+                self._cells.append(self._static_cells(instance, status_for(instance)) + ["", ""])
+            self.endInsertRows()
+        return bool(added)
+
+    def set_cell(self, name: str, column: int, text: str) -> None:
+        row = self._rows.get(name)
+        if row is not None and self._cells[row][column] != text:
+            self._cells[row][column] = text
+            index = self.index(row, column)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+
+    def _static_cells(self, instance: InstanceInfo, status: str) -> List[str]:
+        return [instance.name, instance.container_name, status, instance.host_port, instance.image]
+
+    def _update_row(self, row: int, cells: List[str]) -> None:
+        changed = [col for col, text in enumerate(cells) if self._cells[row][col] != text]
+        if not changed:
+            return
+        for col in changed:
+            self._cells[row][col] = cells[col]
+        self.dataChanged.emit(self.index(row, min(changed)), self.index(row, max(changed)), [Qt.ItemDataRole.DisplayRole])
+
+
+class InstanceFilterProxy(QSortFilterProxyModel):
+    """Filters on a name/port substring and an exact status; sorts by the model's sort keys."""
+
+    def __init__(self, parent: Optional[QObject] = None) -> None:
+        super().__init__(parent)
+        self.text = ""
+        self.status = ""
+        self.setSortRole(InstanceTableModel.SORT_ROLE)
+        self.setDynamicSortFilter(True)
+
+    def set_filter(self, text: str, status: str) -> None:
+        self.text = text.strip().lower()
+        self.status = status
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row: int, source_parent: QModelIndex) -> bool:
+        model = self.sourceModel()
+        if self.status and model.index(source_row, COL_STATUS, source_parent).data() != self.status:
+            return False
+        if not self.text:
+            return True
+        return any(
+            self.text in str(model.index(source_row, col, source_parent).data()).lower()
+            for col in (COL_NAME, COL_PORT)
+        )
+
+
 class MainWindow(QMainWindow):
-    def __init__(self, root_dir: Path) -> None:
+    def __init__(self, root_dir: Path, started_at: Optional[float] = None) -> None:
         super().__init__()
         self.root_dir = root_dir
         self.instances_dir = self.root_dir / "instances"
         self.templates_dir = self.root_dir / "templates"
+        self.snapshot_path = self.root_dir / ".hsm" / "gui-snapshot.json"
+        # One registry for the process: docker_api and metrics look instances up through it too.
+        self.registry = registry.Registry(self.instances_dir, self.root_dir / ".hsm" / "registry.json")
+        registry.set_default(self.registry)
+        self.started_at = started_at if started_at is not None else time.perf_counter()
         self.thread_pool = QThreadPool.globalInstance()
-        self.instances: List[InstanceInfo] = []
+        self.log_windows: Dict[str, LogViewerWindow] = {}
+        self.search_windows: Dict[str, LogSearchWindow] = {}
+        # Last known statuses from the on-disk snapshot, shown until Docker answers.
+        self.cached_statuses: Dict[str, str] = {}
 
         self.setWindowTitle("Hytale Instance Manager")
         self.resize(980, 620)
 
-        self.table = QTableWidget(0, 5)
-        self.table.setHorizontalHeaderLabels([
-            "Instance",
-            "Container",
-            "Status",
-            "Port",
-            "Image",
-        ])
+        self.model = InstanceTableModel(self)
+        self.proxy = InstanceFilterProxy(self)
+        self.proxy.setSourceModel(self.model)
+        self.table = QTableView()
+        self.table.setModel(self.proxy)
         self.table.verticalHeader().setVisible(False)
-        self.table.setSelectionBehavior(QTableWidget.SelectionBehavior.SelectRows)
-        self.table.setSelectionMode(QTableWidget.SelectionMode.SingleSelection)
-        self.table.setEditTriggers(QTableWidget.EditTrigger.NoEditTriggers)
-        self.table.itemSelectionChanged.connect(self.on_selection_changed)
+        # Fixed row heights and visible-rows-only column sizing keep large fleets cheap.
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.table.horizontalHeader().setResizeContentsPrecision(0)
+        self.table.setSelectionBehavior(QTableView.SelectionBehavior.SelectRows)
+        self.table.setSelectionMode(QTableView.SelectionMode.SingleSelection)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(COL_NAME, Qt.SortOrder.AscendingOrder)
+        self.table.selectionModel().selectionChanged.connect(self.on_selection_changed)
         self.table.horizontalHeader().setStretchLastSection(True)
+        self.column_timer = QTimer(self)
+        self.column_timer.setSingleShot(True)
+        self.column_timer.timeout.connect(self.table.resizeColumnsToContents)
+
+        self.filter_edit = QLineEdit()
+        self.filter_edit.setPlaceholderText("Filter by name or port")
+        self.filter_edit.setClearButtonEnabled(True)
+        self.status_filter = QComboBox()
+        self.status_filter.addItem("All statuses", "")
+        for state in ("running", "exited", "created", "paused", "not found"):
+            self.status_filter.addItem(state, state)
+        self.filter_edit.textChanged.connect(self.apply_filter)
+        self.status_filter.currentIndexChanged.connect(self.apply_filter)
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(self.filter_edit)
+        filter_layout.addWidget(self.status_filter)
 
         self.log_view = QPlainTextEdit()
         self.log_view.setReadOnly(True)
@@ -188,7 +834,8 @@ class MainWindow(QMainWindow):
         self.start_btn = QPushButton("Start")
         self.stop_btn = QPushButton("Stop")
         self.restart_btn = QPushButton("Restart")
-        self.logs_btn = QPushButton("Logs")
+        self.logs_btn = QPushButton("Logs / Console")
+        self.search_btn = QPushButton("Search Logs")
         self.open_btn = QPushButton("Open Folder")
         self.create_btn = QPushButton("Create Instance")
 
@@ -197,6 +844,7 @@ class MainWindow(QMainWindow):
         self.stop_btn.clicked.connect(lambda: self.run_compose_action("stop"))
         self.restart_btn.clicked.connect(lambda: self.run_compose_action("restart"))
         self.logs_btn.clicked.connect(self.fetch_logs)
+        self.search_btn.clicked.connect(self.open_log_search)
         self.open_btn.clicked.connect(self.open_instance_folder)
         self.create_btn.clicked.connect(self.create_instance)
 
@@ -207,11 +855,13 @@ class MainWindow(QMainWindow):
         action_layout.addWidget(self.stop_btn, 0, 2)
         action_layout.addWidget(self.restart_btn, 0, 3)
         action_layout.addWidget(self.logs_btn, 0, 4)
-        action_layout.addWidget(self.open_btn, 0, 5)
-        action_layout.addWidget(self.create_btn, 0, 6)
+        action_layout.addWidget(self.search_btn, 0, 5)
+        action_layout.addWidget(self.open_btn, 0, 6)
+        action_layout.addWidget(self.create_btn, 0, 7)
         action_box.setLayout(action_layout)
 
         layout = QVBoxLayout()
+        layout.addLayout(filter_layout)
         layout.addWidget(self.table)
         layout.addWidget(action_box)
         layout.addWidget(QLabel("Output"))
@@ -221,78 +871,172 @@ class MainWindow(QMainWindow):
         container.setLayout(layout)
         self.setCentralWidget(container)
 
-        self.set_actions_enabled(False)
-        self.refresh_instances()
+        self.status_engine = StatusEngine(self)
+        self.status_engine.snapshot_ready.connect(self.on_status_snapshot)
+        self.status_engine.status_changed.connect(self.on_status_changed)
+        # Stats streams fill ring buffers on background threads; the table only reads them.
+        self.metrics = metrics.Collector(self.instances_dir)
+        self.metrics_timer = QTimer(self)
+        self.metrics_timer.timeout.connect(self.update_metric_cells)
 
-        if not docker_available():
-            QMessageBox.warning(
-                self,
-                "Docker Not Available",
-                "Docker CLI not available or Docker Desktop is not running.",
-            )
+        self.set_actions_enabled(False)
+        snapshot_count = self.load_snapshot()
+        # Runs on the first event loop pass, i.e. once the window has been painted.
+        QTimer.singleShot(0, lambda: self.on_first_paint(snapshot_count))
 
     def set_actions_enabled(self, enabled: bool) -> None:
         self.start_btn.setEnabled(enabled)
         self.stop_btn.setEnabled(enabled)
         self.restart_btn.setEnabled(enabled)
         self.logs_btn.setEnabled(enabled)
+        self.search_btn.setEnabled(enabled)
         self.open_btn.setEnabled(enabled)
 
     def log(self, message: str) -> None:
         self.log_view.appendPlainText(message)
 
-    def refresh_instances(self) -> None:
-        self.instances = self.scan_instances()
-        self.table.setRowCount(len(self.instances))
-        for row, instance in enumerate(self.instances):
-            status = docker_status(instance.container_name)
-            items = [
-                QTableWidgetItem(instance.name),
-                QTableWidgetItem(instance.container_name),
-                QTableWidgetItem(status),
-                QTableWidgetItem(instance.host_port),
-                QTableWidgetItem(instance.image),
-            ]
-            for col, item in enumerate(items):
-                item.setData(Qt.ItemDataRole.UserRole, instance.name)
-                self.table.setItem(row, col, item)
-        self.table.resizeColumnsToContents()
-        self.set_actions_enabled(bool(self.instances))
+    def on_first_paint(self, snapshot_count: int) -> None:
+        elapsed_ms = (time.perf_counter() - self.started_at) * 1000
+        if snapshot_count:
+            self.log(f"Window ready in {elapsed_ms:.0f} ms ({snapshot_count} instances from last snapshot)")
+        else:
+            self.log(f"Window ready in {elapsed_ms:.0f} ms")
+        self.status_engine.start()
+        self.metrics.start()
+        self.metrics_timer.start(METRICS_REFRESH_MS)
+        self.refresh_instances()
+        self.run_task(docker_available, self.on_docker_probe)
 
-    def scan_instances(self) -> List[InstanceInfo]:
+    def run_task(self, func: Callable[[], Any], callback: Callable[[Any], None]) -> None:
+        worker = TaskWorker(func)
+        worker.signals.result.connect(callback)
+        worker.signals.error.connect(self.log)
+        self.thread_pool.start(worker)
+
+    def on_scan_finished(self, instances: List[InstanceInfo]) -> None:
+        self.populate_table(instances)
+        self.save_snapshot()
+
+    def on_docker_probe(self, available: bool) -> None:
+        if not available:
+            QMessageBox.warning(
+                self,
+                "Docker Not Available",
+                "Docker CLI not available or Docker Desktop is not running.",
+            )
+
+    def load_snapshot(self) -> int:
+        try:
+            data = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            return 0
         instances: List[InstanceInfo] = []
-        if not self.instances_dir.exists():
-            return instances
-        for entry in sorted(self.instances_dir.iterdir()):
-            if not entry.is_dir():
-                continue
-            env_path = entry / ".env"
-            env = parse_env_file(env_path)
-            container = env.get("HT_CONTAINER_NAME", "")
-            host_port = env.get("HOST_PORT", "")
-            image = env.get("HT_IMAGE", "")
-            server_cmd = env.get("HT_SERVER_CMD", "")
-            instances.append(
-                InstanceInfo(
-                    name=entry.name,
-                    path=entry,
-                    container_name=container,
-                    host_port=host_port,
-                    image=image,
-                    server_cmd=server_cmd,
+        for entry in data.get("instances", []):
+            try:
+                instance = InstanceInfo(
+                    name=entry["name"],
+                    path=Path(entry["path"]),
+                    container_name=entry["container_name"],
+                    host_port=entry["host_port"],
+                    image=entry["image"],
+                    server_cmd=entry["server_cmd"],
+                    project=entry.get("project", ""),
                 )
+            except (KeyError, TypeError):
+                continue
+            instances.append(instance)
+            self.cached_statuses[instance.name] = entry.get("status", "unknown")
+        self.populate_table(instances)
+        return len(instances)
+
+    def save_snapshot(self) -> None:
+        entries = []
+        for instance in self.model.instances():
+            entry = asdict(instance)
+            entry["path"] = str(instance.path)
+            entry["status"] = self.status_text(instance)
+            entries.append(entry)
+        payload = {"saved_at": datetime.now().isoformat(timespec="seconds"), "instances": entries}
+        try:
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.snapshot_path.with_suffix(".tmp")
+            tmp_path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+            tmp_path.replace(self.snapshot_path)
+        except OSError:
+            pass
+
+    def status_text(self, instance: InstanceInfo) -> str:
+        if self.status_engine.ready:
+            return self.status_engine.status_for(instance)
+        return self.cached_statuses.get(instance.name, "unknown")
+
+    def refresh_instances(self) -> None:
+        self.run_task(self.scan_instances, self.on_scan_finished)
+
+    def populate_table(self, instances: List[InstanceInfo]) -> None:
+        if self.model.set_instances(instances, self.status_text):
+            # Coalesces the inserts of a scan; sizing only measures the visible rows.
+            self.column_timer.start(COLUMN_RESIZE_MS)
+        self.update_metric_cells()
+        self.set_actions_enabled(self.model.rowCount() > 0)
+
+    def apply_filter(self) -> None:
+        self.proxy.set_filter(self.filter_edit.text(), self.status_filter.currentData())
+
+    def on_status_snapshot(self) -> None:
+        self.cached_statuses = {}
+        for instance in self.model.instances():
+            self.set_status_cell(instance)
+        self.save_snapshot()
+
+    def on_status_changed(self, container_name: str, project: str) -> None:
+        for instance in self.model.instances():
+            if instance.container_name:
+                if instance.container_name == container_name:
+                    self.set_status_cell(instance)
+            elif instance.project == project:
+                self.set_status_cell(instance)
+
+    def update_metric_cells(self) -> None:
+        for instance in self.model.instances():
+            recent = self.metrics.recent(instance.name, SPARK_POINTS)
+            if recent is None:
+                self.model.set_cell(instance.name, COL_CPU, "-")
+                self.model.set_cell(instance.name, COL_MEM, "-")
+                continue
+            cpu, mem, mem_limit = recent
+            self.model.set_cell(
+                instance.name, COL_CPU, f"{metrics.sparkline(cpu, SPARK_POINTS, max(100.0, *cpu))} {cpu[-1]:.0f}%"
+            )
+            self.model.set_cell(
+                instance.name,
+                COL_MEM,
+                f"{metrics.sparkline(mem, SPARK_POINTS, mem_limit or None)} {metrics.human_bytes(mem[-1])}",
             )
-        return instances
+
+    def set_status_cell(self, instance: InstanceInfo) -> None:
+        self.model.set_cell(instance.name, COL_STATUS, self.status_text(instance))
+
+    def scan_instances(self) -> List[InstanceInfo]:
+        # Only instances whose .env/compose/server files changed since the last scan are re-parsed.
+        return [
+            InstanceInfo(
+                name=entry.name,
+                path=Path(entry.path),
+                container_name=entry.container_name,
+                host_port=entry.port,
+                image=entry.image,
+                server_cmd=entry.env.get("HT_SERVER_CMD", ""),
+                project=entry.project,
+            )
+            for entry in self.registry.refresh()
+        ]
 
     def selected_instance(self) -> Optional[InstanceInfo]:
-        selected = self.table.selectedItems()
-        if not selected:
+        rows = self.table.selectionModel().selectedRows()
+        if not rows:
             return None
-        name = selected[0].data(Qt.ItemDataRole.UserRole)
-        for instance in self.instances:
-            if instance.name == name:
-                return instance
-        return None
+        return self.model.instance(self.proxy.mapToSource(rows[0]).row())
 
     def on_selection_changed(self) -> None:
         self.set_actions_enabled(self.selected_instance() is not None)
@@ -312,8 +1056,31 @@ class MainWindow(QMainWindow):
         instance = self.selected_instance()
         if not instance:
             return
-        cmd = ["docker", "compose", "logs", "--tail", "200"]
-        self.run_command_async(cmd, instance.path)
+        window = self.log_windows.get(instance.name)
+        if window is None or not window.isVisible():
+            window = LogViewerWindow(instance)
+            window.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+            window.destroyed.connect(lambda _=None, name=instance.name, closed=window: self.forget_log_window(name, closed))
+            self.log_windows[instance.name] = window
+            window.show()
+        window.raise_()
+        window.activateWindow()
+
+    def open_log_search(self) -> None:
+        instance = self.selected_instance()
+        if not instance:
+            return
+        window = self.search_windows.get(instance.name)
+        if window is None:
+            window = LogSearchWindow(instance, self.thread_pool)
+            self.search_windows[instance.name] = window
+        window.show()
+        window.raise_()
+        window.activateWindow()
+
+    def forget_log_window(self, name: str, window: LogViewerWindow) -> None:
+        if self.log_windows.get(name) is window:
+            del self.log_windows[name]
 
     def run_command_async(self, args: List[str], cwd: Path) -> None:
         self.log(f"> {' '.join(args)} ({cwd})")
@@ -371,15 +1138,61 @@ class MainWindow(QMainWindow):
         (instance_dir / ".env").write_text(template_env, encoding="utf-8")
         compose_dst = instance_dir / "docker-compose.yml"
         compose_dst.write_text(template_compose_path.read_text(encoding="utf-8"), encoding="utf-8")
+        if not self.allocate_capacity(instance_dir, values):
+            shutil.rmtree(instance_dir, ignore_errors=True)
+            self.log(f"Instance not created: {values['instance_name']}")
+            return
 
         self.log(f"Created instance: {values['instance_name']}")
         self.refresh_instances()
 
+    def allocate_capacity(self, instance_dir: Path, values: Dict[str, str]) -> bool:
+        """Pins the new instance to free cores and sets its memory limit; False if cancelled."""
+        try:
+            cores = int(values["cpu_cores"])
+            memory_mb = capacity.parse_size_mb(values["memory_limit"])
+            result = capacity.allocate(instance_dir, cores=cores, memory_mb=memory_mb)
+            if result.refused:
+                answer = QMessageBox.question(
+                    self,
+                    "Host Overcommitted",
+                    "\n".join(result.warnings) + "\n\nCreate the instance anyway?",
+                )
+                if answer != QMessageBox.StandardButton.Yes:
+                    return False
+                result = capacity.allocate(instance_dir, cores=cores, memory_mb=memory_mb, force=True)
+        except capacity.CapacityError as exc:
+            QMessageBox.warning(self, "Capacity", str(exc))
+            return False
+        for warning in result.warnings:
+            self.log(f"Capacity warning: {warning}")
+        self.log(
+            f"Assigned cpuset {capacity.format_cpuset(result.cpuset)}, "
+            f"{result.memory_mb} MiB to {instance_dir.name}"
+        )
+        return True
+
+    def closeEvent(self, event) -> None:
+        self.status_engine.stop()
+        self.metrics_timer.stop()
+        self.metrics.stop()
+        for window in list(self.log_windows.values()):
+            window.close()
+        for search_window in self.search_windows.values():
+            search_window.close()
+        self.save_snapshot()
+        super().closeEvent(event)
+
 
 def main() -> None:
+    started_at = time.perf_counter()
     root_dir = Path(__file__).resolve().parents[1]
+    if "--trace" in sys.argv:
+        sys.argv.remove("--trace")
+        os.environ["HSM_TRACE"] = "1"
+    tracing.start("gui")
     app = QApplication(sys.argv)
-    window = MainWindow(root_dir)
+    window = MainWindow(root_dir, started_at)
     window.show()
     sys.exit(app.exec())
 
@@ -11,7 +11,7 @@ Usage: ./hsm.sh <command> [args...]
 
 Commands:
   manager <args>    Run scripts/manager.sh (default)
-  gui              Launch instance GUI (PyQt6)
+  gui [--trace]    Launch instance GUI (PyQt6)
   mod-gui          Launch mod tools GUI (PyQt6)
   install-deps     Install local dependencies (Debian/Ubuntu)
   setup            Run scripts/setup.sh
@@ -30,7 +30,7 @@ case "$cmd" in
     "$ROOT_DIR/scripts/manager.sh" "$@"
     ;;
   gui)
-    python3 "$ROOT_DIR/gui/app.py"
+    python3 "$ROOT_DIR/gui/app.py" "$@"
     ;;
   mod-gui)
     python3 "$ROOT_DIR/mod_tools/app.py"
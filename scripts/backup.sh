@@ -2,20 +2,178 @@
 set -euo pipefail
 
 ROOT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)
+. "$ROOT_DIR/scripts/tracing.sh"
+. "$ROOT_DIR/scripts/registry.sh"
 INSTANCE_DIR=${1:-"$(pwd)"}
+shift || true
+MODE=""
+CODEC=""
+LEVEL=""
+THREADS=""
+DATA_FROM=""
+BENCH=0
+SAMPLE_MB=256
+
+usage() {
+  cat <<USAGE
+Usage: ./scripts/backup.sh <instance_dir> [options]
+
+Options:
+  --incremental        Deduplicated chunk-store backup
+  --full               Full tar archive
+  --codec <name>       gzip | zstd | xz for tar archives; zlib | lzma | zstd for the chunk store
+  --level <n>          Compression level for the codec
+  --threads <n>        Compression threads (default: all cores)
+  --data-from <dir>    Archive <dir> as data/ (snapshot taken by a hot backup)
+  --bench [--sample-mb N]
+                       Report MB/s and compression ratio per codec on a sample of the instance
+USAGE
+}
 
 if [[ ! -d "$INSTANCE_DIR" ]]; then
   echo "Instance directory not found: $INSTANCE_DIR" >&2
   exit 1
 fi
 
+while [[ $# -gt 0 ]]; do
+  case "$1" in
+    --incremental) MODE=incremental ;;
+    --full) MODE=tar ;;
+    --codec) CODEC=${2:?--codec needs a value}; shift ;;
+    --level) LEVEL=${2:?--level needs a value}; shift ;;
+    --threads) THREADS=${2:?--threads needs a value}; shift ;;
+    --data-from) DATA_FROM=${2:?--data-from needs a value}; shift ;;
+    --bench) BENCH=1 ;;
+    --sample-mb) SAMPLE_MB=${2:?--sample-mb needs a value}; shift ;;
+    "") ;;
+    -h|--help) usage; exit 0 ;;
+    *)
+      echo "Unknown backup option: $1" >&2
+      usage >&2
+      exit 1
+      ;;
+  esac
+  shift
+done
+
+# Parsed .env (scripts/registry.sh), loaded once.
+load_instance_env "$INSTANCE_DIR"
+env_value() {
+  printf '%s\n' "${INSTANCE_ENV[$1]:-}"
+}
+
+MODE=${MODE:-$(env_value HT_BACKUP_MODE)}
+MODE=${MODE:-tar}
+CODEC=${CODEC:-$(env_value HT_BACKUP_CODEC)}
+LEVEL=${LEVEL:-$(env_value HT_BACKUP_LEVEL)}
+THREADS=${THREADS:-$(env_value HT_BACKUP_THREADS)}
+# Empty unless --threads or HT_BACKUP_THREADS asked for a count.
+THREADS_REQUESTED=$THREADS
+THREADS=${THREADS:-$(nproc 2>/dev/null || echo 1)}
+
+# Prints the compressor command line for a tar codec (multi-threaded where possible).
+compressor_cmd() {
+  local codec=$1 level=$2
+  case "$codec" in
+    gzip)
+      if command -v pigz >/dev/null 2>&1; then
+        echo "pigz -p $THREADS -${level:-6}"
+      else
+        echo "gzip -${level:-6}"
+      fi
+      ;;
+    zstd)
+      command -v zstd >/dev/null 2>&1 || return 1
+      echo "zstd -q -T$THREADS -${level:-3}"
+      ;;
+    xz)
+      command -v xz >/dev/null 2>&1 || return 1
+      echo "xz -T$THREADS -${level:-6}"
+      ;;
+    *)
+      return 1
+      ;;
+  esac
+}
+
+codec_ext() {
+  case "$1" in
+    gzip) echo "tar.gz" ;;
+    zstd) echo "tar.zst" ;;
+    xz) echo "tar.xz" ;;
+  esac
+}
+
+now_ns() {
+  date +%s%N
+}
+
 BACKUP_DIR="$ROOT_DIR/backups"
 mkdir -p "$BACKUP_DIR"
+trace_init "backup.sh ${INSTANCE_DIR##*/}"
+
+if [[ $BENCH -eq 1 ]]; then
+  sample_bytes=$((SAMPLE_MB * 1024 * 1024))
+  echo "Benchmarking on up to ${SAMPLE_MB} MiB of $(basename "$INSTANCE_DIR") with $THREADS threads"
+  in_file=$(mktemp)
+  trace_trap_exit 'rm -f "$in_file"'
+  { tar -cf - -C "$INSTANCE_DIR" . 2>/dev/null || true; } | head -c "$sample_bytes" > "$in_file"
+  in_bytes=$(stat -c %s "$in_file")
+  printf "%-28s %10s %10s %8s\n" "TAR CODEC" "IN MiB" "MB/s" "RATIO"
+  for spec in "gzip 1" "gzip 6" "zstd 1" "zstd 3" "zstd 9" "xz 1" "xz 6"; do
+    read -r codec level <<<"$spec"
+    if ! cmd=$(compressor_cmd "$codec" "$level"); then
+      printf "%-28s %s\n" "$codec -$level" "(not installed)"
+      continue
+    fi
+    start=$(now_ns)
+    out_bytes=$($cmd < "$in_file" | wc -c)
+    elapsed_ns=$(( $(now_ns) - start ))
+    awk -v name="${cmd%% *} -$level" -v in_b="$in_bytes" -v out_b="$out_bytes" -v ns="$elapsed_ns" 'BEGIN {
+      secs = ns / 1e9; if (secs <= 0) secs = 1e-9
+      printf "%-28s %10.1f %10.1f %8.2f\n", name, in_b / 1048576, in_b / 1e6 / secs, (out_b > 0 ? in_b / out_b : 0)
+    }'
+  done
+  if [[ "$THREADS" -gt 1 ]] && ! command -v pigz >/dev/null 2>&1; then
+    echo "gzip ran on a single core; install pigz for parallel gzip."
+  fi
+  echo
+  python3 "$ROOT_DIR/scripts/chunk_store.py" bench "$INSTANCE_DIR" --sample-mb "$SAMPLE_MB" --threads "$THREADS"
+  exit 0
+fi
+
+if [[ "$MODE" == "incremental" ]]; then
+  chunk_args=(--backup-dir "$BACKUP_DIR" backup "$INSTANCE_DIR" --threads "$THREADS")
+  [[ -n "$CODEC" ]] && chunk_args+=(--codec "$CODEC")
+  [[ -n "$LEVEL" ]] && chunk_args+=(--level "$LEVEL")
+  [[ -n "$DATA_FROM" ]] && chunk_args+=(--data-from "$DATA_FROM")
+  traced python3 "$ROOT_DIR/scripts/chunk_store.py" "${chunk_args[@]}"
+  exit 0
+fi
+
+CODEC=${CODEC:-gzip}
+if ! COMPRESSOR=$(compressor_cmd "$CODEC" "$LEVEL"); then
+  echo "Codec '$CODEC' is not available (install it or use gzip/zstd/xz)." >&2
+  exit 1
+fi
+if [[ "$COMPRESSOR" == gzip* && "${THREADS_REQUESTED:-1}" -gt 1 ]]; then
+  echo "pigz not found; compressing on a single core (install pigz for parallel gzip)." >&2
+fi
 
 INSTANCE_NAME=$(basename "$INSTANCE_DIR")
 TS=$(date +%Y%m%d-%H%M%S)
-BACKUP_FILE="$BACKUP_DIR/${INSTANCE_NAME}-${TS}.tar.gz"
+BACKUP_FILE="$BACKUP_DIR/${INSTANCE_NAME}-${TS}.$(codec_ext "$CODEC")"
 
-tar -czf "$BACKUP_FILE" -C "$INSTANCE_DIR" .
+trace_trap_exit 'rm -f "$BACKUP_FILE.part"'
+start=$(now_ns)
+TAR_SOURCES=(-C "$INSTANCE_DIR" .)
+if [[ -n "$DATA_FROM" ]]; then
+  TAR_SOURCES=(-C "$INSTANCE_DIR" --exclude=./data . -C "$(dirname "$DATA_FROM")" --transform "s|^$(basename "$DATA_FROM")|./data|" "$(basename "$DATA_FROM")")
+fi
+trace_begin "tar | ${COMPRESSOR%% *}" "$BACKUP_FILE"
+tar -cf - "${TAR_SOURCES[@]}" | $COMPRESSOR > "$BACKUP_FILE.part"
+trace_end
+mv "$BACKUP_FILE.part" "$BACKUP_FILE"
+elapsed_ms=$(( ($(now_ns) - start) / 1000000 ))
 
-echo "Backup created: $BACKUP_FILE"
+echo "Backup created: $BACKUP_FILE (${COMPRESSOR%% *}, ${elapsed_ms} ms)"
@@ -0,0 +1,118 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# Compares boot time (container start to HT_READY_PATTERN, default
+# "Hytale Server Booted") with and without the class-data-sharing archive.
+#
+# Usage: ./scripts/bench-cds.sh <instance> [--runs N] [--timeout S]
+#
+# Each mode gets one warm-up boot first; for HT_CDS=1 that boot's clean
+# shutdown writes the archive. The instance's .env is restored afterwards.
+
+ROOT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)
+MANAGER="$ROOT_DIR/scripts/manager.sh"
+INSTANCE=${1:-}
+shift || true
+RUNS=3
+TIMEOUT=300
+
+while [[ $# -gt 0 ]]; do
+  case "$1" in
+    --runs) RUNS=${2:-}; shift 2 ;;
+    --timeout) TIMEOUT=${2:-}; shift 2 ;;
+    *)
+      echo "Unknown bench-cds option: $1" >&2
+      exit 1
+      ;;
+  esac
+done
+
+if [[ -z "$INSTANCE" ]]; then
+  echo "Usage: $0 <instance> [--runs N] [--timeout S]" >&2
+  exit 1
+fi
+if [[ -d "$INSTANCE" ]]; then
+  INSTANCE_DIR=$(cd "$INSTANCE" && pwd)
+else
+  INSTANCE_DIR="$ROOT_DIR/instances/$INSTANCE"
+fi
+COMPOSE_FILE="$INSTANCE_DIR/docker-compose.yml"
+ENV_FILE="$INSTANCE_DIR/.env"
+if [[ ! -f "$COMPOSE_FILE" || ! -f "$ENV_FILE" ]]; then
+  echo "Not an instance directory: $INSTANCE_DIR" >&2
+  exit 1
+fi
+
+cp -p "$ENV_FILE" "$ENV_FILE.bench-cds"
+restore_env() {
+  mv -f "$ENV_FILE.bench-cds" "$ENV_FILE"
+  echo "Restored $ENV_FILE; run './scripts/manager.sh start $(basename "$INSTANCE_DIR")' to apply it."
+}
+trap restore_env EXIT
+
+set_cds() {
+  if grep -qE '^HT_CDS=' "$ENV_FILE"; then
+    sed -i -E "s|^HT_CDS=.*|HT_CDS=$1|" "$ENV_FILE"
+  else
+    printf 'HT_CDS=%s\n' "$1" >> "$ENV_FILE"
+  fi
+}
+
+# One stop/recreate/ready cycle; prints the ready time in ms.
+boot_once() {
+  local out ms
+  "$MANAGER" stop "$INSTANCE_DIR" >/dev/null 2>&1 || true
+  docker compose -f "$COMPOSE_FILE" up -d --force-recreate >/dev/null 2>&1
+  if ! out=$("$MANAGER" wait-ready "$INSTANCE_DIR" --timeout "$TIMEOUT" 2>&1); then
+    echo "$out" >&2
+    return 1
+  fi
+  ms=$(sed -n 's/.*Server ready \([0-9][0-9]*\) ms.*/\1/p' <<<"$out" | tail -n1)
+  if [[ -z "$ms" ]]; then
+    echo "Could not read the ready time: $out" >&2
+    return 1
+  fi
+  echo "$ms"
+}
+
+# Prints "min median mean" of the numbers on stdin.
+stats() {
+  sort -n | awk '
+    { v[NR] = $1; sum += $1 }
+    END {
+      med = (NR % 2) ? v[(NR + 1) / 2] : (v[NR / 2] + v[NR / 2 + 1]) / 2
+      printf "%d %d %d\n", v[1], med, sum / NR
+    }'
+}
+
+declare -A RESULT
+for mode in 0 1; do
+  set_cds "$mode"
+  label=$([[ "$mode" == 1 ]] && echo "CDS on" || echo "CDS off")
+  echo "$label: warm-up boot..."
+  boot_once >/dev/null
+  times=()
+  for ((i = 1; i <= RUNS; i++)); do
+    ms=$(boot_once)
+    echo "$label: run $i: $ms ms"
+    times+=("$ms")
+  done
+  if [[ "$mode" == 1 ]] && ! compgen -G "$INSTANCE_DIR/data/cds/server-*.jsa" >/dev/null; then
+    echo "Warning: no archive in $INSTANCE_DIR/data/cds (server did not exit cleanly, or JDK < 19)." >&2
+  fi
+  RESULT[$mode]=$(printf '%s\n' "${times[@]}" | stats)
+done
+"$MANAGER" stop "$INSTANCE_DIR" >/dev/null 2>&1 || true
+
+echo
+for mode in 0 1; do
+  read -r min med mean <<<"${RESULT[$mode]}"
+  printf '%-8s runs %d  min %d ms  median %d ms  mean %d ms\n' \
+    "$([[ "$mode" == 1 ]] && echo "CDS on" || echo "CDS off")" "$RUNS" "$min" "$med" "$mean"
+done
+read -r _ off _ <<<"${RESULT[0]}"
+read -r _ on _ <<<"${RESULT[1]}"
+if [[ "$off" -gt 0 ]]; then
+  awk -v off="$off" -v on="$on" \
+    'BEGIN { printf "Median boot: %d ms -> %d ms (%+.1f%%)\n", off, on, (on - off) * 100 / off }'
+fi
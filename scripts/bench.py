@@ -0,0 +1,396 @@
+"""Lifecycle benchmarks for manager.sh and the GUI against a scripted Docker.
+
+Each run copies scripts/, templates/ and gui/ into a scratch root, generates a
+synthetic fleet there (instances with a server tree, a world of the given size and
+logs) and puts bench_docker.py on PATH as `docker`, with the configured latencies,
+boot time and log volume. Every operation is timed as a child process and reported
+as JSON: wall and CPU time, processes spawned, docker calls and I/O bytes. Spawns
+come from the kernel's last-PID counter, so they are approximate on a busy host; I/O
+comes from /proc/self/io, which includes reaped children (rchar/wchar count every
+read/write, read_bytes/write_bytes only what reached the block layer).
+
+Usage:
+  bench.py run [--instances N] [--world-mb MB] [--world-files N] [--server-mb MB]
+               [--ops start,status,stop,backup,update,gui-refresh] [--repeat N]
+               [--latency "compose up=0.8,exec=0.05"] [--boot-ms MS] [--stop-ms MS]
+               [--log-lines N] [--out FILE] [--keep]
+  bench.py compare <base.json> <new.json> [--threshold PCT]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+DEFAULT_OPS = "start,status,stop,backup,update,gui-refresh"
+DEFAULT_LATENCY = "default=0.01,compose up=0.5,compose stop=0.3,compose down=0.3,exec=0.05"
+IO_KEYS = ("rchar", "wchar", "read_bytes", "write_bytes")
+COMPARE_KEYS = ("wall_ms", "cpu_ms", "spawns", "docker_calls", "wchar", "write_bytes")
+
+GUI_REFRESH = """
+import os, sys, time
+from pathlib import Path
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, sys.argv[1] + "/gui")
+from PyQt6.QtWidgets import QApplication
+import app
+qt = QApplication([])
+window = app.MainWindow(Path(sys.argv[1]))
+started = time.perf_counter()
+# refresh_instances() runs these two on a worker thread; timed here back to back.
+window.populate_table(window.scan_instances())
+qt.processEvents()
+print("refresh_ms=%.1f" % ((time.perf_counter() - started) * 1000), flush=True)
+window.close()
+qt.processEvents()
+# Skip interpreter teardown; the GUI's background threads are daemons.
+os._exit(0)
+"""
+
+
+def parse_latency(text: str) -> Dict[str, float]:
+    latency: Dict[str, float] = {}
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        key, _, value = part.partition("=")
+        latency[key.strip()] = float(value)
+    return latency
+
+
+def set_env(text: str, key: str, value: str) -> str:
+    line = f"{key}={value}"
+    if re.search(rf"^{key}=", text, re.MULTILINE):
+        return re.sub(rf"^{key}=.*$", lambda _: line, text, count=1, flags=re.MULTILINE)
+    return text.rstrip("\n") + f"\n{line}\n"
+
+
+def make_server_zip(path: Path, server_mb: float) -> str:
+    """Synthetic server archive: a large jar, a start script and config; returns its sha256."""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr("Server/HytaleServer.jar", os.urandom(int(server_mb * 1024 * 1024)))
+        archive.writestr("Server/config.json", json.dumps({"ServerName": "Bench", "MaxPlayers": 10}, indent=2))
+        archive.writestr("HytaleServer.sh", "#!/bin/sh\nexec java -jar Server/HytaleServer.jar\n")
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for block in iter(lambda: handle.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_instance(root: Path, index: int, server_zip: Path, sha: str, args: argparse.Namespace) -> Path:
+    name = f"bench-{index:03d}"
+    instance_dir = root / "instances" / name
+    for sub in ("server", "mods", "data", "logs"):
+        (instance_dir / sub).mkdir(parents=True, exist_ok=True)
+    env = (root / "templates" / "instance.env").read_text(encoding="utf-8")
+    for token, value in (
+        ("__INSTANCE_NAME__", name),
+        ("__HOST_PORT__", str(5520 + index)),
+        ("__SERVER_URL__", server_zip.as_uri()),
+        ("__SERVER_SHA256__", sha),
+        ("__WORLD_NAME__", "default"),
+        ("__SERVICE_NAME__", name),
+    ):
+        env = env.replace(token, value)
+    for key, value in (
+        ("HT_SERVER_CMD", "./server/HytaleServer.sh"),
+        ("HYTALE_SERVER_SESSION_TOKEN", "bench"),
+        ("HT_READY_TIMEOUT", "60"),
+    ):
+        env = set_env(env, key, value)
+    (instance_dir / ".env").write_text(env, encoding="utf-8")
+    compose = (root / "templates" / "instance-compose.yml").read_text(encoding="utf-8")
+    (instance_dir / "docker-compose.yml").write_text(compose.replace("__SERVICE_NAME__", name), encoding="utf-8")
+    with zipfile.ZipFile(server_zip) as archive:
+        archive.extractall(instance_dir / "server")
+    (instance_dir / "data" / "machine-id").write_text(os.urandom(16).hex() + "\n", encoding="utf-8")
+    # Region files are half random, half repetitive, so compression has some work to do.
+    world = instance_dir / "data" / "universe" / "worlds" / "default" / "chunks"
+    world.mkdir(parents=True, exist_ok=True)
+    files = max(1, args.world_files)
+    size = int(args.world_mb * 1024 * 1024 / files)
+    for i in range(files):
+        half = size // 2
+        (world / f"{i // 32}.{i % 32}.region.bin").write_bytes(os.urandom(half) + bytes(size - half))
+    log_line = "[2026/01/01 10:00:00 INFO] [Bench] synthetic log line\n"
+    (instance_dir / "logs" / "2026-01-01_10-00-00_server.log").write_text(log_line * args.log_lines, encoding="utf-8")
+    return instance_dir
+
+
+def build_sandbox(root: Path, args: argparse.Namespace) -> List[Path]:
+    for part in ("scripts", "templates", "gui"):
+        shutil.copytree(ROOT_DIR / part, root / part, ignore=shutil.ignore_patterns("__pycache__"))
+    bin_dir = root / "bin"
+    bin_dir.mkdir()
+    shim = bin_dir / "docker"
+    shim.write_text(f'#!/bin/sh\nexec {sys.executable} "{root}/scripts/bench_docker.py" "$@"\n', encoding="utf-8")
+    shim.chmod(0o755)
+    state = root / "state"
+    state.mkdir()
+    (state / "config.json").write_text(json.dumps({
+        "latency": parse_latency(args.latency),
+        "boot_ms": args.boot_ms,
+        "stop_ms": args.stop_ms,
+        "log_lines": args.log_lines,
+    }, indent=2), encoding="utf-8")
+    fixtures = root / "fixtures"
+    fixtures.mkdir()
+    server_zip = fixtures / "server.zip"
+    sha = make_server_zip(server_zip, args.server_mb)
+    return [make_instance(root, i, server_zip, sha, args) for i in range(args.instances)]
+
+
+def bench_env(root: Path) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        PATH=f"{root / 'bin'}:{env.get('PATH', '')}",
+        HSM_BENCH_STATE=str(root / "state"),
+        # No Engine API socket: every Docker access goes through the shim.
+        DOCKER_HOST=f"unix://{root / 'state' / 'no-engine.sock'}",
+        HT_AUTO_INSTALL_DEPS="0",
+    )
+    return env
+
+
+def op_command(op: str, root: Path, instance: str) -> Optional[List[str]]:
+    manager = str(root / "scripts" / "manager.sh")
+    commands = {
+        "start": [manager, "start", instance],
+        "stop": [manager, "stop", instance],
+        "status": [manager, "status"],
+        "backup": [manager, "backup", instance],
+        "update": [manager, "update", instance, "--no-backup"],
+        "start-all": [manager, "start-all"],
+        "stop-all": [manager, "stop-all"],
+        "backup-all": [manager, "backup-all"],
+        "gui-refresh": [sys.executable, "-c", GUI_REFRESH, str(root)],
+    }
+    return commands.get(op)
+
+
+def read_io() -> Dict[str, int]:
+    values: Dict[str, int] = {}
+    with open("/proc/self/io", encoding="ascii") as handle:
+        for line in handle:
+            key, _, value = line.partition(":")
+            values[key] = int(value)
+    return values
+
+
+def last_pid() -> int:
+    with open("/proc/loadavg", encoding="ascii") as handle:
+        return int(handle.read().split()[-1])
+
+
+def count_lines(path: Path) -> int:
+    try:
+        with open(path, "rb") as handle:
+            return sum(1 for _ in handle)
+    except OSError:
+        return 0
+
+
+def measure(command: List[str], env: Dict[str, str], root: Path, log, timeout: float) -> Dict[str, object]:
+    calls_log = root / "state" / "calls.log"
+    calls = count_lines(calls_log)
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    io_before = read_io()
+    pid_before = last_pid()
+    started = time.perf_counter()
+    try:
+        result = subprocess.run(command, env=env, cwd=root, stdin=subprocess.DEVNULL,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout)
+        rc, output = result.returncode, result.stdout
+    except subprocess.TimeoutExpired as exc:
+        rc, output = -1, exc.stdout or b""
+    wall = time.perf_counter() - started
+    pid_after = last_pid()
+    io_after = read_io()
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    log.write(f"$ {' '.join(command[:3])}\n".encode() + output + f"[rc={rc}]\n".encode())
+    run: Dict[str, object] = {
+        "rc": rc,
+        "wall_ms": round(wall * 1000, 1),
+        "cpu_ms": round((after.ru_utime - usage.ru_utime + after.ru_stime - usage.ru_stime) * 1000, 1),
+        "spawns": max(0, pid_after - pid_before),
+        "docker_calls": count_lines(calls_log) - calls,
+    }
+    for key in IO_KEYS:
+        run[key] = io_after.get(key, 0) - io_before.get(key, 0)
+    match = re.search(rb"refresh_ms=([0-9.]+)", output)
+    if match:
+        run["inner_ms"] = float(match.group(1))
+    return run
+
+
+def summarize(runs: List[Dict[str, object]]) -> Dict[str, object]:
+    ok = [run for run in runs if run["rc"] == 0] or runs
+    summary: Dict[str, object] = {"runs": len(runs), "failures": sum(1 for run in runs if run["rc"] != 0)}
+    for key in ("wall_ms", "cpu_ms", "spawns", "docker_calls", "inner_ms") + IO_KEYS:
+        values = [float(run[key]) for run in ok if key in run]  # type: ignore[arg-type]
+        if values:
+            summary[key] = round(statistics.median(values), 1)
+    walls = [float(run["wall_ms"]) for run in ok]  # type: ignore[arg-type]
+    summary["wall_ms_min"] = min(walls)
+    summary["wall_ms_max"] = max(walls)
+    return summary
+
+
+def git_revision() -> str:
+    try:
+        result = subprocess.run(["git", "-C", str(ROOT_DIR), "describe", "--always", "--dirty"],
+                                capture_output=True, text=True, check=False)
+        return result.stdout.strip()
+    except OSError:
+        return ""
+
+
+def gui_available() -> bool:
+    try:
+        import PyQt6.QtWidgets  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def run(args: argparse.Namespace) -> int:
+    ops = [op.strip() for op in args.ops.split(",") if op.strip()]
+    unknown = [op for op in ops if op_command(op, ROOT_DIR, "x") is None]
+    if unknown:
+        print(f"Unknown operations: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+    root = Path(tempfile.mkdtemp(prefix="hsm-bench-"))
+    try:
+        started = time.perf_counter()
+        instances = build_sandbox(root, args)
+        setup_s = time.perf_counter() - started
+        print(f"Sandbox {root}: {len(instances)} instances in {setup_s:.1f}s", file=sys.stderr)
+        env = bench_env(root)
+        results: Dict[str, Dict[str, object]] = {}
+        runs: Dict[str, List[Dict[str, object]]] = {op: [] for op in ops}
+        with open(root / "bench.log", "wb") as log:
+            for repeat in range(args.repeat):
+                for op in ops:
+                    if op == "gui-refresh" and not gui_available():
+                        results[op] = {"skipped": "PyQt6 not installed"}
+                        continue
+                    command = op_command(op, root, instances[0].name)
+                    result = measure(command, env, root, log, args.op_timeout)  # type: ignore[arg-type]
+                    runs[op].append(result)
+                    status = "ok" if result["rc"] == 0 else f"rc={result['rc']}"
+                    print(f"[{repeat + 1}/{args.repeat}] {op}: {result['wall_ms']} ms ({status})", file=sys.stderr)
+            for instance in instances:
+                subprocess.run([sys.executable, str(root / "scripts" / "console.py"), "stop", str(instance)],
+                               env=env, capture_output=True, check=False)
+        for op in ops:
+            if runs[op]:
+                results[op] = {"command": " ".join(op_command(op, Path("."), instances[0].name)[:3]),  # type: ignore[index]
+                               "summary": summarize(runs[op]), "runs": runs[op]}
+        report = {
+            "revision": git_revision(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": {"python": platform.python_version(), "system": platform.platform(), "cpus": os.cpu_count()},
+            "config": {
+                "instances": args.instances,
+                "world_mb": args.world_mb,
+                "world_files": args.world_files,
+                "server_mb": args.server_mb,
+                "repeat": args.repeat,
+                "latency": parse_latency(args.latency),
+                "boot_ms": args.boot_ms,
+                "stop_ms": args.stop_ms,
+                "log_lines": args.log_lines,
+            },
+            "results": results,
+        }
+        text = json.dumps(report, indent=2)
+        if args.out:
+            Path(args.out).write_text(text + "\n", encoding="utf-8")
+            print(f"Wrote {args.out}", file=sys.stderr)
+        else:
+            print(text)
+        failed = [op for op in ops if runs[op] and any(r["rc"] != 0 for r in runs[op])]
+        if failed:
+            print(f"Failed operations: {', '.join(failed)} (see {root / 'bench.log'})", file=sys.stderr)
+            args.keep = True
+        return 1 if failed else 0
+    finally:
+        if args.keep:
+            print(f"Kept sandbox: {root}", file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(base_path: Path, new_path: Path, threshold: float) -> int:
+    base = json.loads(base_path.read_text(encoding="utf-8"))
+    new = json.loads(new_path.read_text(encoding="utf-8"))
+    print(f"{base.get('revision') or base_path.name} -> {new.get('revision') or new_path.name}")
+    print(f"{'OPERATION':<14} {'METRIC':<13} {'BASE':>12} {'NEW':>12} {'CHANGE':>8}")
+    regressions = 0
+    for op, result in new.get("results", {}).items():
+        old = base.get("results", {}).get(op, {}).get("summary")
+        summary = result.get("summary")
+        if not old or not summary:
+            continue
+        for key in COMPARE_KEYS:
+            if key not in old or key not in summary:
+                continue
+            before, after = float(old[key]), float(summary[key])
+            change = (after - before) * 100 / before if before else 0.0
+            flag = ""
+            if key == "wall_ms" and change > threshold:
+                flag = "  regression"
+                regressions += 1
+            print(f"{op:<14} {key:<13} {before:>12.1f} {after:>12.1f} {change:>+7.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="bench.py", description="Lifecycle benchmarks against a scripted Docker.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_cmd = sub.add_parser("run", help="Build a sandbox fleet and time the operations")
+    run_cmd.add_argument("--instances", type=int, default=3)
+    run_cmd.add_argument("--world-mb", type=float, default=64.0, help="world size per instance")
+    run_cmd.add_argument("--world-files", type=int, default=64, help="region files per world")
+    run_cmd.add_argument("--server-mb", type=float, default=32.0, help="size of the synthetic server jar")
+    run_cmd.add_argument("--ops", default=DEFAULT_OPS, help="comma-separated; also start-all, stop-all, backup-all")
+    run_cmd.add_argument("--repeat", type=int, default=3)
+    run_cmd.add_argument("--latency", default=DEFAULT_LATENCY, help='seconds per docker call, e.g. "compose up=0.8,exec=0.05"')
+    run_cmd.add_argument("--boot-ms", type=int, default=1500, help="container start to boot marker")
+    run_cmd.add_argument("--stop-ms", type=int, default=300, help="/stop to container exit")
+    run_cmd.add_argument("--log-lines", type=int, default=200, help="log lines before the boot marker")
+    run_cmd.add_argument("--op-timeout", type=float, default=600.0)
+    run_cmd.add_argument("--out", default="", help="write the JSON report here instead of stdout")
+    run_cmd.add_argument("--keep", action="store_true", help="keep the sandbox directory")
+
+    compare_cmd = sub.add_parser("compare", help="Compare two reports")
+    compare_cmd.add_argument("base", type=Path)
+    compare_cmd.add_argument("new", type=Path)
+    compare_cmd.add_argument("--threshold", type=float, default=10.0, help="wall-time regression threshold in percent")
+
+    args = parser.parse_args(argv)
+    if args.command == "compare":
+        return compare(args.base, args.new, args.threshold)
+    if args.instances < 1:
+        print("--instances must be at least 1", file=sys.stderr)
+        return 1
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
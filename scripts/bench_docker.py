@@ -0,0 +1,341 @@
+"""Scripted stand-in for `docker` and `docker compose`, used by bench.py.
+
+Containers exist only as records in $HSM_BENCH_STATE/containers.json; `compose up`
+marks one running, `/stop` on its console or `compose stop` marks it exited. The log
+stream prints configurable chatter and then the boot marker once boot_ms have passed
+since the start. Every call is appended to calls.log and, per config.json, delayed:
+
+  {"latency": {"compose up": 0.8, "compose stop": 0.3, "exec": 0.05, "default": 0.01},
+   "boot_ms": 1500, "stop_ms": 300, "log_lines": 200}
+
+Latency keys are "compose <subcommand>" or the docker subcommand.
+
+Usage (installed on PATH as `docker` by bench.py):
+  bench_docker.py <docker arguments...>
+"""
+
+import fcntl
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+STATE_DIR = Path(os.environ.get("HSM_BENCH_STATE", ".hsm/bench-state"))
+BOOT_MARKER = "[INFO] Hytale Server Booted"
+SERVICE_RE = re.compile(r"^  ([A-Za-z0-9_.-]+):\s*$")
+FORMAT_RE = re.compile(r"\{\{\s*(json \.|\.[A-Za-z.]+|\.Label \"([^\"]+)\")\s*\}\}")
+
+Container = Dict[str, object]
+
+
+def load_config() -> Dict[str, object]:
+    try:
+        return json.loads((STATE_DIR / "config.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+
+CONFIG = load_config()
+
+
+@contextmanager
+def containers() -> Iterator[Dict[str, Container]]:
+    """Locked read-modify-write of the container records."""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(STATE_DIR / "containers.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        path = STATE_DIR / "containers.json"
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            data = {}
+        yield data
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, path)
+
+
+def snapshot() -> Dict[str, Container]:
+    with containers() as data:
+        return dict(data)
+
+
+def state_of(container: Container) -> str:
+    stop_at = container.get("stop_at")
+    if container.get("state") == "running" and stop_at and time.time() >= float(stop_at):  # type: ignore[arg-type]
+        return "exited"
+    return str(container.get("state", "created"))
+
+
+def iso(ts: object) -> str:
+    if not ts:
+        return "0001-01-01T00:00:00Z"
+    return datetime.fromtimestamp(float(ts), timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")  # type: ignore[arg-type]
+
+
+def find(ref: str) -> Optional[Container]:
+    for container in snapshot().values():
+        if ref in (container["id"], container["name"]) or (len(ref) >= 6 and str(container["id"]).startswith(ref)):
+            return container
+    return None
+
+
+def fields(container: Container) -> Dict[str, str]:
+    state = state_of(container)
+    return {
+        ".ID": str(container["id"])[:12],
+        ".Id": str(container["id"]),
+        ".Names": str(container["name"]),
+        ".Name": "/" + str(container["name"]),
+        ".State": state,
+        ".Status": "Up" if state == "running" else "Exited (0)",
+        ".State.Status": state,
+        ".State.Running": "true" if state == "running" else "false",
+        ".State.StartedAt": iso(container.get("started_at")),
+        ".Config.Tty": "true",
+    }
+
+
+def labels(container: Container) -> Dict[str, str]:
+    return {
+        "com.docker.compose.project": str(container["project"]),
+        "com.docker.compose.service": str(container["service"]),
+    }
+
+
+def render(template: str, container: Container) -> str:
+    values = fields(container)
+
+    def sub(match: "re.Match[str]") -> str:
+        if match.group(2):
+            return labels(container).get(match.group(2), "")
+        if match.group(1) == "json .":
+            return json.dumps({key.lstrip("."): value for key, value in values.items() if "." not in key[1:]})
+        return values.get(match.group(1), "")
+
+    return FORMAT_RE.sub(sub, template).replace("\\t", "\t")
+
+
+def inspect_json(container: Container) -> Dict[str, object]:
+    state = state_of(container)
+    return {
+        "Id": container["id"],
+        "Name": "/" + str(container["name"]),
+        "State": {"Status": state, "Running": state == "running", "StartedAt": iso(container.get("started_at"))},
+        "Config": {"Tty": True, "Labels": labels(container)},
+    }
+
+
+def pause(key: str) -> None:
+    latency = CONFIG.get("latency", {})
+    delay = latency.get(key, latency.get("default", 0))  # type: ignore[union-attr]
+    if delay:
+        time.sleep(float(delay))
+
+
+def emit_logs(container: Container, follow: bool, tail: Optional[int]) -> int:
+    """Chatter lines, then the boot marker once the server has "booted"; -f keeps going until exit."""
+    started = float(container.get("started_at") or 0)  # type: ignore[arg-type]
+    lines = [f"[INFO] [Bench] chatter line {i}" for i in range(int(CONFIG.get("log_lines", 50)))]  # type: ignore[arg-type]
+    boot_at = started + int(CONFIG.get("boot_ms", 1000)) / 1000  # type: ignore[arg-type]
+    booted = time.time() >= boot_at
+    history = lines + ([BOOT_MARKER] if booted else [])
+    if tail is not None:
+        history = history[-tail:] if tail else []
+    out = sys.stdout
+    for line in history:
+        out.write(line + "\n")
+    out.flush()
+    if not follow:
+        return 0
+    while True:
+        current = find(str(container["id"]))
+        if current is None or state_of(current) != "running":
+            return 0
+        if not booted and time.time() >= boot_at:
+            out.write(BOOT_MARKER + "\n")
+            out.flush()
+            booted = True
+        time.sleep(0.05)
+
+
+def console_input(container: Container, texts: List[str]) -> None:
+    if any("/stop" in text for text in texts):
+        stop_ms = int(CONFIG.get("stop_ms", 300))  # type: ignore[arg-type]
+        with containers() as data:
+            record = data.get(str(container["project"]))
+            if record and state_of(record) == "running" and not record.get("stop_at"):
+                record["stop_at"] = time.time() + stop_ms / 1000
+
+
+def exec_cmd(container: Optional[Container], args: List[str], interactive: bool) -> int:
+    if container is None:
+        print("Error: No such container", file=sys.stderr)
+        return 1
+    console_input(container, args)
+    if interactive:
+        for line in sys.stdin:
+            console_input(container, [line])
+    return 0
+
+
+def split_flags(args: List[str], with_value: Tuple[str, ...]) -> Tuple[Dict[str, str], List[str]]:
+    flags: Dict[str, str] = {}
+    rest: List[str] = []
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg.startswith("-") and rest == []:
+            name, eq, value = arg.partition("=")
+            if name in with_value and not eq:
+                i += 1
+                value = args[i] if i < len(args) else ""
+            flags[name] = value
+        else:
+            rest.append(arg)
+        i += 1
+    return flags, rest
+
+
+def compose_target(compose_file: Path) -> Tuple[str, str]:
+    project = ""
+    env_file = compose_file.parent / ".env"
+    if env_file.exists():
+        for line in env_file.read_text(encoding="utf-8", errors="replace").splitlines():
+            if line.startswith("COMPOSE_PROJECT_NAME="):
+                project = line.split("=", 1)[1].strip()
+    project = project or re.sub(r"[^a-z0-9_-]", "", compose_file.parent.name.lower())
+    service = "hytale"
+    for line in compose_file.read_text(encoding="utf-8").splitlines():
+        match = SERVICE_RE.match(line)
+        if match:
+            service = match.group(1)
+            break
+    return project, service
+
+
+def compose(args: List[str]) -> int:
+    compose_file = Path("docker-compose.yml")
+    i = 0
+    while i < len(args) and args[i].startswith("-"):
+        if args[i] in ("-f", "--file"):
+            compose_file = Path(args[i + 1])
+        i += 2 if args[i] in ("-f", "--file", "-p", "--project-name", "--project-directory", "--ansi", "--progress") else 1
+    if i >= len(args):
+        return 0
+    sub, rest = args[i], args[i + 1:]
+    pause(f"compose {sub}")
+    project, service = compose_target(compose_file)
+    if sub in ("up", "start", "restart"):
+        with containers() as data:
+            record = data.setdefault(project, {
+                "id": os.urandom(32).hex(),
+                "name": f"{project}-{service}-1",
+                "project": project,
+                "service": service,
+            })
+            if sub == "up" and "--force-recreate" not in rest and state_of(record) == "running":
+                return 0
+            record.update(state="running", started_at=time.time(), stop_at=None)
+        print(f" Container {project}-{service}-1  Started", file=sys.stderr)
+        return 0
+    if sub in ("stop", "down", "kill", "rm"):
+        with containers() as data:
+            if sub in ("down", "rm"):
+                data.pop(project, None)
+            elif project in data:
+                data[project].update(state="exited", stop_at=None)
+        return 0
+    record = snapshot().get(project)
+    if sub == "ps":
+        if record is not None and ("-a" in rest or "--all" in rest or state_of(record) == "running"):
+            print(record["id"] if "-q" in rest or "--quiet" in rest else f"{record['name']}  {state_of(record)}")
+        return 0
+    if sub == "logs":
+        if record is None:
+            return 0
+        flags, _ = split_flags(rest, ("--tail", "--since", "-n"))
+        tail = flags.get("--tail", flags.get("-n"))
+        follow = "-f" in flags or "--follow" in flags
+        return emit_logs(record, follow, int(tail) if tail not in (None, "all") else None)
+    if sub == "exec":
+        flags, cmd = split_flags(rest, ("-u", "--user", "-w", "--workdir", "-e", "--env"))
+        return exec_cmd(record, cmd[1:], interactive="-T" not in flags)
+    return 0
+
+
+def main(argv: List[str]) -> int:
+    with open(STATE_DIR / "calls.log", "a", encoding="utf-8") as log:
+        log.write(" ".join(argv) + "\n")
+    if not argv:
+        return 0
+    cmd, args = argv[0], argv[1:]
+    if cmd == "compose":
+        return compose(args)
+    pause(cmd)
+    if cmd == "version":
+        print("27.0.0-bench")
+        return 0
+    if cmd == "image":
+        print("[]")
+        return 0
+    if cmd == "ps":
+        flags, _ = split_flags(args, ("--format", "--filter", "-f"))
+        template = flags.get("--format", "{{.ID}}\t{{.Names}}\t{{.Status}}")
+        wanted = flags.get("--filter", flags.get("-f", ""))
+        for container in snapshot().values():
+            if "-a" not in flags and "--all" not in flags and state_of(container) != "running":
+                continue
+            if wanted.startswith("label=") and wanted[6:] not in [f"{k}={v}" for k, v in labels(container).items()]:
+                continue
+            print(render(template, container))
+        return 0
+    if cmd == "inspect":
+        flags, refs = split_flags(args, ("-f", "--format", "--type"))
+        template = flags.get("-f", flags.get("--format", ""))
+        found = [find(ref) for ref in refs]
+        if not found or None in found:
+            print("Error: No such object", file=sys.stderr)
+            return 1
+        if template:
+            for container in found:
+                print(render(template, container))  # type: ignore[arg-type]
+        else:
+            print(json.dumps([inspect_json(container) for container in found]))  # type: ignore[arg-type]
+        return 0
+    if cmd == "wait":
+        while True:
+            container = find(args[-1]) if args else None
+            if container is None or state_of(container) != "running":
+                print(0)
+                return 0
+            time.sleep(0.05)
+    if cmd == "logs":
+        flags, refs = split_flags(args, ("--tail", "--since", "-n"))
+        container = find(refs[0]) if refs else None
+        if container is None:
+            print("Error: No such container", file=sys.stderr)
+            return 1
+        tail = flags.get("--tail", flags.get("-n"))
+        return emit_logs(container, "-f" in flags or "--follow" in flags, int(tail) if tail not in (None, "all") else None)
+    if cmd == "exec":
+        flags, rest = split_flags(args, ("-u", "--user", "-w", "--workdir", "-e", "--env"))
+        interactive = "-i" in flags or "-it" in flags or "--interactive" in flags
+        return exec_cmd(find(rest[0]) if rest else None, rest[1:], interactive)
+    if cmd == "events":
+        # Nothing is emitted; callers follow events with a timeout.
+        while True:
+            time.sleep(1)
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except (BrokenPipeError, KeyboardInterrupt):
+        sys.exit(0)
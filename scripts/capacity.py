@@ -0,0 +1,454 @@
+"""Host capacity planner: CPU pinning and memory admission for instances.
+
+The host's cores and RAM (minus a reserve for the OS and the manager) are recorded
+in .hsm/capacity.json the first time they are needed. Each instance's share lives
+in its own docker-compose.yml (`cpuset`, `mem_limit`, `mem_reservation`), so the
+current allocation is always read back from the instances themselves and removing
+an instance frees its share. `allocate` picks the least-used cores and checks that
+memory limits still fit; an overcommitted host is a warning by default and a
+refusal (exit 2) with policy "refuse".
+
+Usage:
+  capacity.py report [--json]
+  capacity.py allocate <instance_dir> [--cores N | --cpuset LIST] [--memory 6G] [--policy warn|refuse] [--force] [--dry-run]
+  capacity.py host [--detect] [--cpus LIST] [--memory SIZE] [--reserve-cpus LIST] [--reserve-memory SIZE] [--policy warn|refuse]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from tracing import run_main
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+INSTANCES_DIR = ROOT_DIR / "instances"
+HOST_FILE = ROOT_DIR / ".hsm" / "capacity.json"
+
+DEFAULT_CORES = 2
+DEFAULT_MEMORY_MB = 6144
+EXIT_REFUSED = 2
+POLICIES = ("warn", "refuse")
+
+SIZE_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$", re.IGNORECASE)
+SIZE_MB = {"": 1 / (1024 * 1024), "k": 1 / 1024, "m": 1, "g": 1024, "t": 1024 * 1024}
+SERVICE_RE = re.compile(r"^  ([A-Za-z0-9_.-]+):\s*$")
+LIMIT_RE = re.compile(r"^    (cpuset|mem_limit|mem_reservation):\s*(.*?)\s*$")
+MARKER = "    # Assigned by scripts/capacity.py (manager.sh capacity)"
+
+
+class CapacityError(Exception):
+    pass
+
+
+@dataclass
+class Host:
+    cpus: List[int]
+    memory_mb: int
+    reserved_cpus: List[int] = field(default_factory=list)
+    reserved_memory_mb: int = 1024
+    policy: str = "warn"
+    detected_at: str = ""
+
+    def usable_cpus(self) -> List[int]:
+        return [cpu for cpu in self.cpus if cpu not in self.reserved_cpus]
+
+    def usable_memory_mb(self) -> int:
+        return max(0, self.memory_mb - self.reserved_memory_mb)
+
+
+@dataclass
+class Allocation:
+    instance: str
+    cpuset: List[int]
+    memory_mb: int
+    warnings: List[str] = field(default_factory=list)
+    refused: bool = False
+
+
+def parse_size_mb(text: str) -> int:
+    """Compose/docker sizes ("6g", "512m", "6GiB", plain bytes) in MiB."""
+    match = SIZE_RE.match(str(text).strip().strip("\"'"))
+    if not match:
+        raise CapacityError(f"Invalid size: {text!r} (use e.g. 6G or 512M)")
+    return int(float(match.group(1)) * SIZE_MB[match.group(2).lower()])
+
+
+def parse_cpuset(text: str) -> List[int]:
+    """ "0-3,6" -> [0, 1, 2, 3, 6] (cgroup cpuset syntax)."""
+    cpus: List[int] = []
+    for part in str(text).strip().strip("\"'").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition("-")
+        if not low.isdigit() or (high and not high.isdigit()):
+            raise CapacityError(f"Invalid cpuset: {text!r} (use e.g. 2-3 or 2,3)")
+        cpus.extend(range(int(low), int(high or low) + 1))
+    return sorted(set(cpus))
+
+
+def format_cpuset(cpus: List[int]) -> str:
+    """Compacts [0, 1, 2, 6] to "0-2,6"."""
+    ranges: List[List[int]] = []
+    for cpu in sorted(set(cpus)):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(low) if low == high else f"{low}-{high}" for low, high in ranges)
+
+
+def detect_host() -> Host:
+    try:
+        cpus = parse_cpuset(Path("/sys/devices/system/cpu/online").read_text(encoding="utf-8"))
+    except (OSError, CapacityError):
+        cpus = list(range(os.cpu_count() or 1))
+    memory_mb = 0
+    try:
+        for line in Path("/proc/meminfo").read_text(encoding="utf-8").splitlines():
+            if line.startswith("MemTotal:"):
+                memory_mb = int(line.split()[1]) // 1024
+                break
+    except OSError:
+        pass
+    if not memory_mb:
+        memory_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    # Keep the first core for the OS, Docker and the manager on hosts with room to spare.
+    reserved = cpus[:1] if len(cpus) > 2 else []
+    reserve_mb = 2048 if memory_mb >= 16384 else 1024
+    return Host(
+        cpus=cpus,
+        memory_mb=memory_mb,
+        reserved_cpus=reserved,
+        reserved_memory_mb=reserve_mb,
+        detected_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+    )
+
+
+def load_host(path: Path = HOST_FILE) -> Host:
+    """The recorded host, detected and saved on first use."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        host = Host(**{key: data[key] for key in Host.__dataclass_fields__ if key in data})
+    except FileNotFoundError:
+        host = detect_host()
+        save_host(host, path)
+    except (ValueError, TypeError) as exc:
+        raise CapacityError(f"Unreadable {path}: {exc}")
+    policy = os.environ.get("HSM_CAPACITY_POLICY")
+    if policy in POLICIES:
+        host.policy = policy
+    return host
+
+
+def save_host(host: Host, path: Path = HOST_FILE) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(asdict(host), indent=2) + "\n", encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def read_limits(compose_path: Path) -> Dict[str, str]:
+    """cpuset/mem_limit/mem_reservation of the (first) service in a compose file."""
+    limits: Dict[str, str] = {}
+    try:
+        lines = compose_path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return limits
+    in_service = False
+    for line in lines:
+        if SERVICE_RE.match(line):
+            if in_service:
+                break
+            in_service = True
+            continue
+        match = LIMIT_RE.match(line) if in_service else None
+        if match:
+            limits[match.group(1)] = match.group(2).strip("\"'")
+    return limits
+
+
+def write_limits(compose_path: Path, cpuset: List[int], memory_mb: int) -> None:
+    """Replaces the service's limit lines (after `restart:`, else after the service key)."""
+    lines = compose_path.read_text(encoding="utf-8").splitlines()
+    out: List[str] = []
+    service_at = -1
+    insert_at = -1
+    for line in lines:
+        if SERVICE_RE.match(line) and service_at < 0:
+            service_at = len(out)
+            insert_at = len(out) + 1
+            out.append(line)
+            continue
+        if service_at >= 0 and (line == MARKER or LIMIT_RE.match(line)):
+            continue
+        if service_at >= 0 and insert_at == service_at + 1 and line.startswith("    restart:"):
+            insert_at = len(out) + 1
+        out.append(line)
+    if service_at < 0:
+        raise CapacityError(f"No service found in {compose_path}")
+    block = [
+        MARKER,
+        f'    cpuset: "{format_cpuset(cpuset)}"',
+        f"    mem_limit: {memory_mb}m",
+        f"    mem_reservation: {memory_mb}m",
+    ]
+    out[insert_at:insert_at] = block
+    tmp = compose_path.with_suffix(".yml.tmp")
+    tmp.write_text("\n".join(out) + "\n", encoding="utf-8")
+    os.replace(tmp, compose_path)
+
+
+def instance_limits(instances_dir: Path = INSTANCES_DIR) -> Dict[str, Dict[str, object]]:
+    """Per instance: pinned cpus ([] when unpinned) and memory limit in MiB (0 when unlimited)."""
+    result: Dict[str, Dict[str, object]] = {}
+    if not instances_dir.is_dir():
+        return result
+    for path in sorted(instances_dir.iterdir()):
+        compose_path = path / "docker-compose.yml"
+        if not compose_path.is_file():
+            continue
+        limits = read_limits(compose_path)
+        try:
+            cpus = parse_cpuset(limits.get("cpuset", ""))
+        except CapacityError:
+            cpus = []
+        try:
+            memory_mb = parse_size_mb(limits["mem_limit"]) if limits.get("mem_limit") else 0
+        except CapacityError:
+            memory_mb = 0
+        result[path.name] = {"cpus": cpus, "memory_mb": memory_mb}
+    return result
+
+
+def core_load(host: Host, others: Dict[str, Dict[str, object]]) -> Dict[int, List[str]]:
+    load: Dict[int, List[str]] = {cpu: [] for cpu in host.cpus}
+    for name, limits in others.items():
+        for cpu in limits["cpus"]:  # type: ignore[union-attr]
+            load.setdefault(cpu, []).append(name)
+    return load
+
+
+def plan(
+    host: Host,
+    instance: str,
+    cores: int = DEFAULT_CORES,
+    memory_mb: int = DEFAULT_MEMORY_MB,
+    cpuset: Optional[List[int]] = None,
+    instances_dir: Path = INSTANCES_DIR,
+) -> Allocation:
+    """Chooses cores and checks memory against the other instances; does not write anything."""
+    others = {name: lim for name, lim in instance_limits(instances_dir).items() if name != instance}
+    load = core_load(host, others)
+    usable = host.usable_cpus()
+    warnings: List[str] = []
+    hard = False
+    if cpuset is None:
+        if cores < 1:
+            raise CapacityError("--cores must be at least 1")
+        if cores > len(usable):
+            warnings.append(f"{cores} cores requested but the host has {len(usable)} usable cores.")
+            hard = True
+            cores = len(usable)
+        # Least-loaded cores first; ties go to the lowest id, so free cores end up contiguous.
+        cpuset = sorted(sorted(usable, key=lambda cpu: (len(load.get(cpu, [])), cpu))[:cores])
+    else:
+        missing = [cpu for cpu in cpuset if cpu not in host.cpus]
+        if missing:
+            raise CapacityError(f"CPUs not on this host: {format_cpuset(missing)}")
+        reserved = [cpu for cpu in cpuset if cpu in host.reserved_cpus]
+        if reserved:
+            warnings.append(f"cpuset includes reserved cores {format_cpuset(reserved)}.")
+    shared = {cpu: load[cpu] for cpu in cpuset if load.get(cpu)}
+    if shared:
+        users = sorted({name for names in shared.values() for name in names})
+        warnings.append(
+            f"CPU overcommit: cores {format_cpuset(list(shared))} are already pinned to {', '.join(users)}."
+        )
+    unpinned = sorted(name for name, lim in others.items() if not lim["cpus"])
+    if unpinned:
+        warnings.append(f"Unpinned instances share every core: {', '.join(unpinned)}.")
+    committed = sum(int(lim["memory_mb"]) for lim in others.values())  # type: ignore[arg-type]
+    available = host.usable_memory_mb()
+    if committed + memory_mb > available:
+        warnings.append(
+            f"Memory overcommit: {committed} MiB already assigned + {memory_mb} MiB > {available} MiB usable."
+        )
+    unlimited = sorted(name for name, lim in others.items() if not lim["memory_mb"])
+    if unlimited:
+        warnings.append(f"Instances without a memory limit: {', '.join(unlimited)}.")
+    overcommitted = hard or bool(shared) or committed + memory_mb > available
+    return Allocation(
+        instance=instance,
+        cpuset=cpuset,
+        memory_mb=memory_mb,
+        warnings=warnings,
+        refused=overcommitted and host.policy == "refuse",
+    )
+
+
+def allocate(
+    instance_dir: Path,
+    cores: int = DEFAULT_CORES,
+    memory_mb: int = DEFAULT_MEMORY_MB,
+    cpuset: Optional[List[int]] = None,
+    policy: Optional[str] = None,
+    force: bool = False,
+    dry_run: bool = False,
+) -> Allocation:
+    """Plans an allocation and writes it into the instance's compose file unless refused."""
+    host = load_host()
+    if policy:
+        host.policy = policy
+    compose_path = instance_dir / "docker-compose.yml"
+    if not compose_path.is_file():
+        raise CapacityError(f"Missing docker-compose.yml in {instance_dir}")
+    result = plan(host, instance_dir.name, cores, memory_mb, cpuset, instance_dir.parent)
+    if force:
+        result.refused = False
+    if not result.refused and not dry_run:
+        write_limits(compose_path, result.cpuset, result.memory_mb)
+    return result
+
+
+def report_data(host: Host, instances_dir: Path = INSTANCES_DIR) -> Dict[str, object]:
+    limits = instance_limits(instances_dir)
+    load = core_load(host, limits)
+    committed = sum(int(lim["memory_mb"]) for lim in limits.values())  # type: ignore[arg-type]
+    pinned = sorted({cpu for lim in limits.values() for cpu in lim["cpus"]})  # type: ignore[union-attr]
+    return {
+        "host": asdict(host),
+        "usable_cpus": host.usable_cpus(),
+        "usable_memory_mb": host.usable_memory_mb(),
+        "committed_memory_mb": committed,
+        "pinned_cpus": pinned,
+        "shared_cpus": {str(cpu): names for cpu, names in sorted(load.items()) if len(names) > 1},
+        "instances": limits,
+        "overcommitted": committed > host.usable_memory_mb() or any(len(names) > 1 for names in load.values()),
+    }
+
+
+def report(as_json: bool = False) -> int:
+    host = load_host()
+    data = report_data(host)
+    if as_json:
+        print(json.dumps(data, indent=2))
+        return 0
+    usable = host.usable_cpus()
+    print(
+        f"Host: {len(host.cpus)} CPUs ({format_cpuset(host.cpus)}), {host.memory_mb} MiB; "
+        f"reserved: CPUs {format_cpuset(host.reserved_cpus) or 'none'}, {host.reserved_memory_mb} MiB; "
+        f"policy {host.policy}"
+    )
+    free = [cpu for cpu in usable if cpu not in data["pinned_cpus"]]  # type: ignore[operator]
+    committed = int(data["committed_memory_mb"])  # type: ignore[arg-type]
+    available = host.usable_memory_mb()
+    percent = committed * 100 // available if available else 0
+    print(f"CPUs: {len(usable) - len(free)}/{len(usable)} usable cores pinned; free: {format_cpuset(free) or 'none'}")
+    print(f"Memory: {committed}/{available} MiB assigned ({percent}%)")
+    instances = data["instances"]
+    if instances:
+        print()
+        print(f"{'INSTANCE':<32} {'CPUSET':<12} {'CORES':>5} {'MEMORY':>10}")
+        for name, lim in instances.items():  # type: ignore[union-attr]
+            cpus = lim["cpus"]
+            memory = f"{lim['memory_mb']} MiB" if lim["memory_mb"] else "unlimited"
+            print(f"{name:<32} {format_cpuset(cpus) or 'any':<12} {len(cpus) or '-':>5} {memory:>10}")
+    for cpu, names in data["shared_cpus"].items():  # type: ignore[union-attr]
+        print(f"Warning: core {cpu} is shared by {', '.join(names)}.", file=sys.stderr)
+    if committed > available:
+        print(f"Warning: memory overcommitted by {committed - available} MiB.", file=sys.stderr)
+    unpinned = [name for name, lim in instances.items() if not lim["cpus"]]  # type: ignore[union-attr]
+    if unpinned:
+        print(
+            f"Note: {len(unpinned)} instance(s) without a cpuset; assign one with "
+            "'manager.sh capacity allocate <instance>'.",
+            file=sys.stderr,
+        )
+    return 0
+
+
+def update_host(args: argparse.Namespace) -> int:
+    host = detect_host() if args.detect else load_host()
+    if args.cpus:
+        host.cpus = parse_cpuset(args.cpus)
+    if args.memory:
+        host.memory_mb = parse_size_mb(args.memory)
+    if args.reserve_cpus is not None:
+        host.reserved_cpus = parse_cpuset(args.reserve_cpus)
+    if args.reserve_memory:
+        host.reserved_memory_mb = parse_size_mb(args.reserve_memory)
+    if args.policy:
+        host.policy = args.policy
+    changed = args.detect or any(
+        value is not None and value != ""
+        for value in (args.cpus, args.memory, args.reserve_cpus, args.reserve_memory, args.policy)
+    )
+    if changed:
+        save_host(host)
+    print(json.dumps(asdict(host), indent=2))
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="capacity.py", description="Host capacity planner.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    report_cmd = sub.add_parser("report", help="Show host capacity and per-instance allocations")
+    report_cmd.add_argument("--json", action="store_true")
+
+    alloc_cmd = sub.add_parser("allocate", help="Assign a cpuset and memory limit to an instance")
+    alloc_cmd.add_argument("instance_dir", type=Path)
+    alloc_cmd.add_argument("--cores", type=int, default=DEFAULT_CORES)
+    alloc_cmd.add_argument("--cpuset", default="", help="explicit cores, e.g. 4-5")
+    alloc_cmd.add_argument("--memory", default=f"{DEFAULT_MEMORY_MB}M", help="memory limit, e.g. 6G")
+    alloc_cmd.add_argument("--policy", choices=POLICIES, default=None)
+    alloc_cmd.add_argument("--force", action="store_true", help="write even if the policy refuses")
+    alloc_cmd.add_argument("--dry-run", action="store_true")
+
+    host_cmd = sub.add_parser("host", help="Show or change the recorded host capacity")
+    host_cmd.add_argument("--detect", action="store_true", help="re-detect cores and RAM")
+    host_cmd.add_argument("--cpus", default="", help="cores available to instances, e.g. 0-15")
+    host_cmd.add_argument("--memory", default="", help="host memory, e.g. 64G")
+    host_cmd.add_argument("--reserve-cpus", default=None, help="cores kept free, e.g. 0 ('' for none)")
+    host_cmd.add_argument("--reserve-memory", default="", help="memory kept free, e.g. 2G")
+    host_cmd.add_argument("--policy", choices=POLICIES, default=None)
+
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "report":
+            return report(args.json)
+        if args.command == "host":
+            return update_host(args)
+        instance_dir = args.instance_dir.resolve()
+        result = allocate(
+            instance_dir,
+            cores=args.cores,
+            memory_mb=parse_size_mb(args.memory),
+            cpuset=parse_cpuset(args.cpuset) if args.cpuset else None,
+            policy=args.policy,
+            force=args.force,
+            dry_run=args.dry_run,
+        )
+    except CapacityError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    for warning in result.warnings:
+        print(f"Warning: {warning}", file=sys.stderr)
+    summary = f"cpuset {format_cpuset(result.cpuset)}, memory {result.memory_mb} MiB"
+    if result.refused:
+        print(f"Refused {result.instance}: host is overcommitted ({summary}); use --force to override.", file=sys.stderr)
+        return EXIT_REFUSED
+    verb = "Would assign" if args.dry_run else "Assigned"
+    print(f"{verb} {summary} to {result.instance}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("capacity.py", main))
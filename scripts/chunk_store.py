@@ -0,0 +1,557 @@
+"""Deduplicated, incremental backups backed by a content-addressed chunk store.
+
+Files are split into fixed-size chunks named by their SHA-256 and stored once in
+backups/store/chunks/, shared by every backup of every instance. A backup is a small
+gzipped JSON manifest (backups/<instance>-<ts>.manifest.json.gz) listing each file's
+chunks. Files whose size and mtime match the previous manifest are not read again.
+Hashing and compression run on a thread pool (zlib, lzma and zstd release the GIL),
+so new data is compressed on every core. Backups hold a shared lock on the store and
+gc/prune an exclusive one, so chunks are never deleted under a running backup.
+
+Usage:
+  chunk_store.py backup <instance_dir> [--codec zlib|lzma|zstd] [--level N] [--threads N] [--data-from DIR]
+  chunk_store.py bench <instance_dir> [--sample-mb N] [--threads N]
+  chunk_store.py list [instance]
+  chunk_store.py prune <instance> --keep N
+  chunk_store.py gc
+  chunk_store.py verify <manifest>
+"""
+
+import argparse
+import fcntl
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import re
+import stat
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from tracing import run_main
+
+try:
+    import zstandard
+except ImportError:  # optional: pip install zstandard
+    zstandard = None
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+BACKUP_DIR = ROOT_DIR / "backups"
+MANIFEST_SUFFIX = ".manifest.json.gz"
+MANIFEST_FORMAT = 1
+CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_LEVELS = {"zlib": 6, "lzma": 6, "zstd": 3}
+XZ_MAGIC = b"\xfd7zXZ\x00"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def available_codecs() -> List[str]:
+    codecs = ["zlib", "lzma"]
+    if zstandard is not None:
+        codecs.append("zstd")
+    return codecs
+
+
+def compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "lzma":
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+    if codec == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    raise ValueError(f"Codec not available: {codec}")
+
+
+def decompress(payload: bytes) -> bytes:
+    # Chunks carry no header; the codec is recognized from its stream magic.
+    if payload.startswith(XZ_MAGIC):
+        return lzma.decompress(payload, format=lzma.FORMAT_XZ)
+    if payload.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise ValueError("Chunk is zstd-compressed; install the zstandard module")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+@dataclass
+class BackupStats:
+    files: int = 0
+    bytes_total: int = 0
+    bytes_read: int = 0
+    bytes_stored: int = 0
+    chunks_new: int = 0
+    chunks_reused: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class Manifest:
+    instance: str
+    created: str
+    chunk_size: int = CHUNK_SIZE
+    entries: List[Dict[str, object]] = field(default_factory=list)
+
+    def to_json(self) -> Dict[str, object]:
+        return {
+            "format": MANIFEST_FORMAT,
+            "instance": self.instance,
+            "created": self.created,
+            "chunk_size": self.chunk_size,
+            "entries": self.entries,
+        }
+
+    def chunk_ids(self) -> Set[str]:
+        ids: Set[str] = set()
+        for entry in self.entries:
+            ids.update(entry.get("chunks", []))  # type: ignore[arg-type]
+        return ids
+
+
+def load_manifest(path: Path) -> Manifest:
+    with gzip.open(path, "rt", encoding="utf-8") as handle:
+        data = json.load(handle)
+    if data.get("format") != MANIFEST_FORMAT:
+        raise ValueError(f"Unsupported manifest format in {path}")
+    return Manifest(
+        instance=data["instance"],
+        created=data["created"],
+        chunk_size=data["chunk_size"],
+        entries=data["entries"],
+    )
+
+
+def write_manifest(path: Path, manifest: Manifest) -> None:
+    tmp_path = path.with_name(path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as handle:
+        json.dump(manifest.to_json(), handle, separators=(",", ":"))
+    tmp_path.replace(path)
+
+
+def manifests_for(backup_dir: Path, instance: Optional[str] = None) -> List[Path]:
+    """Manifests sorted oldest first (timestamps in the name sort lexically)."""
+    prefix = re.escape(instance) if instance else ".+"
+    name_re = re.compile(rf"{prefix}-\d{{8}}-\d{{6}}{re.escape(MANIFEST_SUFFIX)}")
+    return sorted(p for p in backup_dir.glob(f"*{MANIFEST_SUFFIX}") if name_re.fullmatch(p.name))
+
+
+class ChunkStore:
+    def __init__(self, root: Path, codec: str = "zlib", level: Optional[int] = None) -> None:
+        if codec not in available_codecs():
+            raise ValueError(f"Codec not available: {codec} (available: {', '.join(available_codecs())})")
+        self.root = root
+        self.chunks_dir = root / "chunks"
+        self.codec = codec
+        self.level = DEFAULT_LEVELS[codec] if level is None else level
+
+    def chunk_path(self, chunk_id: str) -> Path:
+        return self.chunks_dir / chunk_id[:2] / chunk_id
+
+    def has(self, chunk_id: str) -> bool:
+        return self.chunk_path(chunk_id).exists()
+
+    def put(self, data: bytes) -> Tuple[str, int]:
+        """Store a chunk if new; returns (chunk id, bytes written)."""
+        chunk_id = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(chunk_id)
+        if path.exists():
+            return chunk_id, 0
+        payload = compress(data, self.codec, self.level)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{chunk_id}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with tmp_path.open("wb") as handle:
+            handle.write(payload)
+        tmp_path.replace(path)
+        return chunk_id, len(payload)
+
+    def get(self, chunk_id: str) -> bytes:
+        data = decompress(self.chunk_path(chunk_id).read_bytes())
+        if hashlib.sha256(data).hexdigest() != chunk_id:
+            raise ValueError(f"Chunk {chunk_id} is corrupt")
+        return data
+
+    def all_ids(self) -> Iterator[str]:
+        if not self.chunks_dir.exists():
+            return
+        for bucket in self.chunks_dir.iterdir():
+            if bucket.is_dir():
+                for path in bucket.iterdir():
+                    if not path.name.endswith(".tmp"):
+                        yield path.name
+
+
+class ChunkWriter:
+    """Stores chunks on a thread pool, keeping at most a few chunks in memory per thread."""
+
+    def __init__(self, store: ChunkStore, threads: int) -> None:
+        self.store = store
+        self.pool = ThreadPoolExecutor(max_workers=max(1, threads))
+        self.max_inflight = max(1, threads) * 2
+        self.inflight: Deque[Future] = deque()
+
+    def submit(self, data: bytes) -> Future:
+        while len(self.inflight) >= self.max_inflight:
+            self.inflight.popleft().result()
+        future = self.pool.submit(self.store.put, data)
+        self.inflight.append(future)
+        return future
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+
+
+@contextmanager
+def store_lock(backup_dir: Path, exclusive: bool) -> Iterator[None]:
+    """flock on the store: shared while backing up, exclusive while deleting chunks or manifests."""
+    store_dir = backup_dir / "store"
+    store_dir.mkdir(parents=True, exist_ok=True)
+    mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    with open(store_dir / "lock", "w") as lock:
+        try:
+            fcntl.flock(lock, mode | fcntl.LOCK_NB)
+        except OSError:
+            print("Waiting for another backup or gc to finish...", file=sys.stderr, flush=True)
+            fcntl.flock(lock, mode)
+        yield
+
+
+def walk(base: Path, skip: Optional[Path] = None) -> Iterator[Path]:
+    """Yield every entry below base (directories before their contents), sorted."""
+    stack = [base]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            entries = sorted(it, key=lambda e: e.name, reverse=True)
+        for entry in entries:
+            path = Path(entry.path)
+            if path == skip:
+                continue
+            yield path
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(path)
+
+
+def backup(
+    instance_dir: Path,
+    backup_dir: Path = BACKUP_DIR,
+    codec: str = "zlib",
+    level: Optional[int] = None,
+    threads: Optional[int] = None,
+    data_from: Optional[Path] = None,
+) -> Tuple[Path, BackupStats]:
+    """Create a manifest backup of instance_dir; returns (manifest path, stats).
+
+    data_from replaces the instance's data/ folder with a snapshot taken elsewhere
+    (hot backups); paths in the manifest still read data/...
+    """
+    with store_lock(backup_dir, exclusive=False):
+        manifest_path, stats = _backup(instance_dir, backup_dir, codec, level, threads, data_from)
+    return manifest_path, stats
+
+
+def _backup(
+    instance_dir: Path,
+    backup_dir: Path,
+    codec: str,
+    level: Optional[int],
+    threads: Optional[int],
+    data_from: Optional[Path],
+) -> Tuple[Path, BackupStats]:
+    started = time.perf_counter()
+    instance = instance_dir.name
+    store = ChunkStore(backup_dir / "store", codec, level)
+    writer = ChunkWriter(store, threads or os.cpu_count() or 1)
+    previous: Dict[str, Dict[str, object]] = {}
+    existing = manifests_for(backup_dir, instance)
+    if existing:
+        try:
+            previous = {str(e["path"]): e for e in load_manifest(existing[-1]).entries}
+        except (OSError, ValueError, KeyError):
+            previous = {}
+
+    stats = BackupStats()
+    manifest = Manifest(instance=instance, created=datetime.now().isoformat(timespec="seconds"))
+    pending: List[Tuple[Dict[str, object], List[Future]]] = []
+    try:
+        walk_instance(instance_dir, data_from, previous, store, writer, stats, manifest, pending)
+    finally:
+        writer.close()
+    for entry, futures in pending:
+        chunk_ids = []
+        for future in futures:
+            chunk_id, written = future.result()
+            if written:
+                stats.chunks_new += 1
+                stats.bytes_stored += written
+            else:
+                stats.chunks_reused += 1
+            chunk_ids.append(chunk_id)
+        entry["chunks"] = chunk_ids
+
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = backup_dir / f"{instance}-{datetime.now():%Y%m%d-%H%M%S}{MANIFEST_SUFFIX}"
+    while manifest_path.exists():
+        # Names have one-second resolution; never overwrite an existing backup.
+        time.sleep(0.25)
+        manifest_path = backup_dir / f"{instance}-{datetime.now():%Y%m%d-%H%M%S}{MANIFEST_SUFFIX}"
+    write_manifest(manifest_path, manifest)
+    stats.seconds = time.perf_counter() - started
+    return manifest_path, stats
+
+
+def instance_paths(instance_dir: Path, data_from: Optional[Path]) -> Iterator[Tuple[Path, str]]:
+    if data_from is None:
+        for path in walk(instance_dir):
+            yield path, path.relative_to(instance_dir).as_posix()
+        return
+    for path in walk(instance_dir, skip=instance_dir / "data"):
+        yield path, path.relative_to(instance_dir).as_posix()
+    yield data_from, "data"
+    for path in walk(data_from):
+        yield path, "data/" + path.relative_to(data_from).as_posix()
+
+
+def walk_instance(
+    instance_dir: Path,
+    data_from: Optional[Path],
+    previous: Dict[str, Dict[str, object]],
+    store: ChunkStore,
+    writer: ChunkWriter,
+    stats: BackupStats,
+    manifest: Manifest,
+    pending: List[Tuple[Dict[str, object], List[Future]]],
+) -> None:
+    for path, rel in instance_paths(instance_dir, data_from):
+        st = path.lstat()
+        entry: Dict[str, object] = {"path": rel, "mode": stat.S_IMODE(st.st_mode), "mtime_ns": st.st_mtime_ns}
+        if stat.S_ISLNK(st.st_mode):
+            entry["type"] = "symlink"
+            entry["target"] = os.readlink(path)
+        elif stat.S_ISDIR(st.st_mode):
+            entry["type"] = "dir"
+        elif stat.S_ISREG(st.st_mode):
+            entry["type"] = "file"
+            entry["size"] = st.st_size
+            reused = reusable_chunks(st, previous.get(rel), store)
+            if reused is not None:
+                entry["chunks"] = reused
+                stats.chunks_reused += len(reused)
+            else:
+                pending.append((entry, read_chunks(path, writer, stats)))
+            stats.files += 1
+            stats.bytes_total += st.st_size
+        else:
+            continue
+        manifest.entries.append(entry)
+
+
+def reusable_chunks(
+    st: os.stat_result,
+    previous: Optional[Dict[str, object]],
+    store: ChunkStore,
+) -> Optional[List[str]]:
+    if (
+        previous is not None
+        and previous.get("type") == "file"
+        and previous.get("size") == st.st_size
+        and previous.get("mtime_ns") == st.st_mtime_ns
+    ):
+        chunks = list(previous.get("chunks", []))  # type: ignore[arg-type]
+        if all(store.has(chunk_id) for chunk_id in chunks):
+            return chunks
+    return None
+
+
+def read_chunks(path: Path, writer: ChunkWriter, stats: BackupStats) -> List[Future]:
+    futures: List[Future] = []
+    with path.open("rb") as handle:
+        while True:
+            data = handle.read(CHUNK_SIZE)
+            if not data:
+                break
+            stats.bytes_read += len(data)
+            futures.append(writer.submit(data))
+    return futures
+
+
+def bench(instance_dir: Path, sample_mb: int, threads: int) -> None:
+    """Print throughput and ratio of each chunk codec on a sample of the instance."""
+    sample: List[bytes] = []
+    budget = sample_mb * 1024 * 1024
+    for path in walk(instance_dir):
+        if budget <= 0:
+            break
+        if not path.is_file() or path.is_symlink():
+            continue
+        with path.open("rb") as handle:
+            while budget > 0:
+                data = handle.read(min(CHUNK_SIZE, budget))
+                if not data:
+                    break
+                sample.append(data)
+                budget -= len(data)
+    total = sum(len(data) for data in sample)
+    print(f"{'CHUNK CODEC':<28} {'IN MiB':>10} {'MB/s':>10} {'RATIO':>8}")
+    if not total:
+        return
+    specs = [("zlib", 1), ("zlib", 6), ("lzma", 1), ("lzma", 6), ("zstd", 3), ("zstd", 9)]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for codec, level in specs:
+            name = f"{codec} -{level}"
+            if codec not in available_codecs():
+                print(f"{name:<28} (not installed)")
+                continue
+            started = time.perf_counter()
+            out = sum(pool.map(lambda data: len(compress(data, codec, level)), sample))
+            seconds = max(time.perf_counter() - started, 1e-9)
+            print(f"{name:<28} {total / 1048576:>10.1f} {total / 1e6 / seconds:>10.1f} {total / max(out, 1):>8.2f}")
+
+
+def gc(backup_dir: Path = BACKUP_DIR) -> Tuple[int, int]:
+    """Delete chunks no manifest references; returns (chunks removed, bytes freed)."""
+    store = ChunkStore(backup_dir / "store")
+    removed = 0
+    freed = 0
+    with store_lock(backup_dir, exclusive=True):
+        referenced: Set[str] = set()
+        for path in manifests_for(backup_dir):
+            referenced |= load_manifest(path).chunk_ids()
+        for chunk_id in list(store.all_ids()):
+            if chunk_id in referenced:
+                continue
+            path = store.chunk_path(chunk_id)
+            freed += path.stat().st_size
+            path.unlink()
+            removed += 1
+    return removed, freed
+
+
+def prune(instance: str, keep: int, backup_dir: Path = BACKUP_DIR) -> List[Path]:
+    """Delete all but the newest `keep` manifests of an instance; returns the removed ones."""
+    with store_lock(backup_dir, exclusive=True):
+        manifests = manifests_for(backup_dir, instance)
+        stale = manifests[:-keep] if keep > 0 else manifests
+        for path in stale:
+            path.unlink()
+    return stale
+
+
+def verify(manifest_path: Path, backup_dir: Path = BACKUP_DIR) -> List[str]:
+    """Return the ids of missing or corrupt chunks referenced by a manifest."""
+    store = ChunkStore(backup_dir / "store")
+    bad: List[str] = []
+    for chunk_id in sorted(load_manifest(manifest_path).chunk_ids()):
+        try:
+            store.get(chunk_id)
+        except (OSError, ValueError, zlib.error, lzma.LZMAError):
+            bad.append(chunk_id)
+    return bad
+
+
+def human_bytes(value: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or unit == "GiB":
+            return f"{value:.1f} {unit}" if unit != "B" else f"{int(value)} B"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="chunk_store.py", description="Deduplicated instance backups.")
+    parser.add_argument("--backup-dir", type=Path, default=BACKUP_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    backup_cmd = sub.add_parser("backup", help="Create an incremental backup")
+    backup_cmd.add_argument("instance_dir", type=Path)
+    backup_cmd.add_argument("--codec", default="zlib", help=f"one of: {', '.join(available_codecs())}")
+    backup_cmd.add_argument("--level", type=int)
+    backup_cmd.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    backup_cmd.add_argument("--data-from", type=Path, help="back up this snapshot as data/")
+
+    bench_cmd = sub.add_parser("bench", help="Compare chunk codecs on a sample of an instance")
+    bench_cmd.add_argument("instance_dir", type=Path)
+    bench_cmd.add_argument("--sample-mb", type=int, default=256)
+    bench_cmd.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+
+    list_cmd = sub.add_parser("list", help="List manifest backups")
+    list_cmd.add_argument("instance", nargs="?")
+
+    prune_cmd = sub.add_parser("prune", help="Keep only the newest N backups of an instance")
+    prune_cmd.add_argument("instance")
+    prune_cmd.add_argument("--keep", type=int, required=True)
+
+    sub.add_parser("gc", help="Delete unreferenced chunks")
+
+    verify_cmd = sub.add_parser("verify", help="Check that every chunk of a backup is intact")
+    verify_cmd.add_argument("manifest", type=Path)
+
+    args = parser.parse_args(argv)
+    backup_dir: Path = args.backup_dir
+
+    if args.command == "backup":
+        instance_dir = args.instance_dir.resolve()
+        if not instance_dir.is_dir():
+            print(f"Instance directory not found: {instance_dir}", file=sys.stderr)
+            return 1
+        try:
+            manifest_path, stats = backup(
+                instance_dir,
+                backup_dir,
+                args.codec,
+                args.level,
+                args.threads,
+                args.data_from.resolve() if args.data_from else None,
+            )
+        except ValueError as exc:
+            print(str(exc), file=sys.stderr)
+            return 1
+        print(f"Backup created: {manifest_path}")
+        print(
+            f"{stats.files} files, {human_bytes(stats.bytes_total)} total; "
+            f"read {human_bytes(stats.bytes_read)}, stored {human_bytes(stats.bytes_stored)} new "
+            f"({stats.chunks_new} new / {stats.chunks_reused} reused chunks) in {stats.seconds:.1f}s"
+        )
+        return 0
+
+    if args.command == "bench":
+        print(f"Chunk store codecs, {args.threads} threads")
+        bench(args.instance_dir.resolve(), args.sample_mb, args.threads)
+        return 0
+
+    if args.command == "list":
+        for path in manifests_for(backup_dir, args.instance):
+            print(path.name)
+        return 0
+
+    if args.command == "prune":
+        for path in prune(args.instance, args.keep, backup_dir):
+            print(f"Removed {path.name}")
+        removed, freed = gc(backup_dir)
+        print(f"Removed {removed} unreferenced chunks ({human_bytes(freed)})")
+        return 0
+
+    if args.command == "gc":
+        removed, freed = gc(backup_dir)
+        print(f"Removed {removed} unreferenced chunks ({human_bytes(freed)})")
+        return 0
+
+    bad = verify(args.manifest, backup_dir)
+    if bad:
+        for chunk_id in bad:
+            print(f"missing or corrupt chunk: {chunk_id}", file=sys.stderr)
+        return 1
+    print(f"{args.manifest.name}: OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("chunk_store.py", main))
@@ -0,0 +1,525 @@
+"""Persistent console session to an instance's server.
+
+A small daemon per instance keeps one exec writer attached to the server's stdin
+(PID 1) and one log follower open (over the Engine API socket, or the docker CLI
+where the socket is not usable), and serves clients on .hsm/console/<instance>.sock.
+Commands are written straight into the open session, so sending one costs a socket
+round-trip instead of a new exec. The log lines that follow a command, until the output goes quiet (or a line matches
+--until), are returned as its response. The console command and the GUI start the
+daemon on first use; it exits after HSM_CONSOLE_IDLE seconds (default 900) without
+requests. `send --no-start` (used by manager.sh stop, backup and auth) goes through a
+running daemon, else attaches only for its own commands and leaves nothing behind.
+
+Usage:
+  console.py send <instance_dir> [-c CMD ...] [--no-wait] [--no-start] [--timeout S] [--quiet-ms N] [--until REGEX]
+  console.py shell <instance_dir>
+  console.py serve <instance_dir> [--idle SECS]
+  console.py stop <instance_dir>
+  console.py status <instance_dir>
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional
+
+from docker_api import DockerClient, DockerError, DockerStream, default_client, instance_container, read_env, socket_alive
+from tracing import detached_env, run_main
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+CONSOLE_DIR = ROOT_DIR / ".hsm" / "console"
+
+# Log lines kept for matching responses, and how long a client waits for a new daemon.
+BUFFER_LINES = 2000
+SPAWN_WAIT = 5.0
+# A command's response ends after this much log silence, or at the timeout.
+QUIET_MS = 150
+RESPONSE_TIMEOUT = 2.0
+# How long closing waits for the writer to pass on commands it already accepted.
+WRITER_DRAIN = 2.0
+IDLE_SECONDS = int(os.environ.get("HSM_CONSOLE_IDLE", "900"))
+
+
+class ConsoleError(Exception):
+    pass
+
+
+class NoSession(ConsoleError):
+    pass
+
+
+@dataclass
+class Response:
+    command: str
+    lines: List[str] = field(default_factory=list)
+    ms: float = 0.0
+    error: str = ""
+
+
+def socket_path(instance_dir: Path) -> Path:
+    return CONSOLE_DIR / f"{instance_dir.name}.sock"
+
+
+def env_value(instance_dir: Path, key: str) -> str:
+    return read_env(instance_dir).get(key, "")
+
+
+def container_id(instance_dir: Path, client: Optional[DockerClient] = None) -> str:
+    """Same lookup as manager.sh: HT_CONTAINER_NAME, else the compose service's container."""
+    if client is not None:
+        return instance_container(client, instance_dir)
+    override = env_value(instance_dir, "HT_CONTAINER_NAME")
+    if override:
+        return override
+    service = env_value(instance_dir, "HT_SERVICE_NAME") or "hytale"
+    result = subprocess.run(
+        ["docker", "compose", "-f", str(instance_dir / "docker-compose.yml"), "ps", "-q", service],
+        capture_output=True,
+        text=True,
+    )
+    lines = result.stdout.split()
+    return lines[0] if lines else ""
+
+
+class ConsoleSession:
+    """The server's stdin writer plus a log follower, reconnected when either exits.
+
+    Both go through the Engine API socket when it is usable (an exec with stdin
+    attached, and a followed logs stream); otherwise through the docker CLI.
+    """
+
+    def __init__(self, instance_dir: Path) -> None:
+        self.instance_dir = instance_dir
+        self.container = ""
+        self.lock = threading.Lock()
+        self._client = default_client()
+        self._lines: Deque[str] = deque(maxlen=BUFFER_LINES)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._writer: Optional[subprocess.Popen] = None
+        self._reader: Optional[subprocess.Popen] = None
+        self._writer_sock: Optional[socket.socket] = None
+        self._reader_stream: Optional[DockerStream] = None
+
+    def connected(self) -> bool:
+        if self._client is not None:
+            return (
+                self._writer_sock is not None
+                and socket_alive(self._writer_sock)
+                and self._reader_stream is not None
+                and not self._reader_stream.closed
+            )
+        return all(proc is not None and proc.poll() is None for proc in (self._writer, self._reader))
+
+    def connect(self) -> None:
+        if self.connected():
+            return
+        self.close()
+        try:
+            cid = container_id(self.instance_dir, self._client)
+        except DockerError as exc:
+            raise ConsoleError(str(exc)) from exc
+        if not cid:
+            raise ConsoleError(f"Container not found for {self.instance_dir}")
+        if self._client is not None:
+            self._connect_api(self._client, cid)
+        else:
+            self._connect_cli(cid)
+        self.container = cid
+
+    def _connect_api(self, client: DockerClient, cid: str) -> None:
+        try:
+            # Follow first so the response to the first command cannot be missed.
+            self._reader_stream = client.logs(cid, follow=True, tail=0)
+            threading.Thread(target=self._follow, args=(self._reader_stream,), name="console-logs", daemon=True).start()
+            # `cat` prints nothing, so there is no early output to keep.
+            self._writer_sock, _ = client.exec_socket(cid, ["sh", "-c", "cat > /proc/1/fd/0"])
+        except DockerError as exc:
+            self.close()
+            raise ConsoleError(str(exc)) from exc
+
+    def _connect_cli(self, cid: str) -> None:
+        self._reader = subprocess.Popen(
+            ["docker", "logs", "-f", "--tail", "0", cid],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            stdin=subprocess.DEVNULL,
+        )
+        assert self._reader.stdout is not None
+        lines = (raw.decode(errors="replace").rstrip("\r\n") for raw in self._reader.stdout)
+        threading.Thread(target=self._follow, args=(lines,), name="console-logs", daemon=True).start()
+        self._writer = subprocess.Popen(
+            ["docker", "exec", "-i", cid, "sh", "-c", "cat > /proc/1/fd/0"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        try:
+            self._writer.wait(timeout=0.2)
+        except subprocess.TimeoutExpired:
+            return
+        error = self._writer.stderr.read().decode(errors="replace").strip() if self._writer.stderr else ""
+        self.close()
+        raise ConsoleError(error or f"Could not attach to the console of {cid}")
+
+    def close(self) -> None:
+        # End the writer's input first so its `cat` delivers what was written, then exits.
+        if self._writer is not None and self._writer.poll() is None and self._writer.stdin is not None:
+            try:
+                self._writer.stdin.close()
+                self._writer.wait(timeout=WRITER_DRAIN)
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        if self._writer_sock is not None:
+            try:
+                self._writer_sock.shutdown(socket.SHUT_WR)
+                self._writer_sock.settimeout(WRITER_DRAIN)
+                while self._writer_sock.recv(4096):
+                    pass
+            except OSError:
+                pass
+            self._writer_sock.close()
+        for proc in (self._writer, self._reader):
+            if proc is not None and proc.poll() is None:
+                proc.terminate()
+        if self._reader_stream is not None:
+            self._reader_stream.close()
+        self._writer = self._reader = None
+        self._writer_sock = None
+        self._reader_stream = None
+        self.container = ""
+
+    def write(self, command: str) -> int:
+        """Writes one command; returns the log position to collect its response from."""
+        data = f"{command}\r\n".encode()
+        for attempt in (1, 2):
+            self.connect()
+            with self._cond:
+                seq = self._seq
+            try:
+                if self._writer_sock is not None:
+                    self._writer_sock.sendall(data)
+                else:
+                    assert self._writer is not None and self._writer.stdin is not None
+                    self._writer.stdin.write(data)
+                    self._writer.stdin.flush()
+                return seq
+            except OSError:
+                # The container restarted under us; attach to the new one once.
+                self.close()
+                if attempt == 2:
+                    raise ConsoleError("Console session lost")
+        return 0
+
+    def collect(self, after: int, timeout: float, quiet_ms: int, until: str) -> List[str]:
+        pattern = re.compile(until) if until else None
+        deadline = time.monotonic() + timeout
+        last_output = 0.0
+        lines: List[str] = []
+        with self._cond:
+            while True:
+                new = self._seq - after
+                if new:
+                    lines.extend(list(self._lines)[-min(new, len(self._lines)):])
+                    after = self._seq
+                    last_output = time.monotonic()
+                    if pattern and any(pattern.search(line) for line in lines):
+                        break
+                now = time.monotonic()
+                if now >= deadline or (lines and not pattern and now - last_output >= quiet_ms / 1000):
+                    break
+                wait = deadline - now
+                if lines and not pattern:
+                    wait = min(wait, last_output + quiet_ms / 1000 - now)
+                self._cond.wait(wait)
+        return lines
+
+    def run(
+        self,
+        commands: Iterable[str],
+        wait: bool = True,
+        timeout: float = RESPONSE_TIMEOUT,
+        quiet_ms: int = QUIET_MS,
+        until: str = "",
+    ) -> Iterator[Response]:
+        """Writes each command in turn and yields its response (no lines without wait)."""
+        for command in commands:
+            started = time.perf_counter()
+            after = self.write(command)
+            lines = self.collect(after, timeout, quiet_ms, until) if wait else []
+            yield Response(command, lines, (time.perf_counter() - started) * 1000)
+
+    def _follow(self, lines: Iterable[str]) -> None:
+        try:
+            for line in lines:
+                with self._cond:
+                    self._lines.append(line)
+                    self._seq += 1
+                    self._cond.notify_all()
+        except (OSError, DockerError):
+            pass
+
+
+class ConsoleServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path, session: ConsoleSession) -> None:
+        self.session = session
+        self.last_used = time.monotonic()
+        self.stopping = False
+        super().__init__(str(path), ConsoleHandler)
+
+
+class ConsoleHandler(socketserver.StreamRequestHandler):
+    server: ConsoleServer
+
+    def reply(self, message: Dict[str, Any]) -> None:
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        self.server.last_used = time.monotonic()
+        try:
+            request = json.loads(self.rfile.readline() or b"{}")
+        except ValueError:
+            self.reply({"done": True, "error": "Invalid request"})
+            return
+        session = self.server.session
+        op = request.get("op", "send")
+        if op == "stop":
+            self.server.stopping = True
+            # New clients must start a fresh daemon rather than queue on this one.
+            Path(self.server.server_address).unlink(missing_ok=True)
+            self.reply({"done": True})
+            return
+        if op == "status":
+            self.reply({"done": True, "pid": os.getpid(), "container": session.container, "connected": session.connected()})
+            return
+
+        responses = session.run(
+            request.get("commands", []),
+            request.get("wait", True),
+            float(request.get("timeout", RESPONSE_TIMEOUT)),
+            int(request.get("quiet_ms", QUIET_MS)),
+            request.get("until", ""),
+        )
+        # One client at a time owns the console, so responses cannot interleave.
+        with session.lock:
+            try:
+                for response in responses:
+                    self.reply(asdict(response))
+            except ConsoleError as exc:
+                self.reply({"done": True, "error": str(exc)})
+                return
+        self.server.last_used = time.monotonic()
+        self.reply({"done": True})
+
+
+def serve(instance_dir: Path, idle: int = IDLE_SECONDS) -> int:
+    CONSOLE_DIR.mkdir(parents=True, exist_ok=True)
+    path = socket_path(instance_dir)
+    lock_file = open(path.with_suffix(".lock"), "w")
+    deadline = time.monotonic() + SPAWN_WAIT
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except OSError:
+            # Another daemon serves this instance, unless it is shutting down
+            # (socket already removed); then take over once it has exited.
+            if path.exists() or time.monotonic() >= deadline:
+                return 0
+            time.sleep(0.05)
+    path.unlink(missing_ok=True)
+    session = ConsoleSession(instance_dir)
+    # Only the owner may connect; the socket is created with these permissions.
+    umask = os.umask(0o077)
+    try:
+        server = ConsoleServer(path, session)
+    finally:
+        os.umask(umask)
+    server.timeout = 1.0
+    try:
+        while not server.stopping and time.monotonic() - server.last_used < idle:
+            server.handle_request()
+    finally:
+        path.unlink(missing_ok=True)
+        server.server_close()
+        session.close()
+    return 0
+
+
+def open_socket(instance_dir: Path, start: bool = True) -> socket.socket:
+    path = socket_path(instance_dir)
+    deadline = time.monotonic() + SPAWN_WAIT
+    spawned = False
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(str(path))
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+        if not start:
+            raise NoSession(f"No console session for {instance_dir.name}")
+        if not spawned:
+            CONSOLE_DIR.mkdir(parents=True, exist_ok=True)
+            with open(CONSOLE_DIR / f"{instance_dir.name}.log", "ab") as log:
+                subprocess.Popen(
+                    [sys.executable, str(Path(__file__).resolve()), "serve", str(instance_dir)],
+                    stdin=subprocess.DEVNULL,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    cwd=str(ROOT_DIR),
+                    env=detached_env(),
+                    start_new_session=True,
+                )
+            spawned = True
+        if time.monotonic() >= deadline:
+            raise ConsoleError(f"Console daemon for {instance_dir.name} did not start")
+        time.sleep(0.02)
+
+
+def request(instance_dir: Path, payload: Dict[str, Any], start: bool = True) -> Iterator[Dict[str, Any]]:
+    """Sends one request and yields the daemon's replies up to (and including) the final one."""
+    with open_socket(instance_dir, start) as sock:
+        sock.sendall(json.dumps(payload).encode() + b"\n")
+        with sock.makefile("rb") as replies:
+            for raw in replies:
+                message = json.loads(raw)
+                yield message
+                if message.get("done"):
+                    return
+    raise ConsoleError("Console daemon closed the connection")
+
+
+def send(
+    instance_dir: Path,
+    commands: List[str],
+    wait: bool = True,
+    timeout: float = RESPONSE_TIMEOUT,
+    quiet_ms: int = QUIET_MS,
+    until: str = "",
+    start: bool = True,
+) -> List[Response]:
+    """Runs commands in order over the instance's console session.
+
+    Without a running daemon, one is started; with start=False the commands use a
+    session of their own that is closed again afterwards.
+    """
+    payload = {"commands": commands, "wait": wait, "timeout": timeout, "quiet_ms": quiet_ms, "until": until}
+    responses: List[Response] = []
+    try:
+        for message in request(instance_dir, payload, start):
+            if message.get("error"):
+                raise ConsoleError(message["error"])
+            if not message.get("done"):
+                responses.append(Response(**message))
+    except NoSession:
+        session = ConsoleSession(instance_dir)
+        try:
+            return list(session.run(commands, wait, timeout, quiet_ms, until))
+        finally:
+            session.close()
+    return responses
+
+
+def print_responses(responses: List[Response], headers: bool) -> None:
+    for response in responses:
+        if headers:
+            print(f"> {response.command}")
+        for line in response.lines:
+            print(line)
+    sys.stdout.flush()
+
+
+def shell(instance_dir: Path) -> int:
+    try:
+        import readline  # noqa: F401  (line editing and history for input())
+    except ImportError:
+        pass
+    print(f"Console for {instance_dir.name}. Ctrl-D to leave (the server keeps running).")
+    while True:
+        try:
+            command = input(f"{instance_dir.name}> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return 0
+        if not command:
+            continue
+        try:
+            print_responses(send(instance_dir, [command]), headers=False)
+        except ConsoleError as exc:
+            print(str(exc), file=sys.stderr)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="console.py", description="Persistent server console sessions.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    send_cmd = sub.add_parser("send", help="Send commands (from -c, else one per stdin line)")
+    send_cmd.add_argument("instance_dir", type=Path)
+    send_cmd.add_argument("-c", "--command", dest="commands", action="append", default=[], help="repeatable")
+    send_cmd.add_argument("--no-wait", action="store_true", help="do not wait for responses")
+    send_cmd.add_argument("--no-start", action="store_true", help="do not start a daemon; attach for these commands only")
+    send_cmd.add_argument("--timeout", type=float, default=RESPONSE_TIMEOUT, help="max seconds per response")
+    send_cmd.add_argument("--quiet-ms", type=int, default=QUIET_MS, help="silence that ends a response")
+    send_cmd.add_argument("--until", default="", help="end each response at the first line matching REGEX")
+
+    for name, help_text in (
+        ("shell", "Interactive console"),
+        ("serve", "Run the session daemon in the foreground"),
+        ("stop", "Stop the session daemon"),
+        ("status", "Show the session daemon"),
+    ):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("instance_dir", type=Path)
+        if name == "serve":
+            cmd.add_argument("--idle", type=int, default=IDLE_SECONDS)
+
+    args = parser.parse_args(argv)
+    instance_dir = args.instance_dir.resolve()
+
+    if args.command == "serve":
+        return serve(instance_dir, args.idle)
+    if args.command == "shell":
+        return shell(instance_dir)
+    try:
+        if args.command in ("stop", "status"):
+            try:
+                reply = next(request(instance_dir, {"op": args.command}, start=False))
+            except ConsoleError:
+                print(f"No console session for {instance_dir.name}.")
+                return 0
+            if args.command == "status":
+                state = "attached" if reply["connected"] else "not attached"
+                print(f"Console daemon pid {reply['pid']}, {state} {reply['container']}".rstrip())
+            return 0
+
+        commands = args.commands or [line.strip() for line in sys.stdin if line.strip()]
+        started = time.perf_counter()
+        responses = send(
+            instance_dir, commands, not args.no_wait, args.timeout, args.quiet_ms, args.until, start=not args.no_start
+        )
+        print_responses(responses, headers=len(commands) > 1 and not args.no_wait)
+        if args.no_wait:
+            print(f"Sent {len(responses)} command(s) in {(time.perf_counter() - started) * 1000:.0f} ms", file=sys.stderr)
+    except (ConsoleError, OSError) as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("console.py", main))
@@ -0,0 +1,503 @@
+"""Minimal Docker Engine API client over the local unix socket.
+
+Requests reuse one keep-alive connection instead of forking the docker CLI for
+every call; streaming endpoints (events, logs, exec) get a connection of their
+own. Only what the manager and GUI need is covered: ping, version, container
+list/inspect, events, logs and exec. The socket comes from DOCKER_HOST (unix://
+only) or /var/run/docker.sock. `default_client()` returns None when there is no
+usable socket (e.g. a tcp:// host or Docker Desktop's named pipe), and callers
+fall back to the CLI. Compose operations (up/stop/down) stay with `docker compose`.
+
+Usage:
+  docker_api.py ping
+  docker_api.py ps [--all]
+  docker_api.py inspect <container> [--field State.Status]
+  docker_api.py status [--json] [--watch [SECS]]   (manager.sh status; one `docker ps` without a socket)
+"""
+
+import argparse
+import http.client
+import json
+import os
+import re
+import select
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+import registry
+from tracing import run_main
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+INSTANCES_DIR = ROOT_DIR / "instances"
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+# Oldest API with everything used here (Docker 20.10); newer daemons accept it.
+API_VERSION = "v1.41"
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+COMPOSE_SERVICE_LABEL = "com.docker.compose.service"
+# Exit code of the CLI when the API cannot be used, so manager.sh falls back to the docker CLI.
+EXIT_UNAVAILABLE = 3
+
+
+class DockerError(Exception):
+    def __init__(self, message: str, status: int = 0) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerStream:
+    """A streaming response on its own connection; iterating yields decoded lines.
+
+    Multiplexed (non-TTY) log and exec streams are demuxed into stdout/stderr lines.
+    `close()` may be called from another thread to end a blocked iteration.
+    """
+
+    def __init__(
+        self,
+        conn: UnixHTTPConnection,
+        sock: Optional[socket.socket],
+        response: http.client.HTTPResponse,
+        multiplexed: bool,
+    ) -> None:
+        self._conn = conn
+        self._sock = sock
+        self._response = response
+        self.multiplexed = multiplexed
+        self.closed = False
+        self._iterating = False
+
+    def __iter__(self) -> Iterator[str]:
+        self._iterating = True
+        try:
+            if self.multiplexed:
+                yield from self._frames()
+            else:
+                for raw in iter(self._response.readline, b""):
+                    yield raw.decode(errors="replace").rstrip("\r\n")
+        except (OSError, http.client.HTTPException, ValueError, AttributeError):
+            if not self.closed:
+                raise
+        finally:
+            self._iterating = False
+            self.closed = True
+            self._conn.close()
+
+    def _frames(self) -> Iterator[str]:
+        pending: Dict[int, bytes] = {}
+        while True:
+            header = self._response.read(8)
+            if len(header) < 8:
+                break
+            kind, size = struct.unpack(">BxxxL", header)
+            data = pending.get(kind, b"") + self._response.read(size)
+            *lines, pending[kind] = data.split(b"\n")
+            for line in lines:
+                yield line.decode(errors="replace").rstrip("\r")
+        for rest in pending.values():
+            if rest:
+                yield rest.decode(errors="replace").rstrip("\r")
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        if self._sock is not None:
+            try:
+                # Wakes a reader blocked in recv() on another thread, which then
+                # closes the connection itself.
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if not self._iterating:
+            self._conn.close()
+
+
+class DockerClient:
+    """Engine API calls over one reused connection (thread-safe; streams use their own)."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = 30.0) -> None:
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._conn: Optional[UnixHTTPConnection] = None
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def _url(self, path: str, params: Optional[Dict[str, Any]] = None) -> str:
+        url = f"/{API_VERSION}{path}"
+        query = {key: value for key, value in (params or {}).items() if value is not None}
+        return f"{url}?{urlencode(query)}" if query else url
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+    ) -> Any:
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        url = self._url(path, params)
+        with self._lock:
+            reused = self._conn is not None
+            while True:
+                if self._conn is None:
+                    self._conn = UnixHTTPConnection(self.socket_path, self.timeout)
+                try:
+                    self._conn.request(method, url, body=payload, headers=headers)
+                    response = self._conn.getresponse()
+                    data = response.read()
+                    break
+                except (OSError, http.client.HTTPException) as exc:
+                    self._conn.close()
+                    self._conn = None
+                    if not reused:
+                        raise DockerError(f"Docker API unreachable at {self.socket_path}: {exc}") from exc
+                    # The daemon closed the idle keep-alive connection; retry once on a fresh one.
+                    reused = False
+        return decode_response(response.status, data)
+
+    def stream(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        body: Optional[Any] = None,
+        multiplexed: bool = False,
+    ) -> DockerStream:
+        conn = UnixHTTPConnection(self.socket_path, None)
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload is not None else {}
+        try:
+            conn.request(method, self._url(path, params), body=payload, headers=headers)
+            sock = conn.sock
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException) as exc:
+            conn.close()
+            raise DockerError(f"Docker API unreachable at {self.socket_path}: {exc}") from exc
+        if response.status >= 400:
+            data = response.read()
+            conn.close()
+            decode_response(response.status, data)
+        return DockerStream(conn, sock, response, multiplexed)
+
+    def ping(self) -> bool:
+        try:
+            return self.request("GET", "/_ping") == "OK"
+        except DockerError:
+            return False
+
+    def version(self) -> Dict[str, Any]:
+        return self.request("GET", "/version")
+
+    def containers(self, all: bool = False, filters: Optional[Dict[str, List[str]]] = None) -> List[Dict[str, Any]]:
+        params = {"all": "1" if all else None, "filters": json.dumps(filters) if filters else None}
+        return self.request("GET", "/containers/json", params)
+
+    def inspect(self, container: str) -> Dict[str, Any]:
+        return self.request("GET", f"/containers/{quote(container)}/json")
+
+    def events(self, since: Optional[str] = None, filters: Optional[Dict[str, List[str]]] = None) -> DockerStream:
+        """Newline-delimited JSON events (one per line), until closed."""
+        params = {"since": since, "filters": json.dumps(filters) if filters else None}
+        return self.stream("GET", "/events", params)
+
+    def logs(
+        self,
+        container: str,
+        follow: bool = False,
+        tail: Any = "all",
+        since: Optional[str] = None,
+        tty: Optional[bool] = None,
+    ) -> DockerStream:
+        if tty is None:
+            tty = bool(self.inspect(container).get("Config", {}).get("Tty"))
+        params = {
+            "stdout": "1",
+            "stderr": "1",
+            "follow": "1" if follow else None,
+            "tail": str(tail),
+            "since": since,
+        }
+        return self.stream("GET", f"/containers/{quote(container)}/logs", params, multiplexed=not tty)
+
+    def exec_run(self, container: str, cmd: List[str]) -> Tuple[int, str]:
+        """Runs a command in the container and returns (exit code, combined output)."""
+        created = self.request(
+            "POST",
+            f"/containers/{quote(container)}/exec",
+            body={"Cmd": cmd, "AttachStdout": True, "AttachStderr": True},
+        )
+        stream = self.stream("POST", f"/exec/{created['Id']}/start", body={"Detach": False, "Tty": False}, multiplexed=True)
+        output = "\n".join(stream)
+        exit_code = self.request("GET", f"/exec/{created['Id']}/json").get("ExitCode")
+        return (exit_code if exit_code is not None else -1), output
+
+    def exec_socket(self, container: str, cmd: List[str]) -> Tuple[socket.socket, bytes]:
+        """Starts a command with stdin attached; returns the hijacked socket and any stream
+        bytes that arrived together with the response headers."""
+        created = self.request(
+            "POST",
+            f"/containers/{quote(container)}/exec",
+            body={"Cmd": cmd, "AttachStdin": True, "AttachStdout": True, "AttachStderr": True},
+        )
+        payload = json.dumps({"Detach": False, "Tty": False}).encode()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.sendall(
+                (
+                    f"POST {self._url('/exec/' + created['Id'] + '/start')} HTTP/1.1\r\n"
+                    "Host: localhost\r\n"
+                    "Content-Type: application/json\r\n"
+                    "Connection: Upgrade\r\n"
+                    "Upgrade: tcp\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n"
+                ).encode()
+                + payload
+            )
+            head = b""
+            while b"\r\n\r\n" not in head:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise DockerError("Docker closed the exec connection")
+                head += chunk
+        except OSError as exc:
+            sock.close()
+            raise DockerError(f"Docker API unreachable at {self.socket_path}: {exc}") from exc
+        head, _, rest = head.partition(b"\r\n\r\n")
+        status_line = head.split(b"\r\n", 1)[0].decode(errors="replace")
+        status = int(status_line.split(" ", 2)[1])
+        if status not in (101, 200):
+            sock.close()
+            raise DockerError(f"exec start failed: {status_line}", status)
+        return sock, rest
+
+
+def decode_response(status: int, data: bytes) -> Any:
+    text = data.decode(errors="replace")
+    try:
+        value = json.loads(text) if text else None
+    except ValueError:
+        value = text
+    if status >= 400:
+        message = value.get("message", text) if isinstance(value, dict) else text
+        raise DockerError(f"Docker API error {status}: {str(message).strip()}", status)
+    return value
+
+
+def socket_alive(sock: socket.socket) -> bool:
+    """True unless the peer has closed the socket (checked without blocking)."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return not readable or sock.recv(1, socket.MSG_PEEK) != b""
+    except (OSError, ValueError):
+        return False
+
+
+def docker_socket() -> Optional[str]:
+    host = os.environ.get("DOCKER_HOST", "")
+    if host and not host.startswith("unix://"):
+        return None
+    path = host[len("unix://"):] if host else DEFAULT_SOCKET
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    return path
+
+
+def default_client(timeout: float = 30.0) -> Optional[DockerClient]:
+    path = docker_socket()
+    return DockerClient(path, timeout) if path else None
+
+
+def read_env(instance_dir: Path) -> Dict[str, str]:
+    # Served from the registry index; the file is re-parsed only after it changed.
+    return dict(registry.env(instance_dir))
+
+
+def compose_project(instance_dir: Path, env: Dict[str, str]) -> str:
+    # Mirrors docker compose's normalization of the default project name (the folder name).
+    return env.get("COMPOSE_PROJECT_NAME") or re.sub(r"[^a-z0-9_-]", "", instance_dir.name.lower())
+
+
+def instance_container(client: DockerClient, instance_dir: Path) -> str:
+    """The instance's container (same lookup as manager.sh), or "" if it does not exist."""
+    env = read_env(instance_dir)
+    if env.get("HT_CONTAINER_NAME"):
+        return env["HT_CONTAINER_NAME"]
+    labels = [
+        f"{COMPOSE_PROJECT_LABEL}={compose_project(instance_dir, env)}",
+        f"{COMPOSE_SERVICE_LABEL}={env.get('HT_SERVICE_NAME') or 'hytale'}",
+    ]
+    found = client.containers(all=True, filters={"label": labels})
+    return found[0]["Id"] if found else ""
+
+
+def container_states(
+    client: Optional[DockerClient],
+) -> Optional[Tuple[Dict[str, str], Dict[Tuple[str, str], Tuple[str, str]]]]:
+    """States by container name and (name, state) by compose (project, service).
+
+    One container list from the Engine API, or one `docker ps -a` without a client;
+    None if Docker cannot be asked.
+    """
+    state_by_name: Dict[str, str] = {}
+    by_service: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    if client is not None:
+        try:
+            containers = client.containers(all=True)
+        except DockerError:
+            return None
+        listed = [
+            (
+                (container.get("Names") or ["/"])[0].lstrip("/"),
+                container.get("State", ""),
+                (container.get("Labels") or {}).get(COMPOSE_PROJECT_LABEL, ""),
+                (container.get("Labels") or {}).get(COMPOSE_SERVICE_LABEL, ""),
+            )
+            for container in containers
+        ]
+    else:
+        template = f'{{{{.Names}}}}\t{{{{.State}}}}\t{{{{.Label "{COMPOSE_PROJECT_LABEL}"}}}}\t{{{{.Label "{COMPOSE_SERVICE_LABEL}"}}}}'
+        try:
+            result = subprocess.run(["docker", "ps", "-a", "--format", template], capture_output=True, text=True)
+        except OSError:
+            return None
+        if result.returncode != 0:
+            return None
+        listed = [tuple((line.split("\t") + ["", "", ""])[:4]) for line in result.stdout.splitlines() if line]
+    for name, state, project, service in listed:
+        state_by_name[name] = state
+        if project:
+            by_service[(project, service)] = (name, state)
+    return state_by_name, by_service
+
+
+def status_rows(client: Optional[DockerClient], instances_dir: Path = INSTANCES_DIR) -> List[Dict[str, str]]:
+    """Rows of `manager.sh status`: one container list for the whole fleet.
+
+    manager.sh keeps an awk copy of this for hosts without python3.
+    """
+    dirs = sorted(path for path in instances_dir.iterdir() if path.is_dir()) if instances_dir.is_dir() else []
+    if not dirs:
+        return []
+    states = container_states(client)
+    state_by_name, by_service = states or ({}, {})
+    docker_ok = states is not None
+    rows: List[Dict[str, str]] = []
+    for instance_dir in dirs:
+        env = read_env(instance_dir)
+        service = env.get("HT_SERVICE_NAME") or "hytale"
+        container = env.get("HT_CONTAINER_NAME", "")
+        status = "not found"
+        if not docker_ok:
+            status = "unknown"
+        elif container:
+            status = state_by_name.get(container, status)
+        elif (compose_project(instance_dir, env), service) in by_service:
+            container, status = by_service[(compose_project(instance_dir, env), service)]
+        rows.append({
+            "instance": instance_dir.name,
+            "service": service,
+            "container": container,
+            "status": status,
+            "port": env.get("HOST_PORT", ""),
+            "auth": "ok" if env.get("HYTALE_SERVER_SESSION_TOKEN") else "missing",
+        })
+    return rows
+
+
+def print_status(rows: List[Dict[str, str]], json_output: bool) -> None:
+    if json_output:
+        print(json.dumps(rows, separators=(",", ":")))
+        return
+    line = "%-30s %-20s %-20s %-10s %-10s %-8s"
+    print(line % ("INSTANCE", "SERVICE", "CONTAINER", "STATUS", "PORT", "AUTH"))
+    for row in rows:
+        print(line % (row["instance"], row["service"], row["container"] or "-", row["status"], row["port"], row["auth"]))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="docker_api.py", description="Docker Engine API client.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("ping", help="Check that the Engine API answers")
+    ps_cmd = sub.add_parser("ps", help="List containers")
+    ps_cmd.add_argument("--all", "-a", action="store_true")
+    inspect_cmd = sub.add_parser("inspect", help="Inspect a container")
+    inspect_cmd.add_argument("container")
+    inspect_cmd.add_argument("--field", default="", help="dotted path, e.g. State.Status")
+    status_cmd = sub.add_parser("status", help="Instance status (same output as manager.sh status)")
+    status_cmd.add_argument("--json", action="store_true")
+    status_cmd.add_argument("--watch", nargs="?", type=float, const=2.0, default=None)
+
+    args = parser.parse_args(argv)
+    client = default_client()
+    if client is not None and not client.ping():
+        client.close()
+        client = None
+    if client is None and args.command != "status":
+        print("Docker Engine API not reachable (set DOCKER_HOST=unix://...).", file=sys.stderr)
+        return EXIT_UNAVAILABLE
+
+    try:
+        if args.command == "ping":
+            print("OK")
+        elif args.command == "ps":
+            assert client is not None
+            for container in client.containers(all=args.all):
+                name = (container.get("Names") or ["/"])[0].lstrip("/")
+                print(f"{container['Id'][:12]}\t{name}\t{container.get('State', '')}\t{container.get('Image', '')}")
+        elif args.command == "inspect":
+            assert client is not None
+            value: Any = client.inspect(args.container)
+            for key in filter(None, args.field.split(".")):
+                value = value.get(key) if isinstance(value, dict) else None
+            print(value if isinstance(value, str) else json.dumps(value, indent=None if args.field else 2))
+        elif args.watch is None:
+            print_status(status_rows(client), args.json)
+        else:
+            # With the API, one connection for the whole watch instead of a docker fork per refresh.
+            while True:
+                rows = status_rows(client)
+                if not args.json:
+                    sys.stdout.write("\033[H\033[2J")
+                    print(f"Every {args.watch:g}s: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+                print_status(rows, args.json)
+                sys.stdout.flush()
+                time.sleep(args.watch)
+    except DockerError as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        if client is not None:
+            client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("docker_api.py", main))
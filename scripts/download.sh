@@ -5,16 +5,27 @@ INSTANCE_DIR=${1:-"$(pwd)"}
 ENV_FILE="$INSTANCE_DIR/.env"
 SERVER_DIR="$INSTANCE_DIR/server"
 CLEAN=0
+STAGE=0
 ROOT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)
+. "$ROOT_DIR/scripts/tracing.sh"
 DOWNLOADER_URL="https://downloader.hytale.com/hytale-downloader.zip"
 DOWNLOADER_DIR="$ROOT_DIR/tools/hytale-downloader"
 DOWNLOADER_BIN="$DOWNLOADER_DIR/hytale-downloader"
+CACHE_DIR=${HSM_DOWNLOAD_CACHE:-"$ROOT_DIR/.hsm/downloads"}
+CACHE_KEEP=${HSM_DOWNLOAD_CACHE_KEEP:-3}
+STORE_DIR="$ROOT_DIR/store/servers"
 
-"$ROOT_DIR/scripts/check-requirements.sh" --prompt
+trace_init "download.sh ${INSTANCE_DIR##*/}"
+traced "$ROOT_DIR/scripts/check-requirements.sh" --prompt
 
-if [[ "${2:-}" == "--clean" ]]; then
-  CLEAN=1
-fi
+for arg in "${@:2}"; do
+  case "$arg" in
+    --clean) CLEAN=1 ;;
+    # Build the new server tree in server.next/ (keeping this instance's own
+    # files) without touching the running server/.
+    --stage) STAGE=1 ;;
+  esac
+done
 
 if [[ ! -f "$ENV_FILE" ]]; then
   echo "Missing $ENV_FILE" >&2
@@ -26,6 +37,10 @@ set -a
 . "$ENV_FILE"
 set +a
 
+if [[ $STAGE -eq 1 ]]; then
+  CURRENT_SERVER_DIR=$SERVER_DIR
+  SERVER_DIR="$INSTANCE_DIR/server.next"
+fi
 mkdir -p "$SERVER_DIR"
 
 TMP_DIR=$(mktemp -d)
@@ -34,7 +49,7 @@ TMP_FILE="$TMP_DIR/download"
 cleanup() {
   rm -rf "$TMP_DIR"
 }
-trap cleanup EXIT
+trace_trap_exit cleanup
 
 is_truthy() {
   case "${1,,}" in
@@ -43,25 +58,117 @@ is_truthy() {
   esac
 }
 
-if [[ -n "${HT_SERVER_URL:-}" ]]; then
-  URL_NO_QUERY="${HT_SERVER_URL%%\?*}"
-  BASENAME=$(basename "$URL_NO_QUERY")
+file_sha256() {
+  sha256sum "$1" | cut -d' ' -f1
+}
 
-  if [[ -n "$BASENAME" && "$BASENAME" != "/" ]]; then
-    TMP_FILE="$TMP_DIR/$BASENAME"
+# Holds an exclusive lock on a cache entry until the script exits, so parallel
+# setups/updates of several instances download each archive only once.
+lock_cache_entry() {
+  mkdir -p "$1"
+  if command -v flock >/dev/null 2>&1; then
+    exec 9>"$1/.lock"
+    flock 9
   fi
+}
+
+# A cached archive is valid if it matches the expected hash, or (without one)
+# the hash recorded when it was downloaded. Corrupt entries are removed.
+cache_valid() {
+  local file=$1 expected=${2:-}
+  [[ -f "$file" ]] || return 1
+  if [[ -z "$expected" && -f "$file.sha256" ]]; then
+    expected=$(cat "$file.sha256")
+  fi
+  if [[ -n "$expected" && "$(file_sha256 "$file")" != "${expected,,}" ]]; then
+    echo "Cached archive failed verification; downloading again: $file" >&2
+    rm -f "$file" "$file.sha256"
+    return 1
+  fi
+  return 0
+}
+
+# Records the hash of a fresh download and drops all but the newest entries.
+cache_store() {
+  local file=$1 entry
+  file_sha256 "$file" > "$file.sha256"
+  touch "$(dirname "$file")"
+  [[ "$CACHE_KEEP" =~ ^[0-9]+$ && "$CACHE_KEEP" -gt 0 ]] || return 0
+  while IFS= read -r entry; do
+    [[ "$entry" == "$(dirname "$file")" ]] && continue
+    # Skip entries another setup/update is still reading.
+    if command -v flock >/dev/null 2>&1; then
+      flock -n "$entry/.lock" rm -rf "$entry" || true
+    else
+      rm -rf "$entry"
+    fi
+  done < <(find "$CACHE_DIR" -mindepth 1 -maxdepth 1 -type d -printf '%T@ %p\n' | sort -rn | tail -n +"$((CACHE_KEEP + 1))" | cut -d' ' -f2-)
+}
 
+# Downloads url to dest, resuming a previous partial download (dest.part).
+# Returns 1 without downloading if dest exists and the server has nothing newer.
+fetch_url() {
+  local url=$1 dest=$2 part="$2.part"
+  local curl_args=(-L --fail --progress-bar -R)
   if command -v curl >/dev/null 2>&1; then
-    curl -L --fail --progress-bar -o "$TMP_FILE" "$HT_SERVER_URL"
+    if [[ -f "$dest" && ! -f "$part" ]]; then
+      curl "${curl_args[@]}" -z "$dest" -o "$part" "$url" || { rm -f "$part"; echo "Download failed: $url" >&2; exit 1; }
+      if [[ ! -s "$part" ]]; then
+        rm -f "$part"
+        return 1
+      fi
+    elif ! curl "${curl_args[@]}" -C - -o "$part" "$url"; then
+      # The server may not support ranges or the partial file is stale; retry from scratch once.
+      rm -f "$part"
+      curl "${curl_args[@]}" -o "$part" "$url" || { rm -f "$part"; echo "Download failed: $url" >&2; exit 1; }
+    fi
   elif command -v wget >/dev/null 2>&1; then
-    wget -O "$TMP_FILE" "$HT_SERVER_URL"
+    wget -c -O "$part" "$url" || { echo "Download failed: $url" >&2; exit 1; }
   else
     echo "Need curl or wget to download server files." >&2
     exit 1
   fi
+  mv -f "$part" "$dest"
+}
+
+trace_functions lock_cache_entry cache_valid cache_store fetch_url
 
+if [[ -n "${HT_SERVER_URL:-}" ]]; then
+  URL_NO_QUERY="${HT_SERVER_URL%%\?*}"
+  BASENAME=$(basename "$URL_NO_QUERY")
+
+  if [[ -z "$BASENAME" || "$BASENAME" == "/" ]]; then
+    BASENAME=download
+  fi
+
+  # With a pinned hash the archive is immutable and shared by every instance
+  # using it; otherwise the entry is keyed by URL and revalidated with the server.
   if [[ -n "${HT_SERVER_SHA256:-}" ]]; then
-    echo "${HT_SERVER_SHA256}  $TMP_FILE" | sha256sum -c -
+    CACHE_ENTRY="$CACHE_DIR/sha256-${HT_SERVER_SHA256,,}"
+  else
+    CACHE_ENTRY="$CACHE_DIR/url-$(printf '%s' "$HT_SERVER_URL" | sha256sum | cut -c1-16)"
+  fi
+  TMP_FILE="$CACHE_ENTRY/$BASENAME"
+  lock_cache_entry "$CACHE_ENTRY"
+
+  if [[ -n "${HT_SERVER_SHA256:-}" ]]; then
+    if cache_valid "$TMP_FILE" "$HT_SERVER_SHA256"; then
+      echo "Using cached server archive: $TMP_FILE"
+    else
+      fetch_url "$HT_SERVER_URL" "$TMP_FILE"
+      if ! echo "${HT_SERVER_SHA256,,}  $TMP_FILE" | sha256sum -c -; then
+        rm -f "$TMP_FILE"
+        exit 1
+      fi
+      cache_store "$TMP_FILE"
+    fi
+  else
+    cache_valid "$TMP_FILE" || true
+    if fetch_url "$HT_SERVER_URL" "$TMP_FILE"; then
+      cache_store "$TMP_FILE"
+    else
+      echo "Cached server archive is up to date: $TMP_FILE"
+    fi
   fi
 else
   if ! is_truthy "${HT_USE_DOWNLOADER:-1}"; then
@@ -110,6 +217,7 @@ else
     mkdir -p "$(dirname "$TMP_FILE")"
   fi
   DOWNLOADER_ARGS=()
+  CACHE_ARGS=()
   INFO_ONLY=0
   if is_truthy "${HT_DOWNLOADER_PRINT_VERSION:-0}"; then
     DOWNLOADER_ARGS+=("-print-version")
@@ -125,6 +233,7 @@ else
   fi
   if [[ -n "${HT_DOWNLOADER_PATCHLINE:-}" ]]; then
     DOWNLOADER_ARGS+=("-patchline" "$HT_DOWNLOADER_PATCHLINE")
+    CACHE_ARGS+=("-patchline" "$HT_DOWNLOADER_PATCHLINE")
   fi
   if is_truthy "${HT_DOWNLOADER_SKIP_UPDATE_CHECK:-0}"; then
     DOWNLOADER_ARGS+=("-skip-update-check")
@@ -138,42 +247,75 @@ else
     exit 0
   fi
 
-  "$DOWNLOADER_BIN" "${DOWNLOADER_ARGS[@]}" -download-path "$TMP_FILE"
+  # Cache downloads by game version (one cheap -print-version call), unless
+  # the user picked an explicit download path.
+  GAME_VERSION=""
+  if [[ -z "${HT_DOWNLOADER_DOWNLOAD_PATH:-}" ]]; then
+    GAME_VERSION=$("$DOWNLOADER_BIN" "${CACHE_ARGS[@]}" -skip-update-check -print-version 2>/dev/null | tail -n 1 | tr -d '\r' || true)
+  fi
+  if [[ "$GAME_VERSION" =~ ^[A-Za-z0-9._+-]+$ ]]; then
+    CACHE_ENTRY="$CACHE_DIR/game-${HT_DOWNLOADER_PATCHLINE:-release}-$GAME_VERSION"
+    TMP_FILE="$CACHE_ENTRY/game.zip"
+    lock_cache_entry "$CACHE_ENTRY"
+    if cache_valid "$TMP_FILE"; then
+      echo "Using cached server archive for $GAME_VERSION: $TMP_FILE"
+    else
+      rm -rf "$CACHE_ENTRY/partial"
+      mkdir -p "$CACHE_ENTRY/partial"
+      traced "$DOWNLOADER_BIN" "${DOWNLOADER_ARGS[@]}" -download-path "$CACHE_ENTRY/partial/game.zip"
+      mv -f "$CACHE_ENTRY/partial/game.zip" "$TMP_FILE"
+      rm -rf "$CACHE_ENTRY/partial"
+      cache_store "$TMP_FILE"
+    fi
+  else
+    traced "$DOWNLOADER_BIN" "${DOWNLOADER_ARGS[@]}" -download-path "$TMP_FILE"
+  fi
 fi
 
-EXTRACT_DIR="$TMP_DIR/extract"
-mkdir -p "$EXTRACT_DIR"
-
 case "$TMP_FILE" in
-  *.zip)
-    unzip -q "$TMP_FILE" -d "$EXTRACT_DIR"
-    ;;
-  *.tar.gz|*.tgz)
-    tar -xzf "$TMP_FILE" -C "$EXTRACT_DIR"
-    ;;
-  *.tar.xz|*.txz)
-    tar -xJf "$TMP_FILE" -C "$EXTRACT_DIR"
-    ;;
-  *.tar)
-    tar -xf "$TMP_FILE" -C "$EXTRACT_DIR"
-    ;;
+  *.zip|*.tar.gz|*.tgz|*.tar.xz|*.txz|*.tar) ;;
   *)
     echo "Unknown archive type. Placing file into server folder: $TMP_FILE" >&2
+    if [[ $STAGE -eq 1 ]]; then
+      cp -a --reflink=auto "$CURRENT_SERVER_DIR"/. "$SERVER_DIR"/
+    fi
     cp -a "$TMP_FILE" "$SERVER_DIR/"
     exit 0
     ;;
- esac
+esac
 
-if [[ $CLEAN -eq 1 ]]; then
-  rm -rf "$SERVER_DIR"/*
+# Builds are stored once in store/servers/<archive hash> and linked into each
+# instance's server/ folder (see scripts/server_tree.py). The archive is
+# streamed into the store and only files that differ from the build this
+# instance currently runs are written.
+if [[ -f "$TMP_FILE.sha256" ]]; then
+  ARCHIVE_SHA=$(cat "$TMP_FILE.sha256")
+else
+  ARCHIVE_SHA=$(file_sha256 "$TMP_FILE")
 fi
+TREE_KEY=${ARCHIVE_SHA:0:16}
 
-# If archive has a single top-level folder, copy its contents
-TOP_LEVEL_COUNT=$(find "$EXTRACT_DIR" -mindepth 1 -maxdepth 1 | wc -l | tr -d ' ')
-if [[ "$TOP_LEVEL_COUNT" -eq 1 ]] && [[ -d "$(find "$EXTRACT_DIR" -mindepth 1 -maxdepth 1)" ]]; then
-  EXTRACT_DIR="$(find "$EXTRACT_DIR" -mindepth 1 -maxdepth 1)"
+IMPORT_ARGS=()
+CURRENT_TREE=$(cat "${CURRENT_SERVER_DIR:-$SERVER_DIR}/.hsm-tree" 2>/dev/null || true)
+if [[ -n "$CURRENT_TREE" ]]; then
+  IMPORT_ARGS+=(--base "$CURRENT_TREE")
+fi
+if [[ "${GAME_VERSION:-}" =~ ^[A-Za-z0-9._+-]+$ ]]; then
+  IMPORT_ARGS+=(--version "$GAME_VERSION")
 fi
+traced python3 "$ROOT_DIR/scripts/server_tree.py" import "$TMP_FILE" "$TREE_KEY" "${IMPORT_ARGS[@]}"
 
-cp -a "$EXTRACT_DIR"/. "$SERVER_DIR"/
+LINK_ARGS=(--mode "${HT_SERVER_LINK_MODE:-reflink}")
+if [[ -n "${HT_SERVER_WRITABLE:-}" ]]; then
+  LINK_ARGS+=(--writable "$HT_SERVER_WRITABLE")
+fi
+if [[ $CLEAN -eq 1 && $STAGE -eq 0 ]]; then
+  LINK_ARGS+=(--clean)
+fi
+if [[ $STAGE -eq 1 ]]; then
+  python3 "$ROOT_DIR/scripts/server_tree.py" stage "$TREE_KEY" "$CURRENT_SERVER_DIR" "$SERVER_DIR" "${LINK_ARGS[@]}"
+else
+  python3 "$ROOT_DIR/scripts/server_tree.py" link "$TREE_KEY" "$SERVER_DIR" "${LINK_ARGS[@]}"
+fi
 
 echo "Server files downloaded to $SERVER_DIR"
@@ -0,0 +1,567 @@
+"""Incremental, persistent search index over an instance's logs/ directory.
+
+The index lives in .hsm/log-index/<instance>.sqlite. Each update only reads bytes
+appended since the previous run, and queries use the timestamp/level indexes plus an
+FTS5 keyword index instead of scanning files. Files are recognized by inode and by a
+fingerprint of their first bytes, so a rotated (renamed, copied or gzipped) log keeps
+its indexed lines; lines of files that no longer exist are dropped.
+
+Usage:
+  log_index.py update <instance_dir>
+  log_index.py watch <instance_dir> [--interval SECS]
+  log_index.py search <instance_dir> [--since T] [--until T] [--level L] [--grep TEXT] [--limit N] [--json]
+"""
+
+import argparse
+import gzip
+import json
+import re
+import sqlite3
+import sys
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from tracing import run_main
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+INDEX_DIR = ROOT_DIR / ".hsm" / "log-index"
+
+TS_RE = re.compile(r"(\d{4})[-/](\d{2})[-/](\d{2})[ T](\d{2}):(\d{2}):(\d{2})(?:[.,](\d{1,6}))?")
+LEVEL_RE = re.compile(r"\b(TRACE|FINEST|FINER|FINE|DEBUG|CONFIG|INFO|WARNING|WARN|ERROR|SEVERE|FATAL)\b")
+RELATIVE_RE = re.compile(r"^(\d+)([smhd])$")
+
+LEVEL_RANKS = {
+    "TRACE": 0,
+    "FINEST": 0,
+    "FINER": 1,
+    "FINE": 1,
+    "DEBUG": 1,
+    "CONFIG": 2,
+    "INFO": 2,
+    "WARN": 3,
+    "WARNING": 3,
+    "ERROR": 4,
+    "SEVERE": 4,
+    "FATAL": 5,
+}
+RELATIVE_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+# Only the start of a line is searched for a timestamp/level so long messages stay cheap.
+HEADER_CHARS = 96
+BATCH_LINES = 5000
+READ_CHUNK = 8 * 1024 * 1024
+# A line longer than READ_CHUNK is indexed by its first MAX_LINE bytes; the rest is skipped.
+MAX_LINE = 64 * 1024
+# Bytes from the start of a file (decompressed for .gz) that identify its content.
+FINGERPRINT_BYTES = 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    dev INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    offset INTEGER NOT NULL DEFAULT 0,
+    last_ts INTEGER,
+    last_level TEXT,
+    head BLOB,
+    size INTEGER,
+    UNIQUE (dev, inode)
+);
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    ts INTEGER,
+    level TEXT,
+    level_rank INTEGER,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_ts ON lines (ts);
+CREATE INDEX IF NOT EXISTS lines_level_ts ON lines (level_rank, ts);
+"""
+
+
+@dataclass
+class LogRecord:
+    ts: Optional[int]
+    level: str
+    path: str
+    text: str
+
+    def format(self) -> str:
+        stamp = "-" * 19
+        if self.ts is not None:
+            stamp = datetime.fromtimestamp(self.ts / 1000).strftime("%Y-%m-%d %H:%M:%S")
+        return f"{stamp} {self.level or '-':<7} {Path(self.path).name}: {self.text}"
+
+
+@dataclass
+class FileRow:
+    id: int
+    path: str
+    dev: int
+    inode: int
+    offset: int
+    last_ts: Optional[int]
+    last_level: Optional[str]
+    head: Optional[bytes]
+    size: Optional[int]
+
+
+def read_head(path: Path) -> Optional[bytes]:
+    try:
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rb") as handle:  # type: ignore[operator]
+            return handle.read(FINGERPRINT_BYTES)
+    except (OSError, EOFError):
+        return None
+
+
+def continues(known: Optional[bytes], head: bytes) -> bool:
+    """True if a file starting with `head` can be the file fingerprinted as `known` (maybe grown since)."""
+    if known is None:
+        return True  # indexed before fingerprints were stored
+    return head[:len(known)] == known
+
+
+def read_lines(handle: BinaryIO, final: bool) -> Iterator[Tuple[List[str], int]]:
+    """Whole lines from handle in READ_CHUNK pieces, each with the bytes it consumed.
+
+    A trailing partial line is left unread unless `final` (a rotated file will not grow).
+    """
+    pending = b""
+    skipping = False
+    while True:
+        data = handle.read(READ_CHUNK)
+        if not data:
+            break
+        data = pending + data
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            pending = b""
+            if len(data) < READ_CHUNK:
+                pending = data
+            elif skipping:
+                yield [], len(data)
+            else:
+                skipping = True
+                yield [data[:MAX_LINE].decode("utf-8", errors="replace")], len(data)
+            continue
+        chunk, pending = data[:end], data[end:]
+        if skipping:
+            chunk = chunk[chunk.index(b"\n") + 1:]
+            skipping = False
+        yield chunk.decode("utf-8", errors="replace").splitlines(), end
+    if final and pending and not skipping:
+        yield [pending.decode("utf-8", errors="replace")], len(pending)
+
+
+def index_path(instance_dir: Path) -> Path:
+    return INDEX_DIR / f"{instance_dir.name}.sqlite"
+
+
+def parse_time(value: str) -> int:
+    """Accept a relative age (30m, 2h, 1d) or a local date/time; returns epoch ms."""
+    value = value.strip()
+    match = RELATIVE_RE.match(value)
+    if match:
+        delta = timedelta(**{RELATIVE_UNITS[match.group(2)]: int(match.group(1))})
+        return int((datetime.now() - delta).timestamp() * 1000)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(datetime.strptime(value, fmt).timestamp() * 1000)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized time: {value} (use e.g. 30m, 2h, 1d or YYYY-MM-DD[ HH:MM[:SS]])")
+
+
+def parse_header(line: str) -> Tuple[Optional[int], str]:
+    head = line[:HEADER_CHARS]
+    ts: Optional[int] = None
+    match = TS_RE.search(head)
+    if match:
+        year, month, day, hour, minute, second, frac = match.groups()
+        try:
+            stamp = datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+            ts = int(stamp.timestamp() * 1000) + int((frac or "0").ljust(3, "0")[:3])
+        except ValueError:
+            ts = None
+    level_match = LEVEL_RE.search(head)
+    level = level_match.group(1) if level_match else ""
+    if level == "WARNING":
+        level = "WARN"
+    return ts, level
+
+
+def fts_query(text: str) -> str:
+    # Quote every term so user input is never parsed as FTS syntax; terms are ANDed.
+    terms = [term.replace('"', '""') for term in text.split()]
+    return " ".join(f'"{term}"' for term in terms)
+
+
+class LogIndex:
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(files)")}
+        for column, kind in (("head", "BLOB"), ("size", "INTEGER")):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE files ADD COLUMN {column} {kind}")
+        self.has_fts = self._ensure_fts()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _ensure_fts(self) -> bool:
+        try:
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts "
+                "USING fts5(text, content='lines', content_rowid='id')"
+            )
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def update(self, logs_dir: Path) -> Tuple[int, int]:
+        """Index new data under logs_dir; returns (files touched, lines added)."""
+        if not logs_dir.is_dir():
+            return 0, 0
+        files_touched = 0
+        lines_added = 0
+        rows: Dict[int, FileRow] = {}
+        for values in self.conn.execute(
+            "SELECT id, path, dev, inode, offset, last_ts, last_level, head, size FROM files"
+        ):
+            rows[values[0]] = FileRow(*values)
+        by_inode = {(row.dev, row.inode): row.id for row in rows.values()}
+        seen: Dict[int, Path] = {}
+        unreadable: List[str] = []
+        for path in sorted(p for p in logs_dir.rglob("*") if p.is_file()):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            head = read_head(path)
+            if head is None:
+                unreadable.append(str(path))
+                continue
+            gz = path.suffix == ".gz"
+            row = rows.get(by_inode.get((st.st_dev, st.st_ino), -1))
+            if row is not None and row.id in seen:
+                continue  # another hardlink to a file indexed in this pass
+            if row is not None and (
+                not continues(row.head, head)
+                or (not gz and row.offset > st.st_size)
+            ):
+                # Same inode, different content (a reused inode or a truncated file).
+                by_inode.pop((row.dev, row.inode), None)
+                self._detach(row)
+                row = None
+            if row is None:
+                row = self._claim(rows, seen, head, st.st_size, gz)
+            if row is None:
+                cur = self.conn.execute(
+                    "INSERT INTO files (path, dev, inode) VALUES (?, ?, ?)",
+                    (str(path), st.st_dev, st.st_ino),
+                )
+                row = FileRow(int(cur.lastrowid), str(path), st.st_dev, st.st_ino, 0, None, None, None, None)
+                rows[row.id] = row
+            seen[row.id] = path
+            moved = row.path != str(path) or (row.dev, row.inode) != (st.st_dev, st.st_ino)
+            if not moved and row.head is not None and row.size == st.st_size:
+                continue
+            if gz and row.head is None and row.offset:
+                # Indexed whole before fingerprints were stored (offset is the compressed size).
+                added, offset, last_ts, last_level = 0, row.offset, row.last_ts, row.last_level
+            elif gz:
+                added, offset, last_ts, last_level = self._index_gzip(
+                    row.id, path, row.offset, row.last_ts, row.last_level
+                )
+            else:
+                added, offset, last_ts, last_level = self._index_plain(
+                    row.id, path, row.offset, row.last_ts, row.last_level
+                )
+            if by_inode.get((row.dev, row.inode)) == row.id:
+                del by_inode[(row.dev, row.inode)]
+            by_inode[(st.st_dev, st.st_ino)] = row.id
+            row.path, row.dev, row.inode, row.head, row.size = str(path), st.st_dev, st.st_ino, head, st.st_size
+            self.conn.execute(
+                "UPDATE files SET path = ?, dev = ?, inode = ?, offset = ?, last_ts = ?, last_level = ?, "
+                "head = ?, size = ? WHERE id = ?",
+                (row.path, row.dev, row.inode, offset, last_ts, last_level, head, st.st_size, row.id),
+            )
+            self.conn.commit()
+            if added:
+                files_touched += 1
+                lines_added += added
+        for row in rows.values():
+            # Content no longer found under logs_dir: the file was deleted or overwritten.
+            if row.id not in seen and row.path not in unreadable:
+                self._forget(row.id)
+        self.conn.commit()
+        return files_touched, lines_added
+
+    def _detach(self, row: FileRow) -> None:
+        # Frees the (dev, inode) key; the row can still be claimed by its content.
+        row.dev, row.inode = 0, -row.id
+        self.conn.execute("UPDATE files SET dev = ?, inode = ? WHERE id = ?", (row.dev, row.inode, row.id))
+
+    def _claim(
+        self, rows: Dict[int, FileRow], seen: Dict[int, Path], head: bytes, size: int, gz: bool
+    ) -> Optional[FileRow]:
+        """An indexed file whose content this file continues (a rotated copy), if its own file is gone."""
+        for row in rows.values():
+            if row.id in seen or not row.head or not continues(row.head, head):
+                continue
+            if not gz and row.offset > size:
+                continue
+            try:
+                st = Path(row.path).stat()
+            except OSError:
+                return row
+            if (st.st_dev, st.st_ino) != (row.dev, row.inode):
+                return row
+            if not continues(row.head, read_head(Path(row.path)) or b""):
+                return row
+        return None
+
+    def _forget(self, file_id: int) -> None:
+        if self.has_fts:
+            self.conn.execute(
+                "INSERT INTO lines_fts (lines_fts, rowid, text) SELECT 'delete', id, text FROM lines WHERE file_id = ?",
+                (file_id,),
+            )
+        self.conn.execute("DELETE FROM lines WHERE file_id = ?", (file_id,))
+        self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def _index_plain(
+        self,
+        file_id: int,
+        path: Path,
+        offset: int,
+        last_ts: Optional[int],
+        last_level: Optional[str],
+    ) -> Tuple[int, int, Optional[int], Optional[str]]:
+        added = 0
+        with path.open("rb") as handle:
+            handle.seek(offset)
+            # Only whole lines are indexed; a trailing partial line waits for the next pass.
+            for lines, consumed in read_lines(handle, final=False):
+                count, last_ts, last_level = self._insert_lines(file_id, lines, last_ts, last_level)
+                added += count
+                offset += consumed
+        return added, offset, last_ts, last_level
+
+    def _index_gzip(
+        self,
+        file_id: int,
+        path: Path,
+        offset: int,
+        last_ts: Optional[int],
+        last_level: Optional[str],
+    ) -> Tuple[int, int, Optional[int], Optional[str]]:
+        """Lines after `offset` of the decompressed content (a rotated log may already be indexed in part)."""
+        added = 0
+        try:
+            with gzip.open(path, "rb") as handle:
+                skipped = 0
+                while skipped < offset:
+                    data = handle.read(min(READ_CHUNK, offset - skipped))
+                    if not data:
+                        return 0, skipped, last_ts, last_level
+                    skipped += len(data)
+                for lines, consumed in read_lines(handle, final=True):
+                    count, last_ts, last_level = self._insert_lines(file_id, lines, last_ts, last_level)
+                    added += count
+                    offset += consumed
+        except (OSError, EOFError):
+            pass
+        return added, offset, last_ts, last_level
+
+    def _insert_lines(
+        self,
+        file_id: int,
+        lines: Iterable[str],
+        last_ts: Optional[int],
+        last_level: Optional[str],
+    ) -> Tuple[int, Optional[int], Optional[str]]:
+        added = 0
+        batch: List[Tuple[int, Optional[int], str, Optional[int], str]] = []
+        for raw in lines:
+            line = raw.rstrip("\r\n")
+            if not line.strip():
+                continue
+            ts, level = parse_header(line)
+            if ts is None:
+                # Continuation lines (stack traces, wrapped output) inherit the previous header.
+                ts = last_ts
+                level = level or last_level or ""
+            else:
+                last_ts = ts
+                last_level = level
+            batch.append((file_id, ts, level, LEVEL_RANKS.get(level), line))
+            if len(batch) >= BATCH_LINES:
+                added += self._flush(batch)
+                batch = []
+        if batch:
+            added += self._flush(batch)
+        return added, last_ts, last_level
+
+    def _flush(self, batch: List[Tuple[int, Optional[int], str, Optional[int], str]]) -> int:
+        cur = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM lines")
+        first_id = int(cur.fetchone()[0]) + 1
+        rows = [(first_id + i, *row) for i, row in enumerate(batch)]
+        self.conn.executemany(
+            "INSERT INTO lines (id, file_id, ts, level, level_rank, text) VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        if self.has_fts:
+            self.conn.executemany(
+                "INSERT INTO lines_fts (rowid, text) VALUES (?, ?)",
+                [(row[0], row[5]) for row in rows],
+            )
+        return len(rows)
+
+    def search(
+        self,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        level: str = "",
+        grep: str = "",
+        limit: int = 200,
+    ) -> List[LogRecord]:
+        """Return the newest `limit` matching lines in chronological order."""
+        clauses: List[str] = []
+        params: List[object] = []
+        if since is not None:
+            clauses.append("l.ts >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("l.ts <= ?")
+            params.append(until)
+        if level:
+            rank = LEVEL_RANKS.get(level.upper())
+            if rank is None:
+                raise ValueError(f"Unknown level: {level}")
+            clauses.append("l.level_rank >= ?")
+            params.append(rank)
+        if grep.strip():
+            if self.has_fts:
+                clauses.append("l.id IN (SELECT rowid FROM lines_fts WHERE lines_fts MATCH ?)")
+                params.append(fts_query(grep))
+            else:
+                for term in grep.split():
+                    clauses.append("l.text LIKE ?")
+                    params.append(f"%{term}%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        query = (
+            "SELECT l.ts, l.level, f.path, l.text FROM lines l JOIN files f ON f.id = l.file_id "
+            f"{where} ORDER BY l.ts DESC, l.id DESC LIMIT ?"
+        )
+        params.append(limit)
+        rows = self.conn.execute(query, params).fetchall()
+        return [LogRecord(ts=row[0], level=row[1] or "", path=row[2], text=row[3]) for row in reversed(rows)]
+
+
+def open_index(instance_dir: Path) -> LogIndex:
+    return LogIndex(index_path(instance_dir))
+
+
+def update_instance(instance_dir: Path) -> Tuple[int, int]:
+    index = open_index(instance_dir)
+    try:
+        return index.update(instance_dir / "logs")
+    finally:
+        index.close()
+
+
+def search_instance(
+    instance_dir: Path,
+    since: str = "",
+    until: str = "",
+    level: str = "",
+    grep: str = "",
+    limit: int = 200,
+) -> List[LogRecord]:
+    index = open_index(instance_dir)
+    try:
+        index.update(instance_dir / "logs")
+        return index.search(
+            since=parse_time(since) if since else None,
+            until=parse_time(until) if until else None,
+            level=level,
+            grep=grep,
+            limit=limit,
+        )
+    finally:
+        index.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="log_index.py", description="Index and search instance logs.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    update_cmd = sub.add_parser("update", help="Index new log data")
+    update_cmd.add_argument("instance_dir", type=Path)
+
+    watch_cmd = sub.add_parser("watch", help="Keep the index up to date")
+    watch_cmd.add_argument("instance_dir", type=Path)
+    watch_cmd.add_argument("--interval", type=float, default=5.0)
+
+    search_cmd = sub.add_parser("search", help="Search indexed logs")
+    search_cmd.add_argument("instance_dir", type=Path)
+    search_cmd.add_argument("--since", default="", help="e.g. 30m, 2h, 1d or YYYY-MM-DD[ HH:MM[:SS]]")
+    search_cmd.add_argument("--until", default="")
+    search_cmd.add_argument("--level", default="", help="minimum level (DEBUG, INFO, WARN, ERROR, ...)")
+    search_cmd.add_argument("--grep", default="", help="keywords (all must match)")
+    search_cmd.add_argument("--limit", type=int, default=200)
+    search_cmd.add_argument("--json", action="store_true")
+
+    args = parser.parse_args(argv)
+    instance_dir = args.instance_dir.resolve()
+
+    if args.command == "update":
+        started = time.perf_counter()
+        files, lines = update_instance(instance_dir)
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"Indexed {lines} new lines from {files} files in {elapsed:.0f} ms")
+        return 0
+
+    if args.command == "watch":
+        try:
+            while True:
+                files, lines = update_instance(instance_dir)
+                if lines:
+                    print(f"{datetime.now():%H:%M:%S} indexed {lines} new lines from {files} files", flush=True)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            return 0
+
+    try:
+        records = search_instance(
+            instance_dir,
+            since=args.since,
+            until=args.until,
+            level=args.level,
+            grep=args.grep,
+            limit=args.limit,
+        )
+    except (ValueError, sqlite3.OperationalError) as exc:
+        print(str(exc), file=sys.stderr)
+        return 1
+    if args.json:
+        print(json.dumps([asdict(record) for record in records]))
+    else:
+        for record in records:
+            print(record.format())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("log_index.py", main))
@@ -3,23 +3,57 @@ set -euo pipefail
 
 ROOT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)
 INSTANCES_DIR="$ROOT_DIR/instances"
+. "$ROOT_DIR/scripts/tracing.sh"
+. "$ROOT_DIR/scripts/registry.sh"
 
 usage() {
   cat <<EOF
-Usage: ./scripts/manager.sh <command> [instance]
+Usage: ./scripts/manager.sh [--trace] <command> [instance]
 
 Commands:
   list                              List instances
   setup                             Create a new instance
   start <instance>                  docker compose up -d
   stop <instance>                   docker compose stop
+  wait-ready <instance> [--timeout N]
+                                    Wait until the server has booted (HT_READY_PATTERN)
   restart <instance>                docker compose restart
   down <instance>                   docker compose down
   remove <instance>                 Stop, down, and delete instance directory
   logs <instance>                   docker compose logs -f
-  backup <instance>                 Create a backup tar.gz
-  update <instance> [--no-backup]   Update instance (download + restart)
-  status                            List instances and container status/auth
+  logs-search <instance> [opts]     Search indexed logs/ (--since 2h --level WARN --grep text --limit N --json)
+  console <instance> [-c CMD ...]   Server console over a persistent session: interactive without
+                                    -c, else run the commands (or stdin lines) and print responses;
+                                    --no-wait, --timeout S, --until REGEX; --stop ends the session
+  backup <instance> [opts]          Create a backup (--incremental|--full, --codec, --level,
+                                    --threads, --bench; defaults from HT_BACKUP_* in .env)
+                                    --hot [--detach]: snapshot data/ while the server runs
+  restore <instance> [backup|latest] [opts]
+                                    Restore files from a backup (--only <path>, repeatable;
+                                    --delete, --dry-run, --threads N, --force if running);
+                                    without a backup, lists the available ones
+  update <instance> [--no-backup] [--staged]
+                                    Update instance (download + restart); --staged downloads
+                                    while the server runs and only restarts to swap trees
+  rollback <instance>               Swap back to the server files before the last staged update
+  status [--json] [--watch [secs]]  List instances and container status/auth
+  metrics [instance...] [--since 1h] [--json]
+                                    CPU/memory history per instance (avg, max, peak time, sparklines)
+  metrics collect [--listen HOST:PORT] [--interval S] [--detach]
+                                    Record per-instance stats; writes .hsm/metrics/hsm.prom and
+                                    serves Prometheus text on --listen
+  capacity [--json]                 Host cores/RAM, per-instance cpuset and memory limit, overcommit
+  capacity allocate <instance> [--cores N|--cpuset LIST] [--memory 6G] [--policy warn|refuse] [--force]
+                                    Pin an instance to the least-used cores and set its memory limit
+  capacity host [--detect] [--cpus LIST] [--memory SIZE] [--reserve-cpus LIST] [--reserve-memory SIZE]
+                                    Show or change the recorded host capacity (.hsm/capacity.json)
+  start-all|stop-all|update-all|backup-all|console-all [instance...] [--jobs N] [--rolling N] [-- opts]
+                                    Run a command across instances (default: all) in parallel,
+                                    with live progress and per-instance exit codes; --rolling N
+                                    (update-all, backup-all) keeps N instances up; per-instance
+                                    opts follow --
+  trace [summary|export|list] [file]
+                                    Show a timing trace recorded with --trace (or HSM_TRACE=1)
 EOF
 }
 
@@ -48,18 +82,18 @@ need_compose() {
     echo "Missing docker-compose.yml in $instance_dir" >&2
     exit 1
   fi
+  load_instance_env "$instance_dir"
+}
+
+env_value() {
+  load_instance_env "$1"
+  printf '%s\n' "${INSTANCE_ENV[$2]:-}"
 }
 
 ensure_image() {
-  local instance_dir=$1
-  local env_file="$instance_dir/.env"
-  local image="hytale-dedicated:latest"
-  if [[ -f "$env_file" ]]; then
-    image=$(grep -E '^HT_IMAGE=' "$env_file" | cut -d= -f2- | tr -d '\r')
-  fi
-  if [[ -z "$image" ]]; then
-    image="hytale-dedicated:latest"
-  fi
+  local instance_dir=$1 image
+  load_instance_env "$instance_dir"
+  image=${INSTANCE_ENV[HT_IMAGE]:-hytale-dedicated:latest}
   if docker image inspect "$image" >/dev/null 2>&1; then
     return 0
   fi
@@ -68,43 +102,23 @@ ensure_image() {
 }
 
 service_name() {
-  local instance_dir=$1
-  local env_file="$instance_dir/.env"
-  local name="hytale"
-  if [[ -f "$env_file" ]]; then
-    name=$(grep -E '^HT_SERVICE_NAME=' "$env_file" | cut -d= -f2- | tr -d '\r')
-  fi
-  if [[ -z "$name" ]]; then
-    name="hytale"
-  fi
-  echo "$name"
+  load_instance_env "$1"
+  echo "$INSTANCE_SERVICE"
 }
 
 container_id() {
   local instance_dir=$1
-  local env_file="$instance_dir/.env"
-  local compose_file="$instance_dir/docker-compose.yml"
-  local override=""
-  if [[ -f "$env_file" ]]; then
-    override=$(grep -E '^HT_CONTAINER_NAME=' "$env_file" | cut -d= -f2- | tr -d '\r')
-  fi
-  if [[ -n "$override" ]]; then
-    echo "$override"
+  load_instance_env "$instance_dir"
+  if [[ -n "$INSTANCE_CONTAINER" ]]; then
+    echo "$INSTANCE_CONTAINER"
     return
   fi
-  local svc
-  svc=$(service_name "$instance_dir")
-  docker compose -f "$compose_file" ps -q "$svc" 2>/dev/null | head -n 1
+  docker compose -f "$instance_dir/docker-compose.yml" ps -q "$INSTANCE_SERVICE" 2>/dev/null | head -n 1
 }
 
 print_server_ready() {
-  local instance_dir=$1
-  local env_file="$instance_dir/.env"
-  local host_port="5520"
-  if [[ -f "$env_file" ]]; then
-    host_port=$(grep -E '^HOST_PORT=' "$env_file" | cut -d= -f2- | tr -d '\r')
-  fi
-  echo "Server is up. Connect to: 0.0.0.0:${host_port}"
+  load_instance_env "$1"
+  echo "Server is up. Connect to: 0.0.0.0:${INSTANCE_PORT:-5520}"
 }
 
 run_compose_quiet() {
@@ -117,18 +131,167 @@ run_compose_quiet() {
   return 1
 }
 
+follow_until() {
+  # follow_until <secs> <regex> <command...>
+  # Runs a streaming command once and returns 0 as soon as one of its lines
+  # matches, or 1 on timeout / end of stream. The stream is stopped either way.
+  local secs=$1 pattern=$2 fd pid rc=0
+  shift 2
+  exec {fd}< <(exec "$@" 2>/dev/null)
+  pid=$!
+  # grep acts on each line as it arrives (mawk would wait for a full buffer).
+  timeout "$secs" grep -qE -- "$pattern" <&"$fd" || rc=$?
+  exec {fd}<&-
+  kill "$pid" 2>/dev/null || true
+  return $(( rc == 0 ? 0 : 1 ))
+}
+
 wait_for_container_state() {
+  # Waits (up to <secs>) for "running" or "exited", reacting to Docker
+  # events instead of polling.
   local container_name=$1
   local target=$2
-  local max_tries=${3:-30}
-  for _ in $(seq 1 "$max_tries"); do
-    state=$(docker inspect -f '{{.State.Status}}' "$container_name" 2>/dev/null || echo "unknown")
-    if [[ "$state" == "$target" ]]; then
-      return 0
-    fi
-    sleep 1
+  local secs=${3:-30}
+  local since state
+  since=$(date +%s)
+  state=$(docker inspect -f '{{.State.Status}}' "$container_name" 2>/dev/null || echo "unknown")
+  [[ "$state" == "$target" ]] && return 0
+  case "$target" in
+    exited)
+      timeout "$secs" docker wait "$container_name" >/dev/null 2>&1 || true
+      ;;
+    running)
+      follow_until "$secs" '^start$' docker events --since "$since" --filter "container=$container_name" \
+        --filter event=start --format '{{.Action}}' || true
+      ;;
+  esac
+  state=$(docker inspect -f '{{.State.Status}}' "$container_name" 2>/dev/null || echo "unknown")
+  [[ "$state" == "$target" ]]
+}
+
+wait_for_log() {
+  # wait_for_log <instance_dir> <secs> <regex>: follows the log of the current
+  # container run (since it started) until a line matches.
+  local instance_dir=$1 secs=$2 pattern=$3 cid started
+  cid=$(container_id "$instance_dir")
+  started=$(docker inspect -f '{{.State.StartedAt}}' "$cid" 2>/dev/null || true)
+  follow_until "$secs" "$pattern" docker compose -f "$instance_dir/docker-compose.yml" logs -f --no-color \
+    ${started:+--since "$started"}
+}
+
+wait_ready() {
+  # Blocks until the server logs HT_READY_PATTERN (default: boot marker) and
+  # records the time from container start to ready in .hsm/ready.log.
+  local instance_dir=$1 secs=$2 cid started pattern ms
+  cid=$(container_id "$instance_dir")
+  if [[ -z "$cid" ]] || ! wait_for_container_state "$cid" "running" 30; then
+    echo "Container for $(basename "$instance_dir") is not running." >&2
+    return 1
+  fi
+  pattern=$(env_value "$instance_dir" HT_READY_PATTERN)
+  pattern=${pattern:-Hytale Server Booted}
+  if ! wait_for_log "$instance_dir" "$secs" "$pattern"; then
+    echo "Server not ready after ${secs}s (no \"$pattern\" in the log)." >&2
+    return 1
+  fi
+  started=$(docker inspect -f '{{.State.StartedAt}}' "$cid" 2>/dev/null || true)
+  started=$(date -d "$started" +%s%3N 2>/dev/null || true)
+  ms=""
+  [[ -n "$started" ]] && ms=$(( $(now_ms) - started ))
+  mkdir -p "$ROOT_DIR/.hsm"
+  printf '%s\t%s\t%s\n' "$(date '+%Y-%m-%dT%H:%M:%S')" "$(basename "$instance_dir")" "${ms:-}" >> "$ROOT_DIR/.hsm/ready.log"
+  echo "Server ready${ms:+ ${ms} ms after container start}."
+}
+
+status_rows() {
+  # One `docker ps` for the whole fleet plus a single awk pass over every .env.
+  # Prints TSV rows: instance, service, container, status, port, auth.
+  # Only used without python3; docker_api.py status_rows is the same derivation.
+  local names=() env_files=() dir
+  for dir in "$INSTANCES_DIR"/*/; do
+    dir=${dir%/}
+    [[ -d "$dir" ]] || continue
+    names+=("${dir##*/}")
+    [[ -f "$dir/.env" ]] && env_files+=("$dir/.env")
   done
-  return 1
+  [[ ${#names[@]} -gt 0 ]] || return 0
+  local ps_out="" docker_ok=1
+  if ! ps_out=$(docker ps -a --format '{{.Names}}\t{{.State}}\t{{.Label "com.docker.compose.project"}}\t{{.Label "com.docker.compose.service"}}' 2>/dev/null); then
+    docker_ok=0
+  fi
+  printf '%s\n' "$ps_out" | awk -v names="$(printf '%s\n' "${names[@]}")" -v docker_ok="$docker_ok" '
+    BEGIN { FS = "\t"; OFS = "\t"; count = split(names, order, "\n") }
+    FILENAME == "-" {
+      if ($1 == "") next
+      state_by_name[$1] = $2
+      if ($3 != "") {
+        name_by_svc[$3, $4] = $1
+        state_by_svc[$3, $4] = $2
+      }
+      next
+    }
+    {
+      sub(/\r$/, "")
+      eq = index($0, "=")
+      if (eq == 0 || substr($0, 1, 1) == "#") next
+      parts = split(FILENAME, path, "/")
+      env[path[parts - 1], substr($0, 1, eq - 1)] = substr($0, eq + 1)
+    }
+    END {
+      for (i = 1; i <= count; i++) {
+        inst = order[i]
+        if (inst == "") continue
+        svc = env[inst, "HT_SERVICE_NAME"]
+        if (svc == "") svc = "hytale"
+        project = env[inst, "COMPOSE_PROJECT_NAME"]
+        if (project == "") {
+          project = tolower(inst)
+          gsub(/[^a-z0-9_-]/, "", project)
+        }
+        container = env[inst, "HT_CONTAINER_NAME"]
+        status = "not found"
+        if (!docker_ok) {
+          status = "unknown"
+        } else if (container != "") {
+          if (container in state_by_name) status = state_by_name[container]
+        } else if ((project, svc) in state_by_svc) {
+          container = name_by_svc[project, svc]
+          status = state_by_svc[project, svc]
+        }
+        auth = (env[inst, "HYTALE_SERVER_SESSION_TOKEN"] == "") ? "missing" : "ok"
+        print inst, svc, container, status, env[inst, "HOST_PORT"], auth
+      }
+    }
+  ' - "${env_files[@]}"
+}
+
+print_status() {
+  local format=$1
+  status_rows | awk -v format="$format" '
+    function esc(value) {
+      gsub(/\\/, "\\\\", value)
+      gsub(/"/, "\\\"", value)
+      return "\"" value "\""
+    }
+    BEGIN {
+      FS = "\t"
+      if (format == "table") {
+        printf "%-30s %-20s %-20s %-10s %-10s %-8s\n", "INSTANCE", "SERVICE", "CONTAINER", "STATUS", "PORT", "AUTH"
+      } else {
+        printf "["
+      }
+    }
+    format == "table" {
+      printf "%-30s %-20s %-20s %-10s %-10s %-8s\n", $1, $2, ($3 == "" ? "-" : $3), $4, $5, $6
+      next
+    }
+    {
+      printf "%s{\"instance\":%s,\"service\":%s,\"container\":%s,\"status\":%s,\"port\":%s,\"auth\":%s}", (NR > 1 ? "," : ""), esc($1), esc($2), esc($3), esc($4), esc($5), esc($6)
+    }
+    END {
+      if (format != "table") print "]"
+    }
+  '
 }
 
 set_env_kv() {
@@ -140,6 +303,9 @@ set_env_kv() {
   else
     printf "%s=%s\n" "$key" "$value" >> "$env_file"
   fi
+  if [[ "$env_file" == "$INSTANCE_ENV_DIR/.env" ]]; then
+    INSTANCE_ENV[$key]=$value
+  fi
 }
 
 apply_export_tokens() {
@@ -164,9 +330,8 @@ apply_export_tokens() {
 ensure_server_cmd() {
   local instance_dir=$1
   local env_file="$instance_dir/.env"
-  local current
-  current=$(grep -E '^HT_SERVER_CMD=' "$env_file" | cut -d= -f2- | tr -d '\r')
-  if [[ -n "$current" ]]; then
+  load_instance_env "$instance_dir"
+  if [[ -n "${INSTANCE_ENV[HT_SERVER_CMD]:-}" ]]; then
     return 0
   fi
   if [[ -x "$instance_dir/server/start.sh" || -f "$instance_dir/server/start.sh" ]]; then
@@ -188,26 +353,24 @@ auth_missing() {
   if [[ ! -f "$env_file" ]]; then
     return 0
   fi
-  local token
-  token=$(grep -E '^HYTALE_SERVER_SESSION_TOKEN=' "$env_file" | cut -d= -f2- | tr -d '\r')
-  [[ -z "$token" ]]
+  load_instance_env "$instance_dir"
+  [[ -z "${INSTANCE_ENV[HYTALE_SERVER_SESSION_TOKEN]:-}" ]]
 }
 
 send_console_cmd() {
   local instance_dir=$1
   local command=$2
-  local env_file="$instance_dir/.env"
-  # shellcheck disable=SC1090
-  set -a
-  . "$env_file"
-  set +a
   local cid
   cid=$(container_id "$instance_dir")
   if [[ -z "$cid" ]]; then
     echo "Container not found for $instance_dir" >&2
     return 1
   fi
-  # Try direct exec into PID 1 stdin; fall back to docker compose exec.
+  # Use the instance's console session if one is running (without starting a daemon),
+  # else attach just for this command; fall back to an exec into PID 1 stdin.
+  if python3 "$ROOT_DIR/scripts/console.py" send "$instance_dir" --no-start --no-wait -c "$command" >/dev/null 2>&1; then
+    return 0
+  fi
   if docker exec -i "$cid" bash -lc "printf '%s\r\n' \"$command\" > /proc/1/fd/0" >/dev/null 2>&1; then
     return 0
   fi
@@ -219,6 +382,122 @@ send_console_cmd() {
   return 1
 }
 
+console_ack() {
+  # console_ack <instance_dir> <command> <regex> <secs>: sends a console command and waits
+  # for its response; succeeds once a line matches regex (with no regex, on any response).
+  local instance_dir=$1 command=$2 ack=$3 secs=$4 output
+  output=$(python3 "$ROOT_DIR/scripts/console.py" send "$instance_dir" --no-start -c "$command" --timeout "$secs" \
+    ${ack:+--until "$ack"} 2>/dev/null) || return 1
+  if [[ -n "$ack" ]]; then
+    grep -qE -- "$ack" <<< "$output"
+  else
+    [[ -n "$output" ]]
+  fi
+}
+
+now_ms() {
+  date +%s%3N
+}
+
+container_running() {
+  local cid
+  cid=$(container_id "$1")
+  [[ -n "$cid" ]] && [[ "$(docker inspect -f '{{.State.Status}}' "$cid" 2>/dev/null || true)" == "running" ]]
+}
+
+hot_backup() {
+  local instance_dir=$1
+  shift
+  load_instance_env "$instance_dir"
+  local detach=0 args=() arg
+  for arg in "$@"; do
+    if [[ "$arg" == "--detach" ]]; then
+      detach=1
+    else
+      args+=("$arg")
+    fi
+  done
+  if ! container_running "$instance_dir"; then
+    echo "Instance is not running; taking a regular backup."
+    "$ROOT_DIR/scripts/backup.sh" "$instance_dir" "${args[@]}"
+    return
+  fi
+
+  local name flush_cmd flush_ack pause_cmd pause_ack resume_cmd flush_wait ack_wait snapshot_mode
+  name=$(basename "$instance_dir")
+  flush_cmd=$(env_value "$instance_dir" HT_SAVE_FLUSH_CMD)
+  flush_ack=$(env_value "$instance_dir" HT_SAVE_FLUSH_ACK)
+  pause_cmd=$(env_value "$instance_dir" HT_SAVE_PAUSE_CMD)
+  pause_ack=$(env_value "$instance_dir" HT_SAVE_PAUSE_ACK)
+  resume_cmd=$(env_value "$instance_dir" HT_SAVE_RESUME_CMD)
+  flush_wait=$(env_value "$instance_dir" HT_SAVE_FLUSH_WAIT)
+  ack_wait=$(env_value "$instance_dir" HT_SAVE_ACK_TIMEOUT)
+  snapshot_mode=$(env_value "$instance_dir" HT_SNAPSHOT_MODE)
+  if [[ -z "$pause_cmd" || -z "$pause_ack" ]]; then
+    echo "HT_SAVE_PAUSE_CMD/HT_SAVE_PAUSE_ACK not configured; the snapshot is crash-consistent only." >&2
+  fi
+
+  local snapshot_root="$ROOT_DIR/backups/.snapshots/${name}-$(date +%Y%m%d-%H%M%S)"
+  mkdir -p "$snapshot_root"
+
+  if [[ -n "$flush_cmd" ]] && ! console_ack "$instance_dir" "$flush_cmd" "$flush_ack" "${flush_wait:-30}"; then
+    echo "WARNING: no response to $flush_cmd within ${flush_wait:-30}s." >&2
+  fi
+
+  # The snapshot only counts as consistent once the server has confirmed that saves are off.
+  local pause_start pause_ms snapshot_ok=1 consistency=crash-consistent
+  pause_start=$(now_ms)
+  if [[ -n "$pause_cmd" && -n "$pause_ack" ]]; then
+    if console_ack "$instance_dir" "$pause_cmd" "$pause_ack" "${ack_wait:-10}"; then
+      consistency=paused
+    else
+      echo "WARNING: $pause_cmd was not acknowledged within ${ack_wait:-10}s; the snapshot is crash-consistent only." >&2
+    fi
+  elif [[ -n "$pause_cmd" ]]; then
+    send_console_cmd "$instance_dir" "$pause_cmd" || true
+  fi
+  # Reflinks are copy-on-write clones (instant on btrfs/xfs, a plain copy elsewhere).
+  # Hardlinks are only safe when the server replaces files instead of rewriting them in place.
+  if [[ "$snapshot_mode" == "hardlink" ]]; then
+    cp -al "$instance_dir/data" "$snapshot_root/data" || snapshot_ok=0
+  else
+    cp -a --reflink=auto "$instance_dir/data" "$snapshot_root/data" || snapshot_ok=0
+  fi
+  if [[ -n "$resume_cmd" ]]; then
+    send_console_cmd "$instance_dir" "$resume_cmd" || echo "WARNING: failed to send $resume_cmd; resume saves manually." >&2
+  fi
+  pause_ms=$(( $(now_ms) - pause_start ))
+  printf "%s\t%s\t%s\t%s\t%s\n" "$(date '+%Y-%m-%dT%H:%M:%S')" "$name" "$pause_ms" "${snapshot_mode:-reflink}" \
+    "$consistency" >> "$ROOT_DIR/backups/hot-backup.log"
+  if [[ "$consistency" == "paused" ]]; then
+    echo "World saves paused for ${pause_ms} ms while data/ was snapshotted."
+  else
+    echo "data/ snapshotted in ${pause_ms} ms without a confirmed save pause (crash-consistent)."
+  fi
+
+  if [[ $snapshot_ok -eq 0 ]]; then
+    rm -rf "$snapshot_root"
+    echo "Snapshot failed." >&2
+    return 1
+  fi
+
+  if [[ $detach -eq 1 ]]; then
+    local log_file="$snapshot_root.log"
+    (
+      # The log is kept only if the backup fails.
+      "$ROOT_DIR/scripts/backup.sh" "$instance_dir" --data-from "$snapshot_root/data" "${args[@]}" && rm -f "$log_file"
+      rm -rf "$snapshot_root"
+    ) > "$log_file" 2>&1 &
+    disown
+    echo "Compressing in the background (log: $log_file)."
+    return
+  fi
+  local status=0
+  "$ROOT_DIR/scripts/backup.sh" "$instance_dir" --data-from "$snapshot_root/data" "${args[@]}" || status=$?
+  rm -rf "$snapshot_root"
+  return $status
+}
+
 graceful_stop() {
   local instance_dir=$1
   local env_file="$instance_dir/.env"
@@ -226,13 +505,17 @@ graceful_stop() {
     return 0
   fi
   local stop_cmd
-  stop_cmd=$(grep -E '^HT_STOP_CMD=' "$env_file" | cut -d= -f2- | tr -d '\r')
+  stop_cmd=$(env_value "$instance_dir" HT_STOP_CMD)
   if [[ -z "$stop_cmd" ]]; then
     stop_cmd="/stop"
   fi
   if [[ -n "$stop_cmd" ]]; then
     send_console_cmd "$instance_dir" "$stop_cmd" || true
-    sleep 2
+    # Return as soon as the server exits on its own instead of sleeping a fixed time.
+    local cid wait_secs
+    cid=$(container_id "$instance_dir")
+    wait_secs=$(env_value "$instance_dir" HT_STOP_WAIT)
+    [[ -n "$cid" ]] && timeout "${wait_secs:-10}" docker wait "$cid" >/dev/null 2>&1 || true
   fi
 }
 
@@ -294,20 +577,10 @@ EXP
   fi
 
   echo "Waiting for server boot before starting device login..."
-  for _ in {1..90}; do
-    if docker compose -f "$compose_file" logs --tail 200 | grep -q "Hytale Server Booted"; then
-      break
-    fi
-    sleep 1
-  done
+  wait_for_log "$instance_dir" 90 "Hytale Server Booted" || true
 
   # Wait until the console module is ready before issuing auth commands.
-  for _ in {1..30}; do
-    if docker compose -f "$compose_file" logs --tail 200 | grep -q "Setup console with type"; then
-      break
-    fi
-    sleep 1
-  done
+  wait_for_log "$instance_dir" 30 "Setup console with type" || true
 
   echo "Starting device login..."
 
@@ -336,9 +609,116 @@ EXP
   print_server_ready "$instance_dir"
 }
 
+fleet_instances() {
+  # The given instance names, or every instance that has a compose file.
+  if [[ $# -gt 0 ]]; then
+    printf '%s\n' "$@"
+    return
+  fi
+  local dir
+  for dir in "$INSTANCES_DIR"/*/; do
+    dir=${dir%/}
+    [[ -f "$dir/docker-compose.yml" ]] && echo "${dir##*/}"
+  done
+  return 0
+}
+
+fleet_run() {
+  # fleet_run <action> <jobs> <instance...> [-- <args for each instance>]
+  # Runs `manager.sh <action> <instance> <args>` for every instance, at most
+  # <jobs> at a time, with live progress and a per-instance exit code summary.
+  local action=$1 jobs=$2
+  shift 2
+  local names=() extra=()
+  while [[ $# -gt 0 && "$1" != "--" ]]; do
+    names+=("$1")
+    shift
+  done
+  [[ $# -gt 0 ]] && shift
+  extra=("$@")
+  local total=${#names[@]}
+  if [[ $total -eq 0 ]]; then
+    echo "No instances selected."
+    return 0
+  fi
+
+  local log_dir
+  log_dir="$ROOT_DIR/.hsm/fleet/$(date +%Y%m%d-%H%M%S)-$action"
+  mkdir -p "$log_dir"
+  local -A pids=() started=() codes=() elapsed=()
+  local running=() still=() next=0 finished=0 failed=0 name pid rc now tty=0 line
+  [[ -t 1 ]] && tty=1
+  echo "$action: $total instances, up to $jobs at a time (logs: $log_dir)"
+
+  while [[ $next -lt $total || ${#running[@]} -gt 0 ]]; do
+    while [[ $next -lt $total && ${#running[@]} -lt $jobs ]]; do
+      name=${names[$next]}
+      next=$((next + 1))
+      "$ROOT_DIR/scripts/manager.sh" "$action" "$name" "${extra[@]}" > "$log_dir/$name.log" 2>&1 < /dev/null &
+      pids[$name]=$!
+      started[$name]=$(now_ms)
+      running+=("$name")
+    done
+
+    sleep 0.2
+    still=()
+    for name in "${running[@]}"; do
+      pid=${pids[$name]}
+      if kill -0 "$pid" 2>/dev/null; then
+        still+=("$name")
+        continue
+      fi
+      rc=0
+      wait "$pid" || rc=$?
+      codes[$name]=$rc
+      elapsed[$name]=$(( $(now_ms) - started[$name] ))
+      finished=$((finished + 1))
+      [[ $tty -eq 1 ]] && printf '\r\033[K'
+      if [[ $rc -eq 0 ]]; then
+        printf '[%d/%d] %-20s ok      %6.1fs\n' "$finished" "$total" "$name" "$(awk "BEGIN{print ${elapsed[$name]}/1000}")"
+      else
+        failed=$((failed + 1))
+        printf '[%d/%d] %-20s FAILED  %6.1fs  exit %d: %s\n' "$finished" "$total" "$name" \
+          "$(awk "BEGIN{print ${elapsed[$name]}/1000}")" "$rc" "$(tail -n 1 "$log_dir/$name.log" 2>/dev/null)"
+      fi
+    done
+    running=("${still[@]}")
+
+    if [[ $tty -eq 1 && ${#running[@]} -gt 0 ]]; then
+      # One live line: every running instance with its elapsed time and latest output.
+      now=$(now_ms)
+      line=""
+      for name in "${running[@]}"; do
+        line+="${line:+ | }$name $(( (now - started[$name]) / 1000 ))s: $(tail -n 1 "$log_dir/$name.log" 2>/dev/null | tr -d '\r' | cut -c1-40)"
+      done
+      printf '\r\033[K%s' "${line:0:$(( $(tput cols 2>/dev/null || echo 120) - 1 ))}"
+    fi
+  done
+
+  {
+    printf 'instance\texit\tms\n'
+    for name in "${names[@]}"; do
+      printf '%s\t%s\t%s\n' "$name" "${codes[$name]}" "${elapsed[$name]}"
+    done
+  } > "$log_dir/summary.tsv"
+  echo "$action: $((total - failed)) ok, $failed failed (summary: $log_dir/summary.tsv)"
+  [[ $failed -eq 0 ]]
+}
+
+if [[ "${1:-}" == "--trace" ]]; then
+  export HSM_TRACE=1
+  shift
+fi
 cmd=${1:-}
 shift || true
 
+if [[ "$cmd" != "trace" ]]; then
+  trace_init "manager.sh $cmd${1:+ ${1##*/}}"
+  trace_functions ensure_image ensure_server_cmd apply_export_tokens container_id run_compose_quiet \
+    follow_until wait_for_container_state wait_for_log wait_ready status_rows send_console_cmd \
+    hot_backup graceful_stop auth_flow fleet_run
+fi
+
 case "$cmd" in
   list)
     if [[ ! -d "$INSTANCES_DIR" ]]; then
@@ -360,24 +740,47 @@ case "$cmd" in
     if auth_missing "$instance_dir"; then
       auth_flow "$instance_dir"
     else
-      print_server_ready "$instance_dir"
+      ready_timeout=$(env_value "$instance_dir" HT_READY_TIMEOUT)
+      # The container is up either way; a slow or silent boot only earns a warning.
+      if [[ "${ready_timeout:-180}" != "0" ]] && ! wait_ready "$instance_dir" "${ready_timeout:-180}"; then
+        echo "Warning: the container is running but the server has not reported ready; check \`logs\`." >&2
+        load_instance_env "$instance_dir"
+        echo "Connect to: 0.0.0.0:${INSTANCE_PORT:-5520} once it has booted"
+      else
+        print_server_ready "$instance_dir"
+      fi
     fi
     ;;
+  wait-ready)
+    instance_dir=$(resolve_instance "${1:-}")
+    shift
+    need_compose "$instance_dir"
+    ready_timeout=$(env_value "$instance_dir" HT_READY_TIMEOUT)
+    ready_timeout=${ready_timeout:-180}
+    while [[ $# -gt 0 ]]; do
+      case "$1" in
+        --timeout)
+          ready_timeout=${2:-}
+          shift
+          ;;
+        --timeout=*)
+          ready_timeout=${1#--timeout=}
+          ;;
+        *)
+          echo "Unknown wait-ready option: $1" >&2
+          exit 1
+          ;;
+      esac
+      shift
+    done
+    wait_ready "$instance_dir" "$ready_timeout"
+    ;;
   stop)
     instance_dir=$(resolve_instance "${1:-}")
     need_compose "$instance_dir"
     graceful_stop "$instance_dir"
     run_compose_quiet "$instance_dir/docker-compose.yml" stop
-    env_file="$instance_dir/.env"
-    if [[ -f "$env_file" ]]; then
-      # shellcheck disable=SC1090
-      set -a
-      . "$env_file"
-      set +a
-      container_name=$(container_id "$instance_dir")
-    else
-      container_name=$(container_id "$instance_dir")
-    fi
+    container_name=$(container_id "$instance_dir")
     if wait_for_container_state "$container_name" "exited" 20; then
       echo "Container stopped."
     else
@@ -407,7 +810,9 @@ case "$cmd" in
       fi
     fi
     run_compose_quiet "$instance_dir/docker-compose.yml" down
+    python3 "$ROOT_DIR/scripts/console.py" stop "$instance_dir" >/dev/null 2>&1 || true
     rm -rf "$instance_dir"
+    rm -f "$ROOT_DIR/.hsm/log-index/$(basename "$instance_dir")".sqlite*
     echo "Removed instance."
     ;;
   logs)
@@ -415,37 +820,219 @@ case "$cmd" in
     need_compose "$instance_dir"
     docker compose -f "$instance_dir/docker-compose.yml" logs -f
     ;;
+  logs-search)
+    instance_dir=$(resolve_instance "${1:-}")
+    shift
+    python3 "$ROOT_DIR/scripts/log_index.py" search "$instance_dir" "$@"
+    ;;
+  metrics)
+    if [[ "${1:-}" == "collect" ]]; then
+      shift
+      if [[ " $* " == *" --detach "* ]]; then
+        args=()
+        for arg in "$@"; do
+          [[ "$arg" == "--detach" ]] || args+=("$arg")
+        done
+        mkdir -p "$ROOT_DIR/.hsm/metrics"
+        env -u HSM_TRACE -u HSM_TRACE_FILE -u HSM_TRACE_PID nohup python3 "$ROOT_DIR/scripts/metrics.py" collect "${args[@]}" >> "$ROOT_DIR/.hsm/metrics/collector.log" 2>&1 &
+        echo "Metrics collector running in the background (pid $!, log: .hsm/metrics/collector.log)."
+        exit 0
+      fi
+      exec python3 "$ROOT_DIR/scripts/metrics.py" collect "$@"
+    fi
+    exec python3 "$ROOT_DIR/scripts/metrics.py" show "$@"
+    ;;
+  capacity)
+    case "${1:-}" in
+      allocate)
+        shift
+        instance_dir=$(resolve_instance "${1:-}")
+        shift
+        exec python3 "$ROOT_DIR/scripts/capacity.py" allocate "$instance_dir" "$@"
+        ;;
+      host)
+        shift
+        exec python3 "$ROOT_DIR/scripts/capacity.py" host "$@"
+        ;;
+    esac
+    exec python3 "$ROOT_DIR/scripts/capacity.py" report "$@"
+    ;;
+  trace)
+    sub=${1:-summary}
+    shift || true
+    exec python3 "$ROOT_DIR/scripts/tracing.py" "$sub" "$@"
+    ;;
+  console)
+    instance_dir=$(resolve_instance "${1:-}")
+    shift
+    need_compose "$instance_dir"
+    case "${1:-}" in
+      --stop)
+        exec python3 "$ROOT_DIR/scripts/console.py" stop "$instance_dir"
+        ;;
+      --status)
+        exec python3 "$ROOT_DIR/scripts/console.py" status "$instance_dir"
+        ;;
+    esac
+    if [[ $# -eq 0 && -t 0 ]]; then
+      exec python3 "$ROOT_DIR/scripts/console.py" shell "$instance_dir"
+    fi
+    # -c CMD (repeatable) or one command per stdin line, sent as one batch.
+    exec python3 "$ROOT_DIR/scripts/console.py" send "$instance_dir" "$@"
+    ;;
   backup)
     instance_dir=$(resolve_instance "${1:-}")
-    "$ROOT_DIR/scripts/backup.sh" "$instance_dir"
+    shift
+    if [[ " $* " == *" --hot "* ]]; then
+      args=()
+      for arg in "$@"; do
+        [[ "$arg" == "--hot" ]] || args+=("$arg")
+      done
+      hot_backup "$instance_dir" "${args[@]}"
+    else
+      "$ROOT_DIR/scripts/backup.sh" "$instance_dir" "$@"
+    fi
+    ;;
+  restore)
+    instance_dir=$(resolve_instance "${1:-}")
+    shift
+    if [[ $# -eq 0 || "$1" == --* ]]; then
+      python3 "$ROOT_DIR/scripts/restore.py" list "$(basename "$instance_dir")"
+      exit 0
+    fi
+    force=0
+    args=()
+    for arg in "$@"; do
+      if [[ "$arg" == "--force" ]]; then
+        force=1
+      else
+        args+=("$arg")
+      fi
+    done
+    if [[ $force -eq 0 ]] && container_running "$instance_dir"; then
+      echo "Instance is running; stop it first or pass --force." >&2
+      exit 1
+    fi
+    python3 "$ROOT_DIR/scripts/restore.py" "$instance_dir" "${args[@]}"
     ;;
   update)
     instance_dir=$(resolve_instance "${1:-}")
-    "$ROOT_DIR/scripts/update.sh" "$instance_dir" "${2:-}"
+    shift
+    "$ROOT_DIR/scripts/update.sh" "$instance_dir" "$@"
+    ;;
+  rollback)
+    instance_dir=$(resolve_instance "${1:-}")
+    "$ROOT_DIR/scripts/update.sh" "$instance_dir" --rollback
     ;;
   status)
     if [[ ! -d "$INSTANCES_DIR" ]]; then
       echo "No instances directory found."
       exit 0
     fi
-    printf "%-30s %-20s %-20s %-10s %-10s\n" "INSTANCE" "SERVICE" "CONTAINER" "STATUS" "PORT"
-    for dir in "$INSTANCES_DIR"/*; do
-      [[ -d "$dir" ]] || continue
-      env_file="$dir/.env"
-      instance_name=$(basename "$dir")
-      service_name_value=$(service_name "$dir")
-      container_name=$(container_id "$dir")
-      host_port=""
-      if [[ -f "$env_file" ]]; then
-        container_name=$(grep -E '^HT_CONTAINER_NAME=' "$env_file" | cut -d= -f2- | tr -d '\r')
-        host_port=$(grep -E '^HOST_PORT=' "$env_file" | cut -d= -f2- | tr -d '\r')
-      fi
-      status="not found"
-      if [[ -n "$container_name" ]]; then
-        status=$(docker inspect -f '{{.State.Status}}' "$container_name" 2>/dev/null || echo "not found")
+    # docker_api.py derives the table: over the Engine API socket where it is usable
+    # (one connection kept across --watch refreshes), else from one `docker ps`.
+    # print_status below is the same table for hosts without python3.
+    if command -v python3 >/dev/null 2>&1; then
+      rc=0
+      python3 "$ROOT_DIR/scripts/docker_api.py" status "$@" || rc=$?
+      exit "$rc"
+    fi
+    format=table
+    watch_interval=""
+    while [[ $# -gt 0 ]]; do
+      case "$1" in
+        --json)
+          format=json
+          ;;
+        --watch)
+          watch_interval=2
+          if [[ "${2:-}" =~ ^[0-9]+([.][0-9]+)?$ ]]; then
+            watch_interval=$2
+            shift
+          fi
+          ;;
+        --watch=*)
+          watch_interval=${1#--watch=}
+          ;;
+        *)
+          echo "Unknown status option: $1" >&2
+          exit 1
+          ;;
+      esac
+      shift
+    done
+    if [[ -z "$watch_interval" ]]; then
+      print_status "$format"
+      exit 0
+    fi
+    while true; do
+      if [[ "$format" == "table" ]]; then
+        printf '\033[H\033[2J'
+        printf 'Every %ss: %s\n\n' "$watch_interval" "$(date '+%Y-%m-%d %H:%M:%S')"
       fi
-      printf "%-30s %-20s %-20s %-10s %-10s\n" "$instance_name" "$service_name_value" "${container_name:-"-"}" "$status" "$host_port"
+      print_status "$format"
+      sleep "$watch_interval"
+    done
+    ;;
+  start-all|stop-all|update-all|backup-all|console-all)
+    jobs=${HSM_FLEET_JOBS:-4}
+    rolling=""
+    selected=()
+    args=()
+    while [[ $# -gt 0 ]]; do
+      case "$1" in
+        -j|--jobs|--rolling)
+          if [[ $# -lt 2 ]]; then
+            echo "$1 needs a value." >&2
+            exit 1
+          fi
+          if [[ "$1" == --rolling ]]; then
+            rolling=$2
+          else
+            jobs=$2
+          fi
+          shift
+          ;;
+        --jobs=*)
+          jobs=${1#--jobs=}
+          ;;
+        --rolling=*)
+          rolling=${1#--rolling=}
+          ;;
+        --)
+          shift
+          args+=("$@")
+          break
+          ;;
+        -*)
+          echo "Unknown option: $1 (options for each instance go after --)" >&2
+          exit 1
+          ;;
+        *)
+          resolve_instance "$1" >/dev/null
+          selected+=("$1")
+          ;;
+      esac
+      shift
     done
+    if [[ -n "$rolling" && "$cmd" != update-all && "$cmd" != backup-all ]]; then
+      echo "--rolling only applies to update-all and backup-all." >&2
+      exit 1
+    fi
+    mapfile -t names < <(fleet_instances "${selected[@]}")
+    if [[ -n "$rolling" ]]; then
+      # Keep <rolling> instances serving: never take more than the rest down at once.
+      if [[ ! "$rolling" =~ ^[0-9]+$ || $rolling -ge ${#names[@]} ]]; then
+        echo "--rolling needs a number smaller than the number of instances (${#names[@]})." >&2
+        exit 1
+      fi
+      jobs=$(( ${#names[@]} - rolling ))
+    fi
+    if [[ ! "$jobs" =~ ^[1-9][0-9]*$ ]]; then
+      echo "--jobs must be a positive number." >&2
+      exit 1
+    fi
+    fleet_run "${cmd%-all}" "$jobs" "${names[@]}" -- "${args[@]}"
     ;;
   ""|help|-h|--help)
     usage
@@ -0,0 +1,536 @@
+"""Per-instance resource metrics: CPU, memory, network and block I/O.
+
+The collector follows one stats stream per running instance container (Engine API;
+a single `docker stats` stream when only the CLI is available) and keeps recent
+samples in fixed-size, array-backed ring buffers. Finished minutes are downsampled
+into .hsm/metrics/<instance>.hist, a fixed-size file with one 32-byte slot per
+minute (7 days, then it wraps), and the latest values are written in Prometheus
+text format to .hsm/metrics/hsm.prom (and served on --listen, if given). Only one
+collector at a time persists; others (e.g. the GUI next to a running daemon) only
+fill their own ring buffers.
+
+Usage:
+  metrics.py collect [--interval SECS] [--listen HOST:PORT] [--prom FILE]
+  metrics.py show [instance ...] [--since 1h] [--json]
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from chunk_store import human_bytes
+from docker_api import DockerError, DockerStream, compose_project, default_client, instance_container, read_env
+from tracing import run_main
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+INSTANCES_DIR = ROOT_DIR / "instances"
+METRICS_DIR = ROOT_DIR / ".hsm" / "metrics"
+
+# Ring buffer length (samples arrive about once a second) and how often instances are rediscovered.
+RING_SAMPLES = 600
+DISCOVER_SECONDS = 15.0
+# One slot per minute: minute start (uint32), cpu avg/max, mem max, net rx/tx and block read/write rates.
+RECORD = struct.Struct("<I7f")
+HISTORY_MINUTES = 7 * 24 * 60
+FIELDS = ("cpu", "mem", "net_rx", "net_tx", "blk_read", "blk_write")
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+SIZE_RE = re.compile(r"([\d.]+)\s*([kKMGT]?i?B)")
+SIZE_UNITS = {
+    "B": 1,
+    "kB": 1000,
+    "KB": 1000,
+    "MB": 1000**2,
+    "GB": 1000**3,
+    "TB": 1000**4,
+    "KiB": 1024,
+    "MiB": 1024**2,
+    "GiB": 1024**3,
+    "TiB": 1024**4,
+}
+RELATIVE_RE = re.compile(r"^(\d+)([mhd])$")
+
+
+@dataclass
+class Sample:
+    ts: float
+    cpu: float  # percent, 100 = one core
+    mem: float  # bytes, page cache excluded (as `docker stats` shows it)
+    mem_limit: float
+    net_rx: float  # cumulative bytes
+    net_tx: float
+    blk_read: float
+    blk_write: float
+
+
+class Ring:
+    """Fixed-size ring of floats in one array; appending never allocates."""
+
+    def __init__(self, capacity: int) -> None:
+        self._data = array("d", bytes(8 * capacity))
+        self._start = 0
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def append(self, value: float) -> None:
+        capacity = len(self._data)
+        if self._len < capacity:
+            self._data[(self._start + self._len) % capacity] = value
+            self._len += 1
+        else:
+            self._data[self._start] = value
+            self._start = (self._start + 1) % capacity
+
+    def values(self, last: int = 0) -> List[float]:
+        capacity = len(self._data)
+        count = min(last, self._len) if last else self._len
+        first = self._start + self._len - count
+        return [self._data[(first + i) % capacity] for i in range(count)]
+
+
+class InstanceSeries:
+    """Recent samples of one instance (rates for the I/O fields) plus the current minute."""
+
+    def __init__(self, capacity: int = RING_SAMPLES) -> None:
+        self.times = Ring(capacity)
+        self.rings = {field: Ring(capacity) for field in FIELDS}
+        self.last: Optional[Sample] = None
+        self.up = False
+        self._minute = 0
+        self._acc = [0.0] * 8
+
+    def add(self, sample: Sample) -> Optional[Tuple[float, ...]]:
+        """Records a sample; returns the previous minute's history record once it is complete."""
+        previous = self.last
+        rates = [0.0] * 4
+        if previous is not None and sample.ts > previous.ts:
+            elapsed = sample.ts - previous.ts
+            counters = (sample.net_rx, sample.net_tx, sample.blk_read, sample.blk_write)
+            before = (previous.net_rx, previous.net_tx, previous.blk_read, previous.blk_write)
+            # Counters reset when the container restarts; count that interval as zero.
+            rates = [max(now - then, 0.0) / elapsed for now, then in zip(counters, before)]
+        self.last = sample
+        self.up = True
+        self.times.append(sample.ts)
+        for field, value in zip(FIELDS, (sample.cpu, sample.mem, *rates)):
+            self.rings[field].append(value)
+
+        record = None
+        minute = int(sample.ts // 60 * 60)
+        if self._minute and minute != self._minute and self._acc[0]:
+            record = self.minute_record()
+            self._acc = [0.0] * 8
+        self._minute = minute
+        acc = self._acc
+        acc[0] += 1
+        acc[1] += sample.cpu
+        acc[2] = max(acc[2], sample.cpu)
+        acc[3] = max(acc[3], sample.mem)
+        for i, rate in enumerate(rates):
+            acc[4 + i] += rate
+        return record
+
+    def minute_record(self) -> Tuple[float, ...]:
+        count, cpu_sum, cpu_max, mem_max, *rate_sums = self._acc
+        return (self._minute, cpu_sum / count, cpu_max, mem_max, *(rate / count for rate in rate_sums))
+
+
+def parse_api_stats(stats: Dict) -> Sample:
+    """One Engine API stats frame, with CPU and memory computed the way `docker stats` does."""
+    cpu = stats.get("cpu_stats") or {}
+    pre = stats.get("precpu_stats") or {}
+    cpu_delta = (cpu.get("cpu_usage") or {}).get("total_usage", 0) - (pre.get("cpu_usage") or {}).get("total_usage", 0)
+    system_delta = cpu.get("system_cpu_usage", 0) - pre.get("system_cpu_usage", 0)
+    cpus = cpu.get("online_cpus") or len((cpu.get("cpu_usage") or {}).get("percpu_usage") or []) or 1
+    cpu_percent = cpu_delta / system_delta * cpus * 100 if system_delta > 0 and cpu_delta > 0 else 0.0
+
+    memory = stats.get("memory_stats") or {}
+    memory_stats = memory.get("stats") or {}
+    cache = memory_stats.get("inactive_file", memory_stats.get("total_inactive_file", 0))
+    networks = (stats.get("networks") or {}).values()
+    blkio = (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []
+    return Sample(
+        ts=time.time(),
+        cpu=cpu_percent,
+        mem=max(memory.get("usage", 0) - cache, 0),
+        mem_limit=memory.get("limit", 0),
+        net_rx=sum(net.get("rx_bytes", 0) for net in networks),
+        net_tx=sum(net.get("tx_bytes", 0) for net in networks),
+        blk_read=sum(entry.get("value", 0) for entry in blkio if str(entry.get("op", "")).lower() == "read"),
+        blk_write=sum(entry.get("value", 0) for entry in blkio if str(entry.get("op", "")).lower() == "write"),
+    )
+
+
+def parse_size(text: str) -> float:
+    match = SIZE_RE.search(text)
+    if not match:
+        return 0.0
+    return float(match.group(1)) * SIZE_UNITS.get(match.group(2), 1)
+
+
+def parse_cli_stats(row: Dict[str, str]) -> Sample:
+    """One `docker stats --format '{{json .}}'` row ("1.2%", "512MiB / 2GiB", ...)."""
+
+    def pair(key: str) -> Tuple[float, float]:
+        left, _, right = row.get(key, "").partition("/")
+        return parse_size(left), parse_size(right)
+
+    mem, mem_limit = pair("MemUsage")
+    net_rx, net_tx = pair("NetIO")
+    blk_read, blk_write = pair("BlockIO")
+    try:
+        cpu = float(row.get("CPUPerc", "0").rstrip("%") or 0)
+    except ValueError:
+        cpu = 0.0
+    return Sample(time.time(), cpu, mem, mem_limit, net_rx, net_tx, blk_read, blk_write)
+
+
+def history_path(name: str, metrics_dir: Path = METRICS_DIR) -> Path:
+    return metrics_dir / f"{name}.hist"
+
+
+def write_history(path: Path, record: Tuple[float, ...]) -> None:
+    slot = int(record[0]) // 60 % HISTORY_MINUTES
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        os.pwrite(fd, RECORD.pack(int(record[0]), *record[1:]), slot * RECORD.size)
+    finally:
+        os.close(fd)
+
+
+def read_history(path: Path, since: float = 0) -> List[Tuple[float, ...]]:
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return []
+    usable = len(data) - len(data) % RECORD.size
+    records = [record for record in RECORD.iter_unpack(data[:usable]) if record[0] and record[0] >= since]
+    records.sort()
+    return records
+
+
+def sparkline(values: List[float], width: int = 20, top: Optional[float] = None) -> str:
+    """Unicode sparkline of `values` averaged into at most `width` buckets."""
+    if not values:
+        return ""
+    if len(values) > width:
+        size = len(values) / width
+        values = [
+            sum(values[int(i * size):int((i + 1) * size)]) / max(int((i + 1) * size) - int(i * size), 1)
+            for i in range(width)
+        ]
+    top = top or max(values) or 1.0
+    last = len(SPARK_CHARS) - 1
+    return "".join(SPARK_CHARS[min(int(value / top * last + 0.5), last)] for value in values)
+
+
+def prometheus_text(series: Dict[str, InstanceSeries]) -> str:
+    metrics = [
+        ("hsm_up", "gauge", "1 while stats are being received for the instance container.", lambda s, x: float(x.up)),
+        ("hsm_cpu_percent", "gauge", "CPU usage in percent of one core.", lambda s, x: s.cpu),
+        ("hsm_memory_bytes", "gauge", "Memory in use, page cache excluded.", lambda s, x: s.mem),
+        ("hsm_memory_limit_bytes", "gauge", "Container memory limit.", lambda s, x: s.mem_limit),
+        ("hsm_network_receive_bytes_total", "counter", "Bytes received.", lambda s, x: s.net_rx),
+        ("hsm_network_transmit_bytes_total", "counter", "Bytes sent.", lambda s, x: s.net_tx),
+        ("hsm_block_read_bytes_total", "counter", "Bytes read from block devices.", lambda s, x: s.blk_read),
+        ("hsm_block_write_bytes_total", "counter", "Bytes written to block devices.", lambda s, x: s.blk_write),
+    ]
+    lines: List[str] = []
+    for name, kind, help_text, value in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for instance, entry in sorted(series.items()):
+            if entry.last is not None:
+                lines.append(f'{name}{{instance="{instance}"}} {float(value(entry.last, entry))!r}')
+    return "\n".join(lines) + "\n"
+
+
+class Collector:
+    """Follows stats for every instance container into per-instance ring buffers."""
+
+    def __init__(
+        self,
+        instances_dir: Path = INSTANCES_DIR,
+        metrics_dir: Path = METRICS_DIR,
+        interval: float = 5.0,
+        prom_path: Optional[Path] = None,
+    ) -> None:
+        self.instances_dir = instances_dir
+        self.metrics_dir = metrics_dir
+        self.interval = interval
+        self.prom_path = prom_path or metrics_dir / "hsm.prom"
+        self.persisting = False
+        self._series: Dict[str, InstanceSeries] = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._client = default_client()
+        self._streams: Dict[str, Tuple[str, DockerStream]] = {}
+        self._cli: Optional[subprocess.Popen] = None
+        self._cli_names: Dict[str, str] = {}
+        self._pending: List[Tuple[str, Tuple[float, ...]]] = []
+        self._lock_file = None
+
+    def start(self) -> None:
+        threading.Thread(target=self.run, name="metrics", daemon=True).start()
+
+    def stop(self) -> None:
+        # _discover registers streams under the lock and checks _stopping there first,
+        # so nothing can be added after this snapshot.
+        with self._lock:
+            self._stopping.set()
+            streams = [stream for _, stream in self._streams.values()]
+            cli = self._cli
+        for stream in streams:
+            stream.close()
+        if cli is not None and cli.poll() is None:
+            cli.terminate()
+
+    def series(self, name: str) -> Optional[InstanceSeries]:
+        with self._lock:
+            return self._series.get(name)
+
+    def recent(self, name: str, points: int) -> Optional[Tuple[List[float], List[float], float]]:
+        """Last `points` cpu and mem values plus the memory limit, copied under the lock; None when down."""
+        with self._lock:
+            series = self._series.get(name)
+            if series is None or not series.up or series.last is None:
+                return None
+            return series.rings["cpu"].values(points), series.rings["mem"].values(points), series.last.mem_limit
+
+    def snapshot(self) -> Dict[str, InstanceSeries]:
+        with self._lock:
+            return dict(self._series)
+
+    def prometheus(self) -> str:
+        with self._lock:
+            return prometheus_text(self._series)
+
+    def run(self) -> None:
+        self.metrics_dir.mkdir(parents=True, exist_ok=True)
+        self._lock_file = open(self.metrics_dir / "collector.lock", "w")
+        discovered = 0.0
+        while not self._stopping.is_set():
+            if not self.persisting:
+                try:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self.persisting = True
+                except OSError:
+                    pass
+            if time.monotonic() - discovered >= DISCOVER_SECONDS:
+                discovered = time.monotonic()
+                try:
+                    self._discover()
+                except (OSError, DockerError) as exc:
+                    print(f"metrics: {exc}", file=sys.stderr)
+            if self.persisting:
+                self._persist()
+            self._stopping.wait(self.interval)
+
+    def _persist(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, []
+            text = prometheus_text(self._series)
+        for name, record in pending:
+            write_history(history_path(name, self.metrics_dir), record)
+        tmp = self.prom_path.with_name(self.prom_path.name + ".tmp")
+        tmp.write_text(text, encoding="utf-8")
+        os.replace(tmp, self.prom_path)
+
+    def _record(self, name: str, sample: Sample) -> None:
+        with self._lock:
+            series = self._series.setdefault(name, InstanceSeries())
+            record = series.add(sample)
+            if record is not None:
+                self._pending.append((name, record))
+
+    def _mark_down(self, name: str) -> None:
+        with self._lock:
+            series = self._series.get(name)
+            if series is not None:
+                series.up = False
+
+    def _instance_dirs(self) -> List[Path]:
+        if not self.instances_dir.is_dir():
+            return []
+        return sorted(path for path in self.instances_dir.iterdir() if (path / "docker-compose.yml").exists())
+
+    def _discover(self) -> None:
+        if self._client is None:
+            self._discover_cli()
+            return
+        for instance_dir in self._instance_dirs():
+            name = instance_dir.name
+            with self._lock:
+                current = self._streams.get(name)
+            if current is not None and not current[1].closed:
+                continue
+            try:
+                container = instance_container(self._client, instance_dir)
+                if not container or self._client.inspect(container).get("State", {}).get("Status") != "running":
+                    continue
+                stream = self._client.stream("GET", f"/containers/{container}/stats", {"stream": "1"})
+            except DockerError:
+                continue  # removed between lookup and start, or not created yet
+            with self._lock:
+                if self._stopping.is_set():
+                    stream.close()
+                    return
+                self._streams[name] = (container, stream)
+            threading.Thread(target=self._follow_api, args=(name, stream), name=f"stats-{name}", daemon=True).start()
+
+    def _follow_api(self, name: str, stream: DockerStream) -> None:
+        try:
+            for line in stream:
+                if line.strip():
+                    self._record(name, parse_api_stats(json.loads(line)))
+        except (OSError, DockerError, ValueError):
+            pass
+        self._mark_down(name)
+
+    def _discover_cli(self) -> None:
+        # Compose names containers <project>-<service>-1 unless HT_CONTAINER_NAME is set.
+        names: Dict[str, str] = {}
+        for instance_dir in self._instance_dirs():
+            env = read_env(instance_dir)
+            container = env.get("HT_CONTAINER_NAME") or "{}-{}-1".format(
+                compose_project(instance_dir, env), env.get("HT_SERVICE_NAME") or "hytale"
+            )
+            names[container] = instance_dir.name
+        self._cli_names = names
+        if self._cli is None or self._cli.poll() is not None:
+            with self._lock:
+                if self._stopping.is_set():
+                    return
+                self._cli = subprocess.Popen(
+                    ["docker", "stats", "--format", "{{json .}}"],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.DEVNULL,
+                    text=True,
+                )
+            threading.Thread(target=self._follow_cli, args=(self._cli,), name="stats-cli", daemon=True).start()
+
+    def _follow_cli(self, process: subprocess.Popen) -> None:
+        assert process.stdout is not None
+        for line in process.stdout:
+            # `docker stats` redraws with terminal escapes; the JSON object is what follows them.
+            start = line.find("{")
+            if start < 0:
+                continue
+            try:
+                row = json.loads(line[start:])
+            except ValueError:
+                continue
+            name = self._cli_names.get(row.get("Name", ""))
+            if name:
+                self._record(name, parse_cli_stats(row))
+
+
+class PrometheusHandler(BaseHTTPRequestHandler):
+    collector: Collector
+
+    def do_GET(self) -> None:
+        body = self.collector.prometheus().encode()
+        self.send_response(200 if self.path in ("/", "/metrics") else 404)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def parse_since(value: str) -> float:
+    match = RELATIVE_RE.match(value)
+    if not match:
+        raise ValueError(f"Invalid --since value: {value} (use e.g. 30m, 6h, 2d)")
+    seconds = int(match.group(1)) * {"m": 60, "h": 3600, "d": 86400}[match.group(2)]
+    return time.time() - seconds
+
+
+def show(names: List[str], since: float, as_json: bool, metrics_dir: Path = METRICS_DIR) -> int:
+    if not names:
+        names = sorted(path.stem for path in metrics_dir.glob("*.hist"))
+    summary = []
+    for name in names:
+        records = read_history(history_path(name, metrics_dir), since)
+        if not records:
+            continue
+        peak = max(records, key=lambda record: record[3])
+        summary.append({
+            "instance": name,
+            "cpu_avg": sum(record[1] for record in records) / len(records),
+            "cpu_max": max(record[2] for record in records),
+            "mem_now": records[-1][3],
+            "mem_max": peak[3],
+            "mem_max_at": time.strftime("%Y-%m-%d %H:%M", time.localtime(peak[0])),
+            "cpu_spark": sparkline([record[1] for record in records], 24),
+            "mem_spark": sparkline([record[3] for record in records], 24),
+        })
+    if as_json:
+        print(json.dumps(summary))
+        return 0
+    if not summary:
+        print("No metrics recorded yet (run: manager.sh metrics collect).")
+        return 0
+    print(f"{'INSTANCE':<20} {'CPU AVG':>8} {'CPU MAX':>8} {'MEM NOW':>10} {'MEM MAX':>10} {'PEAK AT':<16}  CPU / MEM")
+    for row in summary:
+        print(
+            f"{row['instance']:<20} {row['cpu_avg']:>7.1f}% {row['cpu_max']:>7.1f}% {human_bytes(row['mem_now']):>10} "
+            f"{human_bytes(row['mem_max']):>10} {row['mem_max_at']:<16}  {row['cpu_spark']} {row['mem_spark']}"
+        )
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="metrics.py", description="Per-instance resource metrics.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    collect_cmd = sub.add_parser("collect", help="Collect metrics until interrupted")
+    collect_cmd.add_argument("--interval", type=float, default=5.0, help="seconds between history/prom writes")
+    collect_cmd.add_argument("--listen", default="", help="serve Prometheus metrics on HOST:PORT")
+    collect_cmd.add_argument("--prom", type=Path, default=None, help="Prometheus text file (default .hsm/metrics/hsm.prom)")
+
+    show_cmd = sub.add_parser("show", help="Summarize recorded history")
+    show_cmd.add_argument("instances", nargs="*")
+    show_cmd.add_argument("--since", default="1h", help="e.g. 30m, 6h, 2d")
+    show_cmd.add_argument("--json", action="store_true")
+
+    args = parser.parse_args(argv)
+    if args.command == "show":
+        try:
+            since = parse_since(args.since)
+        except ValueError as exc:
+            print(str(exc), file=sys.stderr)
+            return 1
+        return show(args.instances, since, args.json)
+
+    collector = Collector(interval=args.interval, prom_path=args.prom)
+    if args.listen:
+        host, _, port = args.listen.rpartition(":")
+        PrometheusHandler.collector = collector
+        server = ThreadingHTTPServer((host or "0.0.0.0", int(port)), PrometheusHandler)
+        threading.Thread(target=server.serve_forever, name="prometheus", daemon=True).start()
+        print(f"Serving Prometheus metrics on http://{args.listen}/metrics")
+    try:
+        collector.run()
+    except KeyboardInterrupt:
+        collector.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("metrics.py", main))
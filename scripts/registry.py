@@ -0,0 +1,284 @@
+"""Instance registry: one cached, parsed view of every instance's settings.
+
+Each instance's .env, compose service, port and server build are indexed in
+.hsm/registry.json together with the mtime and size of the files they came from
+(.env, server/.hsm-tree). A lookup only stats those files and re-parses an instance
+when one of them changed, so the GUI, docker_api and metrics share one source
+instead of each re-reading every .env. The shell scripts parse .env themselves (scripts/registry.sh) with the same
+rules, since that is cheaper than starting python3; `registry.py shell DIR` prints the
+same variables from the index for other tools.
+
+Usage:
+  registry.py list [--json]
+  registry.py get <instance> [KEY]
+  registry.py shell <instance>
+  registry.py refresh
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import sys
+import threading
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from tracing import run_main
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+INSTANCES_DIR = ROOT_DIR / "instances"
+INDEX_FILE = ROOT_DIR / ".hsm" / "registry.json"
+STORE_DIR = ROOT_DIR / "store" / "servers"
+INDEX_VERSION = 1
+# Files an entry is parsed from; any change in mtime or size re-parses the instance.
+SOURCES = (".env", "server/.hsm-tree")
+DEFAULT_SERVICE = "hytale"
+KEY_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+@dataclass
+class Entry:
+    name: str
+    path: str
+    env: Dict[str, str] = field(default_factory=dict)
+    service: str = DEFAULT_SERVICE
+    container_name: str = ""
+    project: str = ""
+    port: str = ""
+    image: str = ""
+    server_key: str = ""
+    server_version: str = ""
+    stamps: Dict[str, Optional[List[int]]] = field(default_factory=dict)
+
+    def fields(self) -> Dict[str, str]:
+        return {
+            "name": self.name,
+            "path": self.path,
+            "service": self.service,
+            "container": self.container_name,
+            "project": self.project,
+            "port": self.port,
+            "image": self.image,
+            "server_key": self.server_key,
+            "server_version": self.server_version,
+        }
+
+
+def parse_env(path: Path) -> Dict[str, str]:
+    data: Dict[str, str] = {}
+    try:
+        text = path.read_text(encoding="utf-8", errors="replace")
+    except OSError:
+        return data
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        data[key.strip()] = value.strip().strip("\"'")
+    return data
+
+
+def default_project(instance_dir: Path) -> str:
+    # Mirrors docker compose's normalization of the default project name (the folder name).
+    return re.sub(r"[^a-z0-9_-]", "", instance_dir.name.lower())
+
+
+def stamp(path: Path) -> Optional[List[int]]:
+    try:
+        info = path.stat()
+    except OSError:
+        return None
+    return [info.st_mtime_ns, info.st_size]
+
+
+def build_version(key: str, store_dir: Path = STORE_DIR) -> str:
+    try:
+        meta = json.loads((store_dir / key / ".hsm-tree.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return ""
+    return str(meta.get("version") or "")
+
+
+def parse_instance(instance_dir: Path, stamps: Dict[str, Optional[List[int]]]) -> Entry:
+    env = parse_env(instance_dir / ".env")
+    try:
+        server_key = (instance_dir / "server" / ".hsm-tree").read_text(encoding="utf-8").strip()
+    except OSError:
+        server_key = ""
+    return Entry(
+        name=instance_dir.name,
+        path=str(instance_dir),
+        env=env,
+        # Same rule as the manager scripts and the status table.
+        service=env.get("HT_SERVICE_NAME") or DEFAULT_SERVICE,
+        container_name=env.get("HT_CONTAINER_NAME", ""),
+        project=env.get("COMPOSE_PROJECT_NAME") or default_project(instance_dir),
+        port=env.get("HOST_PORT", ""),
+        image=env.get("HT_IMAGE", ""),
+        server_key=server_key,
+        server_version=build_version(server_key) if server_key else "",
+        stamps=stamps,
+    )
+
+
+class Registry:
+    """The on-disk index plus revalidation; safe to share between threads."""
+
+    def __init__(self, instances_dir: Path = INSTANCES_DIR, index_file: Path = INDEX_FILE) -> None:
+        self.instances_dir = instances_dir
+        self.index_file = index_file
+        self._entries: Dict[str, Entry] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            data = json.loads(self.index_file.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get("version") != INDEX_VERSION:
+            return
+        for path, raw in (data.get("instances") or {}).items():
+            try:
+                self._entries[path] = Entry(**raw)
+            except TypeError:
+                self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            payload = {"version": INDEX_VERSION, "instances": {path: asdict(e) for path, e in self._entries.items()}}
+            self._dirty = False
+        try:
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.index_file.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            # The cached .env values include the auth tokens persist-auth stores there.
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as handle:
+                handle.write(json.dumps(payload, separators=(",", ":")) + "\n")
+            os.replace(tmp, self.index_file)
+        except OSError:
+            pass  # the index is only a cache
+
+    def _revalidate(self, instance_dir: Path) -> Entry:
+        key = str(instance_dir)
+        stamps = {name: stamp(instance_dir / name) for name in SOURCES}
+        entry = self._entries.get(key)
+        if entry is None or entry.stamps != stamps:
+            entry = parse_instance(instance_dir, stamps)
+            self._entries[key] = entry
+            self._dirty = True
+        return entry
+
+    def get(self, instance_dir: Path) -> Entry:
+        """The entry for one instance folder, re-parsed only if its files changed."""
+        instance_dir = Path(os.path.abspath(instance_dir))
+        with self._lock:
+            entry = self._revalidate(instance_dir)
+        self.save()
+        return entry
+
+    def refresh(self) -> List[Entry]:
+        """Entries for every folder in instances/, sorted by name; drops removed instances."""
+        dirs = sorted(path for path in self.instances_dir.iterdir() if path.is_dir()) if self.instances_dir.is_dir() else []
+        with self._lock:
+            entries = [self._revalidate(Path(os.path.abspath(path))) for path in dirs]
+            parent = str(Path(os.path.abspath(self.instances_dir)))
+            for key in [key for key in self._entries if os.path.dirname(key) == parent and not os.path.isdir(key)]:
+                del self._entries[key]
+                self._dirty = True
+        self.save()
+        return entries
+
+
+_default: Optional[Registry] = None
+_default_lock = threading.Lock()
+
+
+def default() -> Registry:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Registry()
+        return _default
+
+
+def set_default(registry: Registry) -> None:
+    """Make `registry` the process-wide instance (the GUI's, whose root may differ)."""
+    global _default
+    with _default_lock:
+        _default = registry
+
+
+def env(instance_dir: Path) -> Dict[str, str]:
+    """Parsed .env of an instance (a shared dict; do not modify)."""
+    return default().get(instance_dir).env
+
+
+def resolve(name: str, instances_dir: Path = INSTANCES_DIR) -> Optional[Path]:
+    path = Path(name)
+    if path.is_dir():
+        return path
+    if (instances_dir / name).is_dir():
+        return instances_dir / name
+    return None
+
+
+def shell_lines(entry: Entry) -> List[str]:
+    pairs = " ".join(f"[{key}]={shlex.quote(value)}" for key, value in entry.env.items() if KEY_RE.match(key))
+    lines = [f"declare -gA INSTANCE_ENV=({pairs})"]
+    for name, value in entry.fields().items():
+        lines.append(f"INSTANCE_{name.upper()}={shlex.quote(value)}")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="registry.py", description="Cached instance settings.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    list_cmd = sub.add_parser("list", help="List instances with service, port and server build")
+    list_cmd.add_argument("--json", action="store_true")
+    get_cmd = sub.add_parser("get", help="Print an instance's settings, or one .env value")
+    get_cmd.add_argument("instance")
+    get_cmd.add_argument("key", nargs="?")
+    shell_cmd = sub.add_parser("shell", help="Print bash assignments for INSTANCE_ENV and INSTANCE_*")
+    shell_cmd.add_argument("instance")
+    sub.add_parser("refresh", help="Revalidate every instance and rewrite the index")
+
+    args = parser.parse_args(argv)
+    registry = default()
+    if args.command in ("list", "refresh"):
+        entries = registry.refresh()
+        if args.command == "refresh":
+            print(f"{len(entries)} instances indexed in {registry.index_file}")
+        elif args.json:
+            print(json.dumps([entry.fields() for entry in entries], separators=(",", ":")))
+        else:
+            line = "%-30s %-20s %-8s %-18s %s"
+            print(line % ("INSTANCE", "SERVICE", "PORT", "BUILD", "VERSION"))
+            for entry in entries:
+                print(line % (entry.name, entry.service, entry.port or "-", entry.server_key or "-",
+                              entry.server_version or "-"))
+        return 0
+
+    instance_dir = resolve(args.instance)
+    if instance_dir is None:
+        print(f"Instance not found: {args.instance}", file=sys.stderr)
+        return 1
+    entry = registry.get(instance_dir)
+    if args.command == "shell":
+        print("\n".join(shell_lines(entry)))
+    elif args.key:
+        print(entry.env.get(args.key, ""))
+    else:
+        print(json.dumps({**entry.fields(), "env": entry.env}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("registry.py", main))
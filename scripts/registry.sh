@@ -0,0 +1,61 @@
+# Instance settings for the manager scripts, sourced like tracing.sh.
+#
+# load_instance_env <instance_dir> parses the instance's .env in bash, with the same
+# rules as scripts/registry.py (trimmed KEY=VALUE lines, surrounding quotes dropped),
+# into INSTANCE_ENV plus INSTANCE_SERVICE, INSTANCE_PORT, INSTANCE_CONTAINER and
+# INSTANCE_PROJECT. Reading one small file in-process is cheaper than starting python3
+# for the cached index, and basic commands keep working without python3.
+# `python3 scripts/registry.py shell <instance>` prints the same variables from the index.
+
+declare -A INSTANCE_ENV=()
+INSTANCE_ENV_DIR=""
+INSTANCE_SERVICE=""
+INSTANCE_PORT=""
+INSTANCE_CONTAINER=""
+INSTANCE_PROJECT=""
+
+_registry_trim() {
+  # _registry_trim <var> <text>: text without surrounding whitespace (and quotes with a third arg).
+  local s=$2
+  s=${s#"${s%%[![:space:]]*}"}
+  s=${s%"${s##*[![:space:]]}"}
+  if [[ -n "${3:-}" ]]; then
+    while [[ "$s" == [\"\']* ]]; do s=${s:1}; done
+    while [[ "$s" == *[\"\'] ]]; do s=${s:0:${#s}-1}; done
+  fi
+  printf -v "$1" '%s' "$s"
+}
+
+load_instance_env() {
+  # Loads once per instance; call it outside $(...) so the result is kept.
+  local instance_dir=$1 line key value
+  if [[ "$INSTANCE_ENV_DIR" == "$instance_dir" ]]; then
+    return 0
+  fi
+  INSTANCE_ENV=()
+  if [[ -f "$instance_dir/.env" ]]; then
+    while IFS= read -r line || [[ -n "$line" ]]; do
+      _registry_trim line "$line"
+      if [[ -z "$line" || "$line" == "#"* || "$line" != *=* ]]; then
+        continue
+      fi
+      _registry_trim key "${line%%=*}"
+      _registry_trim value "${line#*=}" quotes
+      if [[ "$key" =~ ^[A-Za-z_][A-Za-z0-9_]*$ ]]; then
+        INSTANCE_ENV[$key]=$value
+      fi
+    done < "$instance_dir/.env"
+  fi
+  # Same defaults as registry.py's Entry (and the status table).
+  INSTANCE_SERVICE=${INSTANCE_ENV[HT_SERVICE_NAME]:-hytale}
+  INSTANCE_PORT=${INSTANCE_ENV[HOST_PORT]:-}
+  INSTANCE_CONTAINER=${INSTANCE_ENV[HT_CONTAINER_NAME]:-}
+  INSTANCE_PROJECT=${INSTANCE_ENV[COMPOSE_PROJECT_NAME]:-}
+  if [[ -z "$INSTANCE_PROJECT" ]]; then
+    INSTANCE_PROJECT=${instance_dir%/}
+    INSTANCE_PROJECT=${INSTANCE_PROJECT##*/}
+    INSTANCE_PROJECT=${INSTANCE_PROJECT,,}
+    INSTANCE_PROJECT=${INSTANCE_PROJECT//[^a-z0-9_-]/}
+  fi
+  INSTANCE_ENV_DIR=$instance_dir
+}
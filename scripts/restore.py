@@ -0,0 +1,430 @@
+"""Restore an instance (or parts of it) from a tar archive or chunk-store backup.
+
+Only the requested paths are touched, and files that already match the backup are
+skipped. File contents are decompressed and written on a thread pool; tar archives
+are streamed through an external decompressor (multi-threaded where available), so
+nothing outside the selection is ever written to disk.
+
+Usage:
+  restore.py <instance_dir> <backup|latest> [--only PATH ...] [--delete] [--threads N] [--dry-run]
+  restore.py list <instance>
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from chunk_store import BACKUP_DIR, MANIFEST_SUFFIX, ChunkStore, human_bytes, load_manifest
+from tracing import run_main
+
+TAR_SUFFIXES = (".tar.gz", ".tar.zst", ".tar.xz")
+# Tar members larger than this are streamed to disk directly instead of being handed to a worker.
+INLINE_LIMIT = 64 * 1024 * 1024
+
+
+@dataclass
+class RestoreStats:
+    files_written: int = 0
+    files_skipped: int = 0
+    bytes_written: int = 0
+    bytes_skipped: int = 0
+    removed: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+
+def backups_for(backup_dir: Path, instance: str) -> List[Path]:
+    """Tar archives and manifests of an instance, oldest first (names sort by timestamp)."""
+    if not backup_dir.is_dir():
+        return []
+    found = []
+    for path in backup_dir.iterdir():
+        name = path.name
+        if not name.startswith(instance + "-") or not name.endswith(TAR_SUFFIXES + (MANIFEST_SUFFIX,)):
+            continue
+        stamp = name[len(instance) + 1:].split(".", 1)[0]
+        if len(stamp) == 15 and stamp[8] == "-" and stamp.replace("-", "").isdigit():
+            found.append(path)
+    return sorted(found, key=lambda p: p.name)
+
+
+def resolve_backup(value: str, instance: str, backup_dir: Path) -> Path:
+    if value == "latest":
+        found = backups_for(backup_dir, instance)
+        if not found:
+            raise ValueError(f"No backups found for {instance} in {backup_dir}")
+        return found[-1]
+    path = Path(value)
+    if path.is_file():
+        return path
+    if (backup_dir / value).is_file():
+        return backup_dir / value
+    raise ValueError(f"Backup not found: {value}")
+
+
+def normalize(name: str) -> str:
+    """Turn a member/entry name into a safe instance-relative posix path ('' for the root)."""
+    parts = [p for p in PurePosixPath(name).parts if p not in ("", ".", "/")]
+    if ".." in parts:
+        raise ValueError(f"Refusing unsafe path in backup: {name}")
+    return "/".join(parts)
+
+
+def selected(rel: str, only: List[str]) -> bool:
+    if not only:
+        return True
+    return any(rel == p or rel.startswith(p + "/") or p.startswith(rel + "/") for p in only)
+
+
+def inside(rel: str, only: List[str]) -> bool:
+    """True if rel is one of the requested paths or below one (not just a parent of one)."""
+    return not only or any(rel == p or rel.startswith(p + "/") for p in only)
+
+
+def file_matches(
+    path: Path,
+    size: int,
+    mtime_ns: int,
+    chunks: Optional[List[str]] = None,
+    chunk_size: int = 0,
+    touch: bool = True,
+) -> bool:
+    """Cheap size/mtime check, falling back to comparing chunk hashes when they are known."""
+    try:
+        st = path.lstat()
+    except FileNotFoundError:
+        return False
+    if not stat.S_ISREG(st.st_mode) or st.st_size != size:
+        return False
+    if st.st_mtime_ns == mtime_ns:
+        return True
+    if chunks is None:
+        return False
+    with path.open("rb") as handle:
+        for chunk_id in chunks:
+            if hashlib.sha256(handle.read(chunk_size)).hexdigest() != chunk_id:
+                return False
+    if touch:
+        touch_unshared(path, st, mtime_ns)
+    return True
+
+
+def touch_unshared(path: Path, st: os.stat_result, mtime_ns: int) -> None:
+    """Set the mtime of a file whose content already matches, unless other links share its inode.
+
+    server/ files are hardlinks into store/servers/<build>, shared by every instance of
+    the build; their mtime is left alone and the content check simply runs again next time.
+    """
+    if st.st_nlink <= 1:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def clear_for(path: Path, want_dir: bool = False) -> None:
+    """Remove whatever is at path if it is in the way of the entry being restored."""
+    if not os.path.lexists(path):
+        return
+    if path.is_dir() and not path.is_symlink():
+        if not want_dir:
+            shutil.rmtree(path)
+    elif want_dir:
+        path.unlink()
+
+
+def write_atomic(path: Path, chunks, mode: int, mtime_ns: int) -> int:
+    """Write an iterable of byte strings to path via a temp file; returns bytes written."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    clear_for(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.restore")
+    written = 0
+    try:
+        with tmp_path.open("wb") as handle:
+            for data in chunks:
+                handle.write(data)
+                written += len(data)
+        os.chmod(tmp_path, mode)
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        tmp_path.replace(path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return written
+
+
+def restore_symlink(path: Path, target: str) -> bool:
+    """Point path at target; returns False if it already did."""
+    if path.is_symlink() and os.readlink(path) == target:
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    clear_for(path)
+    os.symlink(target, path)
+    return True
+
+
+class Restorer:
+    """Applies file writes on a thread pool and keeps the shared statistics."""
+
+    def __init__(self, instance_dir: Path, threads: int, dry_run: bool) -> None:
+        self.instance_dir = instance_dir
+        self.dry_run = dry_run
+        self.stats = RestoreStats()
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=max(1, threads))
+        self.max_inflight = max(1, threads) * 2
+        self.inflight: Deque[Future] = deque()
+        self.dir_times: List[Tuple[Path, int, int]] = []
+        self.restored: Set[str] = set()
+
+    def submit(self, fn, *args) -> None:
+        while len(self.inflight) >= self.max_inflight:
+            self.inflight.popleft().result()
+        self.inflight.append(self.pool.submit(fn, *args))
+
+    def count(self, written: bool, size: int) -> None:
+        with self.lock:
+            if written:
+                self.stats.files_written += 1
+                self.stats.bytes_written += size
+            else:
+                self.stats.files_skipped += 1
+                self.stats.bytes_skipped += size
+
+    def directory(self, rel: str, mode: int, mtime_ns: int) -> None:
+        path = self.instance_dir / rel if rel else self.instance_dir
+        if not self.dry_run:
+            clear_for(path, want_dir=True)
+            path.mkdir(parents=True, exist_ok=True)
+            self.dir_times.append((path, mode, mtime_ns))
+
+    def wait(self) -> None:
+        while self.inflight:
+            self.inflight.popleft().result()
+
+    def finish(self) -> None:
+        self.wait()
+        self.pool.shutdown(wait=True)
+        # Directory mtimes change while their contents are written, so set them last.
+        for path, mode, mtime_ns in reversed(self.dir_times):
+            os.chmod(path, mode)
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def remove_extra(self, only: List[str]) -> None:
+        """Delete files under the requested paths that are not in the backup."""
+        roots = [self.instance_dir / p for p in only] if only else [self.instance_dir]
+        for root in roots:
+            if not root.is_dir() or root.is_symlink():
+                continue
+            for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+                for name in filenames + dirnames:
+                    path = Path(dirpath) / name
+                    rel = path.relative_to(self.instance_dir).as_posix()
+                    if rel in self.restored:
+                        continue
+                    if not self.dry_run:
+                        if path.is_dir() and not path.is_symlink():
+                            shutil.rmtree(path)
+                        else:
+                            path.unlink()
+                    self.stats.removed += 1
+                    print(f"{'Would remove' if self.dry_run else 'Removed'} {rel}")
+
+
+def restore_manifest(restorer: Restorer, manifest_path: Path, backup_dir: Path, only: List[str]) -> None:
+    manifest = load_manifest(manifest_path)
+    store = ChunkStore(backup_dir / "store")
+    instance_dir = restorer.instance_dir
+
+    def restore_file(rel: str, entry: Dict[str, object]) -> None:
+        path = instance_dir / rel
+        size = int(entry["size"])  # type: ignore[arg-type]
+        mtime_ns = int(entry["mtime_ns"])  # type: ignore[arg-type]
+        chunks = list(entry.get("chunks", []))  # type: ignore[arg-type]
+        if file_matches(path, size, mtime_ns, chunks, manifest.chunk_size, not restorer.dry_run):
+            restorer.count(False, size)
+            return
+        if not restorer.dry_run:
+            write_atomic(path, (store.get(c) for c in chunks), int(entry["mode"]), mtime_ns)  # type: ignore[arg-type]
+        restorer.count(True, size)
+
+    for entry in manifest.entries:
+        rel = normalize(str(entry["path"]))
+        if not selected(rel, only):
+            continue
+        restorer.restored.add(rel)
+        kind = entry.get("type")
+        if kind == "dir":
+            restorer.directory(rel, int(entry["mode"]), int(entry["mtime_ns"]))  # type: ignore[arg-type]
+        elif kind == "symlink":
+            changed = not restorer.dry_run and restore_symlink(instance_dir / rel, str(entry["target"]))
+            restorer.count(changed, 0)
+        elif kind == "file" and inside(rel, only):
+            restorer.submit(restore_file, rel, entry)
+
+
+def decompressor(path: Path, threads: int) -> Optional[List[str]]:
+    name = path.name
+    if name.endswith(".tar.gz"):
+        if shutil.which("pigz"):
+            return ["pigz", "-dc", "-p", str(threads), str(path)]
+        return ["gzip", "-dc", str(path)] if shutil.which("gzip") else None
+    if name.endswith(".tar.zst"):
+        return ["zstd", "-dcq", str(path)] if shutil.which("zstd") else None
+    if name.endswith(".tar.xz"):
+        return ["xz", "-dc", "-T", str(threads), str(path)] if shutil.which("xz") else None
+    return None
+
+
+def restore_tar(restorer: Restorer, archive: Path, only: List[str], threads: int) -> None:
+    instance_dir = restorer.instance_dir
+    command = decompressor(archive, threads)
+    if command is None and archive.name.endswith(".tar.zst"):
+        raise ValueError("zstd is required to restore .tar.zst archives")
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE) if command else None
+
+    def restore_member(rel: str, data: bytes, mode: int, mtime_ns: int) -> None:
+        path = instance_dir / rel
+        try:
+            st = path.lstat()
+            same = stat.S_ISREG(st.st_mode) and st.st_size == len(data) and path.read_bytes() == data
+        except OSError:
+            same = False
+        if same and not restorer.dry_run:
+            touch_unshared(path, st, mtime_ns)
+        elif not restorer.dry_run:
+            write_atomic(path, (data,), mode, mtime_ns)
+        restorer.count(not same, len(data))
+
+    completed = False
+    try:
+        source = proc.stdout if proc else None
+        with tarfile.open(fileobj=source, mode="r|") if source else tarfile.open(archive, mode="r|*") as tar:
+            for member in tar:
+                rel = normalize(member.name)
+                if not selected(rel, only):
+                    continue
+                restorer.restored.add(rel)
+                mtime_ns = int(member.mtime) * 1_000_000_000
+                if member.isdir():
+                    restorer.directory(rel, member.mode, mtime_ns)
+                elif member.issym():
+                    changed = not restorer.dry_run and restore_symlink(instance_dir / rel, member.linkname)
+                    restorer.count(changed, 0)
+                elif member.islnk():
+                    source_path = instance_dir / normalize(member.linkname)
+                    if not restorer.dry_run:
+                        # The link target may still be in a worker's queue.
+                        restorer.wait()
+                        if not source_path.exists():
+                            print(f"Cannot restore hard link {rel}: {member.linkname} was not restored", file=sys.stderr)
+                            restorer.stats.failed += 1
+                            continue
+                        clear_for(instance_dir / rel)
+                        os.link(source_path, instance_dir / rel)
+                    restorer.count(True, 0)
+                elif member.isfile() and inside(rel, only):
+                    path = instance_dir / rel
+                    if file_matches(path, member.size, mtime_ns):
+                        restorer.count(False, member.size)
+                        continue
+                    handle = tar.extractfile(member)
+                    if handle is None:
+                        continue
+                    if member.size > INLINE_LIMIT:
+                        if not restorer.dry_run:
+                            write_atomic(path, iter(lambda: handle.read(1024 * 1024), b""), member.mode, mtime_ns)
+                        restorer.count(True, member.size)
+                    else:
+                        restorer.submit(restore_member, rel, handle.read(), member.mode, mtime_ns)
+        completed = True
+    finally:
+        if proc:
+            proc.stdout.close()
+            # Only when nothing else is propagating; that error explains the failure better.
+            if proc.wait() not in (0, -13) and completed:
+                raise ValueError(f"{command[0]} failed while reading {archive.name}")
+
+
+def restore(
+    instance_dir: Path,
+    backup_path: Path,
+    only: Optional[List[str]] = None,
+    threads: Optional[int] = None,
+    delete: bool = False,
+    dry_run: bool = False,
+    backup_dir: Path = BACKUP_DIR,
+) -> RestoreStats:
+    """Restore backup_path into instance_dir; only limits it to these instance-relative paths."""
+    started = time.perf_counter()
+    only = [normalize(p) for p in only or []]
+    threads = threads or os.cpu_count() or 1
+    restorer = Restorer(instance_dir, threads, dry_run)
+    try:
+        if backup_path.name.endswith(MANIFEST_SUFFIX):
+            restore_manifest(restorer, backup_path, backup_dir, only)
+        elif backup_path.name.endswith(TAR_SUFFIXES):
+            restore_tar(restorer, backup_path, only, threads)
+        else:
+            raise ValueError(f"Unrecognized backup type: {backup_path.name}")
+        restorer.wait()
+        if only and not restorer.restored:
+            raise ValueError(f"Nothing in {backup_path.name} matches: {', '.join(only)}")
+        if delete:
+            restorer.remove_extra(only)
+    finally:
+        restorer.finish()
+    restorer.stats.seconds = time.perf_counter() - started
+    return restorer.stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["list"]:
+        if len(argv) != 2:
+            print("Usage: restore.py list <instance>", file=sys.stderr)
+            return 1
+        for path in backups_for(BACKUP_DIR, argv[1]):
+            print(path.name)
+        return 0
+
+    parser = argparse.ArgumentParser(prog="restore.py", description="Restore an instance from a backup.")
+    parser.add_argument("instance_dir", type=Path)
+    parser.add_argument("backup", help="backup file, a name in backups/, or 'latest'")
+    parser.add_argument("--only", action="append", default=[], help="restore only this path (repeatable)")
+    parser.add_argument("--delete", action="store_true", help="remove files under the restored paths that are not in the backup")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--backup-dir", type=Path, default=BACKUP_DIR)
+    args = parser.parse_args(argv)
+
+    instance_dir = args.instance_dir.resolve()
+    try:
+        backup_path = resolve_backup(args.backup, instance_dir.name, args.backup_dir)
+        instance_dir.mkdir(parents=True, exist_ok=True)
+        stats = restore(instance_dir, backup_path, args.only, args.threads, args.delete, args.dry_run, args.backup_dir)
+    except (OSError, ValueError, tarfile.TarError) as exc:
+        print(f"Restore failed: {exc}", file=sys.stderr)
+        return 1
+    verb = "would write" if args.dry_run else "wrote"
+    print(f"Restored from {backup_path.name}: {verb} {stats.files_written} files ({human_bytes(stats.bytes_written)}), "
+          f"skipped {stats.files_skipped} unchanged ({human_bytes(stats.bytes_skipped)}) in {stats.seconds:.1f}s")
+    if stats.removed:
+        print(f"{stats.removed} paths not in the backup {'would be' if args.dry_run else 'were'} removed.")
+    if stats.failed:
+        print(f"{stats.failed} paths could not be restored.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("restore.py", main))
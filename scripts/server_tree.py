@@ -0,0 +1,643 @@
+"""Shared, immutable server trees linked into instances.
+
+Each server build is stored once under store/servers/<key>/ with its files made
+read-only. Archives are streamed straight into the store, and files identical to the
+previous build (compared byte for byte as they stream) are hardlinked from it rather
+than written again.
+An instance's server/ folder is then populated with reflinks to those files (private
+copy-on-write copies that share disk blocks; a plain copy where the filesystem has
+no reflinks). Hardlinks (--mode hardlink) share one copy on disk and in the page
+cache, but the container can then write the store's inode for every instance.
+Stored files are checked against their recorded SHA-256 before they are linked.
+Files matching the writable patterns (HT_SERVER_WRITABLE, e.g. Server/config.json)
+are private copies instead and are never replaced once an instance has one.
+
+Usage:
+  server_tree.py import <archive|extract_dir> <key> [--base KEY] [--version VERSION]
+  server_tree.py link <key> <server_dir> [--mode hardlink|reflink|copy] [--writable GLOB ...] [--clean]
+  server_tree.py stage <key> <server_dir> <next_dir> [--mode ...] [--writable GLOB ...]
+  server_tree.py list
+  server_tree.py gc
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tarfile
+import time
+import zipfile
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from chunk_store import human_bytes
+from tracing import run_main
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+STORE_DIR = ROOT_DIR / "store" / "servers"
+INSTANCES_DIR = ROOT_DIR / "instances"
+META_NAME = ".hsm-tree.json"
+MARKER_NAME = ".hsm-tree"
+DEFAULT_WRITABLE = ["Server/config.json", "Server/permissions.json", "Server/whitelist.json", "Server/bans.json"]
+FICLONE = 0x40049409
+COPY_BLOCK = 1024 * 1024
+
+
+@dataclass
+class LinkStats:
+    linked: int = 0
+    kept: int = 0
+    copied: int = 0
+    removed: int = 0
+    bytes_copied: int = 0
+
+
+def tree_files(base: Path) -> Iterator[str]:
+    """Relative posix paths of every file/symlink in a tree (directories excluded)."""
+    for dirpath, dirnames, filenames in os.walk(base):
+        dirnames.sort()
+        rel_dir = Path(dirpath).relative_to(base)
+        for name in sorted(filenames):
+            rel = (rel_dir / name).as_posix()
+            if rel != META_NAME:
+                yield rel
+        for name in dirnames:
+            if os.path.islink(os.path.join(dirpath, name)):
+                yield (rel_dir / name).as_posix()
+
+
+def load_meta(tree: Path) -> Optional[Dict[str, object]]:
+    try:
+        return json.loads((tree / META_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def file_digests(path: Path) -> Tuple[int, str]:
+    """(crc32, sha256 hex) of a file's content."""
+    crc = 0
+    sha = hashlib.sha256()
+    with path.open("rb") as handle:
+        for block in iter(lambda: handle.read(COPY_BLOCK), b""):
+            crc = zlib.crc32(block, crc)
+            sha.update(block)
+    return crc, sha.hexdigest()
+
+
+def tree_manifest(tree: Path) -> Dict[str, List]:
+    """rel path -> [size, crc32, sha256] of every regular file of a stored tree.
+
+    Recorded at import time; computed (read-only) and saved for older trees.
+    """
+    meta = load_meta(tree) or {}
+    manifest = meta.get("manifest")
+    if isinstance(manifest, dict):
+        return manifest
+    manifest = {}
+    for rel in tree_files(tree):
+        path = tree / rel
+        if path.is_symlink() or not path.is_file():
+            continue
+        crc, sha = file_digests(path)
+        manifest[rel] = [path.stat().st_size, crc, sha]
+    meta["manifest"] = manifest
+    try:
+        (tree / META_NAME).write_text(json.dumps(meta) + "\n", encoding="utf-8")
+    except OSError:
+        pass
+    return manifest
+
+
+@dataclass
+class ImportStats:
+    written: int = 0
+    bytes_written: int = 0
+    reused: int = 0
+    bytes_reused: int = 0
+
+
+class TreeBuilder:
+    """Writes a new tree, hardlinking files that are unchanged from a base tree."""
+
+    def __init__(self, tmp: Path, base: Optional[Path]) -> None:
+        self.tmp = tmp
+        self.base = base
+        self.base_files = tree_manifest(base) if base is not None else {}
+        self.manifest: Dict[str, List] = {}
+        self.stats = ImportStats()
+
+    def add_dir(self, rel: str) -> None:
+        (self.tmp / rel).mkdir(parents=True, exist_ok=True)
+
+    def add_symlink(self, rel: str, target: str) -> None:
+        path = self.tmp / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if os.path.lexists(path):
+            path.unlink()
+        os.symlink(target, path)
+
+    def add_file(self, rel: str, mode: int, mtime: float, size: int, crc: Optional[int], opener: Callable[[], BinaryIO]) -> None:
+        path = self.tmp / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if os.path.lexists(path):
+            path.unlink()
+        base_entry = self.base_files.get(rel)
+        with opener() as handle:
+            # A zip CRC that differs rules a file out; a matching one still has to be compared.
+            if base_entry is not None and base_entry[0] == size and crc in (None, base_entry[1]):
+                self.compare(rel, path, mode, mtime, handle, base_entry)
+            else:
+                self.write(path, mode, mtime, iter(lambda: handle.read(COPY_BLOCK), b""), rel)
+
+    def compare(self, rel: str, path: Path, mode: int, mtime: float, handle: BinaryIO, base_entry: List) -> None:
+        """Streams an entry against the base file: linked if identical, else written."""
+        with (self.base / rel).open("rb") as base:  # type: ignore[operator]
+            matched = 0
+            while True:
+                block = handle.read(COPY_BLOCK)
+                if base.read(len(block) or 1) != block:
+                    break
+                if not block:
+                    self.reuse(rel, path, base_entry)
+                    return
+                matched += len(block)
+
+            def blocks() -> Iterator[bytes]:
+                # The part that matched comes from the base file; the rest from the entry.
+                base.seek(0)
+                remaining = matched
+                while remaining:
+                    chunk = base.read(min(COPY_BLOCK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+                yield block
+                yield from iter(lambda: handle.read(COPY_BLOCK), b"")
+
+            self.write(path, mode, mtime, blocks(), rel)
+
+    def reuse(self, rel: str, path: Path, base_entry: List) -> None:
+        src = self.base / rel  # type: ignore[operator]
+        os.link(src, path)
+        size = base_entry[0]
+        # Manifests written before hashes were recorded only have [size, crc32].
+        self.manifest[rel] = list(base_entry) if len(base_entry) > 2 else [size, *file_digests(src)]
+        self.stats.reused += 1
+        self.stats.bytes_reused += size
+
+    def write(self, path: Path, mode: int, mtime: float, blocks, rel: str) -> None:
+        crc = 0
+        sha = hashlib.sha256()
+        size = 0
+        with path.open("wb") as handle:
+            for block in blocks:
+                handle.write(block)
+                crc = zlib.crc32(block, crc)
+                sha.update(block)
+                size += len(block)
+        path.chmod(mode & ~0o222)
+        os.utime(path, (mtime, mtime))
+        self.manifest[rel] = [size, crc, sha.hexdigest()]
+        self.stats.written += 1
+        self.stats.bytes_written += size
+
+
+def clean_name(name: str) -> str:
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if ".." in parts:
+        raise ValueError(f"Refusing unsafe path in archive: {name}")
+    return "/".join(parts)
+
+
+def strip_prefix(names: List[str]) -> str:
+    """The single top-level folder shared by every entry ('' if there is none)."""
+    cleaned = [clean_name(name) for name in names]
+    tops = {name.split("/", 1)[0] for name in cleaned if name}
+    if len(tops) == 1:
+        top = tops.pop()
+        if any(name.startswith(top + "/") for name in cleaned):
+            return top + "/"
+    return ""
+
+
+def entry_rel(name: str, prefix: str) -> str:
+    rel = clean_name(name)
+    if prefix and (rel + "/").startswith(prefix):
+        rel = rel[len(prefix):]
+    return rel
+
+
+def read_zip(archive: Path, builder: TreeBuilder) -> None:
+    with zipfile.ZipFile(archive) as zf:
+        infos = zf.infolist()
+        prefix = strip_prefix([info.filename for info in infos])
+        for info in infos:
+            rel = entry_rel(info.filename, prefix)
+            if not rel:
+                continue
+            unix_mode = info.external_attr >> 16
+            if info.is_dir():
+                builder.add_dir(rel)
+            elif stat.S_ISLNK(unix_mode):
+                builder.add_symlink(rel, zf.read(info).decode("utf-8"))
+            else:
+                mode = stat.S_IMODE(unix_mode) or 0o644
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                builder.add_file(rel, mode, mtime, info.file_size, info.CRC, lambda info=info: zf.open(info))
+
+
+def read_tar(archive: Path, builder: TreeBuilder) -> None:
+    # Stream twice: once for the names (to find a top-level folder), once to extract.
+    with tarfile.open(archive, "r|*") as tar:
+        prefix = strip_prefix([member.name for member in tar])
+    with tarfile.open(archive, "r|*") as tar:
+        for member in tar:
+            rel = entry_rel(member.name, prefix)
+            if not rel:
+                continue
+            if member.isdir():
+                builder.add_dir(rel)
+            elif member.issym():
+                builder.add_symlink(rel, member.linkname)
+            elif member.isfile():
+                builder.add_file(rel, member.mode, member.mtime, member.size, None,
+                                 lambda member=member: tar.extractfile(member))  # type: ignore[arg-type,return-value]
+
+
+def read_dir(source: Path, builder: TreeBuilder) -> None:
+    for rel in tree_files(source):
+        path = source / rel
+        if path.is_symlink():
+            builder.add_symlink(rel, os.readlink(path))
+        elif path.is_file():
+            st = path.stat()
+            builder.add_file(rel, stat.S_IMODE(st.st_mode), st.st_mtime, st.st_size, None,
+                             lambda path=path: path.open("rb"))
+    for dirpath, dirnames, _ in os.walk(source):
+        for name in dirnames:
+            if not os.path.islink(os.path.join(dirpath, name)):
+                builder.add_dir((Path(dirpath) / name).relative_to(source).as_posix())
+
+
+def newest_tree(store_dir: Path) -> Optional[Path]:
+    trees = stored_trees(store_dir)
+    if not trees:
+        return None
+    return max(trees, key=lambda tree: str((load_meta(tree) or {}).get("created", "")))
+
+
+def import_tree(
+    source: Path,
+    key: str,
+    store_dir: Path = STORE_DIR,
+    base_key: Optional[str] = None,
+    version: Optional[str] = None,
+) -> Tuple[Path, Optional[ImportStats]]:
+    """Store a build (archive or extracted folder) once; returns (tree, stats or None if already stored).
+
+    Archives are streamed straight into the store. Files identical to the base build
+    (default: the newest stored one) are hardlinked from it instead of being written
+    again, so an update only writes what changed.
+    """
+    tree = store_dir / key
+    if load_meta(tree) is not None:
+        return tree, None
+    store_dir.mkdir(parents=True, exist_ok=True)
+    base = store_dir / base_key if base_key else None
+    if base is None or load_meta(base) is None:
+        base = newest_tree(store_dir)
+    tmp = store_dir / f".{key}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir()
+    builder = TreeBuilder(tmp, base)
+    try:
+        if source.is_dir():
+            read_dir(source, builder)
+        elif zipfile.is_zipfile(source):
+            read_zip(source, builder)
+        else:
+            read_tar(source, builder)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    meta = {
+        "key": key,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "base": base.name if base is not None else None,
+        "version": version,
+        "files": len(builder.manifest),
+        "bytes": sum(entry[0] for entry in builder.manifest.values()),
+        "manifest": builder.manifest,
+    }
+    (tmp / META_NAME).write_text(json.dumps(meta) + "\n", encoding="utf-8")
+    try:
+        tmp.rename(tree)
+    except OSError:
+        # Another setup/update imported the same build first.
+        shutil.rmtree(tmp, ignore_errors=True)
+        if load_meta(tree) is None:
+            raise
+    return tree, builder.stats
+
+
+def reflink_or_copy(src: Path, dst: Path) -> None:
+    with src.open("rb") as fsrc, dst.open("wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            shutil.copyfileobj(fsrc, fdst, COPY_BLOCK)
+    shutil.copystat(src, dst)
+
+
+def check_tree(tree: Path) -> None:
+    """Refuse a stored tree whose content no longer matches its manifest.
+
+    Every file is hashed (SHA-256; CRC-32 for manifests from before hashes were
+    recorded), so an in-place edit through a hardlinked instance is caught even when
+    the size and mode were put back. Files made writable are made read-only again.
+    """
+    for rel, entry in tree_manifest(tree).items():
+        path = tree / rel
+        st = path.stat()
+        crc, sha = file_digests(path) if st.st_size == entry[0] else (None, None)
+        if crc is None or (sha != entry[2] if len(entry) > 2 else crc != entry[1]):
+            raise ValueError(
+                f"Stored file {rel} of build {tree.name} was modified; delete the build from the store and import it again"
+            )
+        if st.st_mode & 0o222:
+            path.chmod(stat.S_IMODE(st.st_mode) & ~0o222)
+
+
+def is_writable_path(rel: str, patterns: List[str]) -> bool:
+    return any(fnmatch(rel, pattern) for pattern in patterns)
+
+
+def place(src: Path, dst: Path, mode: str, writable: bool) -> str:
+    """Put src at dst; returns 'linked' or 'copied'."""
+    if src.is_symlink():
+        os.symlink(os.readlink(src), dst)
+        return "linked"
+    if mode == "hardlink" and not writable:
+        try:
+            os.link(src, dst)
+            return "linked"
+        except OSError:
+            pass  # different filesystem (or no hardlink support): fall through to a copy
+    reflink_or_copy(src, dst)
+    st = dst.stat()
+    if writable or mode == "copy":
+        dst.chmod(stat.S_IMODE(st.st_mode) | stat.S_IWUSR)
+    return "copied"
+
+
+def unchanged(src: Path, dst: Path, mode: str) -> bool:
+    if src.is_symlink() or dst.is_symlink():
+        return src.is_symlink() and dst.is_symlink() and os.readlink(src) == os.readlink(dst)
+    if mode == "hardlink" and os.path.samefile(src, dst):
+        return True
+    a, b = src.stat(), dst.stat()
+    return mode != "hardlink" and a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+
+def previous_files(server_dir: Path, store_dir: Path) -> Set[str]:
+    try:
+        key = (server_dir / MARKER_NAME).read_text(encoding="utf-8").strip()
+    except OSError:
+        return set()
+    tree = store_dir / key
+    return set(tree_files(tree)) if tree.is_dir() else set()
+
+
+def link_tree(
+    key: str,
+    server_dir: Path,
+    mode: str = "reflink",
+    writable: Optional[List[str]] = None,
+    clean: bool = False,
+    store_dir: Path = STORE_DIR,
+) -> LinkStats:
+    """Populate server_dir from the stored tree.
+
+    Files already pointing at the tree are left alone, so relinking is cheap. With
+    clean, files that came from the previously linked tree but are not part of this
+    one are removed; files the server created itself are always kept.
+    """
+    tree = store_dir / key
+    if load_meta(tree) is None:
+        raise ValueError(f"Server tree not found: {key}")
+    patterns = DEFAULT_WRITABLE + list(writable or [])
+    stats = LinkStats()
+    server_dir.mkdir(parents=True, exist_ok=True)
+    wanted = set(tree_files(tree))
+    check_tree(tree)
+    stale = previous_files(server_dir, store_dir) - wanted if clean else set()
+
+    for rel in sorted(wanted):
+        src = tree / rel
+        dst = server_dir / rel
+        is_writable = is_writable_path(rel, patterns)
+        if os.path.lexists(dst):
+            if dst.is_dir() and not dst.is_symlink():
+                shutil.rmtree(dst)
+            elif is_writable and not dst.is_symlink():
+                stats.kept += 1  # keep the instance's own config
+                continue
+            elif unchanged(src, dst, mode):
+                stats.kept += 1
+                continue
+            else:
+                dst.unlink()
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if place(src, dst, mode, is_writable) == "linked":
+            stats.linked += 1
+        else:
+            stats.copied += 1
+            stats.bytes_copied += dst.lstat().st_size
+
+    for rel in sorted(stale):
+        path = server_dir / rel
+        if is_writable_path(rel, patterns) or not os.path.lexists(path):
+            continue
+        path.unlink()
+        stats.removed += 1
+
+    (server_dir / MARKER_NAME).write_text(key + "\n", encoding="utf-8")
+    return stats
+
+
+def seed_private(server_dir: Path, next_dir: Path, replaced: Set[str], store_dir: Path = STORE_DIR) -> int:
+    """Copy the files of server_dir that did not come from its build into next_dir.
+
+    These are the instance's own files (configs, files the server created); paths
+    in replaced are left out because the new build provides them. Files already up
+    to date in next_dir are skipped, so re-running this right before a swap only
+    copies what changed since staging. Returns the number of files copied.
+    """
+    tree_rels = previous_files(server_dir, store_dir)
+    key = None
+    if tree_rels:
+        key = (server_dir / MARKER_NAME).read_text(encoding="utf-8").strip()
+    copied = 0
+    for dirpath, dirnames, filenames in os.walk(server_dir):
+        rel_dir = Path(dirpath).relative_to(server_dir)
+        (next_dir / rel_dir).mkdir(parents=True, exist_ok=True)
+        for name in filenames + [d for d in dirnames if os.path.islink(os.path.join(dirpath, d))]:
+            rel = (rel_dir / name).as_posix()
+            src = server_dir / rel
+            if rel == MARKER_NAME or rel in replaced:
+                continue
+            if key and rel in tree_rels and not src.is_symlink() and os.path.samefile(src, store_dir / key / rel):
+                continue
+            dst = next_dir / rel
+            if os.path.lexists(dst):
+                if unchanged(src, dst, "copy"):
+                    continue
+                if dst.is_dir() and not dst.is_symlink():
+                    shutil.rmtree(dst)
+                else:
+                    dst.unlink()
+            if src.is_symlink():
+                os.symlink(os.readlink(src), dst)
+            else:
+                reflink_or_copy(src, dst)
+            copied += 1
+    if key:
+        (next_dir / MARKER_NAME).write_text(key + "\n", encoding="utf-8")
+    return copied
+
+
+def stage_tree(
+    key: str,
+    server_dir: Path,
+    next_dir: Path,
+    mode: str = "reflink",
+    writable: Optional[List[str]] = None,
+    store_dir: Path = STORE_DIR,
+) -> Tuple[int, LinkStats]:
+    """Prepare next_dir as server_dir upgraded to build key; returns (files copied, link stats)."""
+    tree = store_dir / key
+    if load_meta(tree) is None:
+        raise ValueError(f"Server tree not found: {key}")
+    patterns = DEFAULT_WRITABLE + list(writable or [])
+    replaced = {rel for rel in tree_files(tree) if not is_writable_path(rel, patterns)}
+    copied = seed_private(server_dir, next_dir, replaced, store_dir)
+    return copied, link_tree(key, next_dir, mode, writable, True, store_dir)
+
+
+def referenced_keys(instances_dir: Path = INSTANCES_DIR) -> Dict[str, List[str]]:
+    """Map tree key -> instances using it (server/, server.next/, server.prev/ ...)."""
+    refs: Dict[str, List[str]] = {}
+    if not instances_dir.is_dir():
+        return refs
+    for marker in sorted(instances_dir.glob(f"*/server*/{MARKER_NAME}")):
+        try:
+            key = marker.read_text(encoding="utf-8").strip()
+        except OSError:
+            continue
+        refs.setdefault(key, []).append(marker.parent.relative_to(instances_dir).as_posix())
+    return refs
+
+
+def stored_trees(store_dir: Path = STORE_DIR) -> List[Path]:
+    if not store_dir.is_dir():
+        return []
+    return sorted(p for p in store_dir.iterdir() if p.is_dir() and load_meta(p) is not None)
+
+
+def remove_tree(tree: Path) -> None:
+    for dirpath, dirnames, _ in os.walk(tree):
+        os.chmod(dirpath, 0o755)
+    shutil.rmtree(tree)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="server_tree.py", description="Shared server trees.")
+    parser.add_argument("--store-dir", type=Path, default=STORE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    import_cmd = sub.add_parser("import", help="Store a server build (archive or extracted folder)")
+    import_cmd.add_argument("source", type=Path)
+    import_cmd.add_argument("key")
+    import_cmd.add_argument("--base", help="build to diff against (default: newest stored build)")
+    import_cmd.add_argument("--version", help="game version of the build, shown by the instance registry")
+
+    link_cmd = sub.add_parser("link", help="Populate a server/ folder from a stored build")
+    link_cmd.add_argument("key")
+    link_cmd.add_argument("server_dir", type=Path)
+    link_cmd.add_argument("--mode", choices=["hardlink", "reflink", "copy"], default="reflink")
+    link_cmd.add_argument("--writable", action="append", default=[], help="glob of files to keep private (repeatable)")
+    link_cmd.add_argument("--clean", action="store_true", help="remove files left over from the previous build")
+
+    stage_cmd = sub.add_parser("stage", help="Build next_dir from a stored build plus server_dir's own files")
+    stage_cmd.add_argument("key")
+    stage_cmd.add_argument("server_dir", type=Path)
+    stage_cmd.add_argument("next_dir", type=Path)
+    stage_cmd.add_argument("--mode", choices=["hardlink", "reflink", "copy"], default="reflink")
+    stage_cmd.add_argument("--writable", action="append", default=[], help="glob of files to keep private (repeatable)")
+
+    sub.add_parser("list", help="List stored builds and the instances using them")
+    sub.add_parser("gc", help="Delete builds no instance uses")
+
+    args = parser.parse_args(argv)
+    store_dir: Path = args.store_dir
+
+    if args.command == "import":
+        try:
+            tree, imported = import_tree(args.source, args.key, store_dir, args.base, args.version)
+        except (OSError, ValueError, zipfile.BadZipFile, tarfile.TarError) as exc:
+            print(f"Importing server build failed: {exc}", file=sys.stderr)
+            return 1
+        if imported is None:
+            print(f"Server build {tree.name} already stored.")
+            return 0
+        base = (load_meta(tree) or {}).get("base") or "-"
+        print(
+            f"Server build {tree.name}: wrote {imported.written} files ({human_bytes(imported.bytes_written)}), "
+            f"skipped {imported.reused} unchanged ({human_bytes(imported.bytes_reused)}) from build {base}"
+        )
+        return 0
+
+    if args.command in ("link", "stage"):
+        writable = [p for value in args.writable for p in value.replace(",", " ").split()]
+        try:
+            if args.command == "stage":
+                copied, stats = stage_tree(args.key, args.server_dir, args.next_dir, args.mode, writable, store_dir)
+                print(f"Copied {copied} instance files into {args.next_dir.name}/")
+            else:
+                stats = link_tree(args.key, args.server_dir, args.mode, writable, args.clean, store_dir)
+        except (OSError, ValueError) as exc:
+            print(f"Linking server files failed: {exc}", file=sys.stderr)
+            return 1
+        print(
+            f"Server files: {stats.linked} linked, {stats.copied} copied ({human_bytes(stats.bytes_copied)}), "
+            f"{stats.kept} unchanged, {stats.removed} removed"
+        )
+        return 0
+
+    refs = referenced_keys()
+    if args.command == "list":
+        for tree in stored_trees(store_dir):
+            meta = load_meta(tree) or {}
+            users = ", ".join(refs.get(tree.name, [])) or "-"
+            print(f"{tree.name}\t{meta.get('created', '')}\t{meta.get('files', 0)} files\t"
+                  f"{human_bytes(float(meta.get('bytes', 0)))}\t{users}")
+        return 0
+
+    for tree in stored_trees(store_dir):
+        if tree.name not in refs:
+            remove_tree(tree)
+            print(f"Removed {tree.name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run_main("server_tree.py", main))
@@ -26,6 +26,12 @@ read -r -p "Password (optional): " SERVER_PASSWORD
 read -r -p "Max players (default: 10): " MAX_PLAYERS
 MAX_PLAYERS=${MAX_PLAYERS:-10}
 
+read -r -p "CPU cores to pin (default: 2): " CPU_CORES
+CPU_CORES=${CPU_CORES:-2}
+
+read -r -p "Memory limit (default: 6G): " MEMORY_LIMIT
+MEMORY_LIMIT=${MEMORY_LIMIT:-6G}
+
 INSTANCE_DIR="$INSTANCE_ROOT/$INSTANCE_NAME"
 
 if [[ -d "${INSTANCE_DIR}" ]]; then
@@ -60,6 +66,27 @@ sed \
   -e "s/__SERVICE_NAME__/${INSTANCE_NAME}/g" \
   "$TEMPLATE_DIR/instance-compose.yml" > "$INSTANCE_DIR/docker-compose.yml"
 
+# Pin the instance to free cores and set its memory limit (refused on an
+# overcommitted host when the capacity policy is "refuse").
+set +e
+python3 "$ROOT_DIR/scripts/capacity.py" allocate "$INSTANCE_DIR" --cores "$CPU_CORES" --memory "$MEMORY_LIMIT"
+CAPACITY_RC=$?
+set -e
+if [[ $CAPACITY_RC -ne 0 ]]; then
+  if [[ $CAPACITY_RC -eq 2 ]]; then
+    read -r -p "Create the instance anyway? (y/N): " OVERCOMMIT
+    if [[ "${OVERCOMMIT:-N}" =~ ^[Yy]$ ]]; then
+      python3 "$ROOT_DIR/scripts/capacity.py" allocate "$INSTANCE_DIR" --cores "$CPU_CORES" --memory "$MEMORY_LIMIT" --force
+      CAPACITY_RC=0
+    fi
+  fi
+  if [[ $CAPACITY_RC -ne 0 ]]; then
+    rm -rf "$INSTANCE_DIR"
+    echo "Aborting."
+    exit 1
+  fi
+fi
+
 "$ROOT_DIR/scripts/download.sh" "$INSTANCE_DIR"
 
 CURRENT_CMD=$(grep -E '^HT_SERVER_CMD=' "$INSTANCE_DIR/.env" | cut -d= -f2- | tr -d '\r')
@@ -0,0 +1,220 @@
+"""Opt-in timing traces (HSM_TRACE=1 or manager.sh --trace), Python side.
+
+Shares the file format of scripts/tracing.sh: Chrome trace events, one JSON object per
+line, appended to $HSM_TRACE_FILE. Helpers started from a traced script inherit the
+file and add their own spans; `export` wraps a trace for Perfetto, chrome://tracing
+or speedscope, and `summary` prints the span tree and the slowest steps.
+
+Usage:
+  tracing.py list
+  tracing.py summary [trace.jsonl] [--top N]
+  tracing.py export [trace.jsonl] [-o trace.json]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+TRACE_DIR = ROOT_DIR / ".hsm" / "trace"
+SUBCOMMAND_RE = re.compile(r"^[a-z][a-z0-9-]*$")
+
+_write_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return bool(os.environ.get("HSM_TRACE_FILE"))
+
+
+def _write(event: Dict[str, object]) -> None:
+    path = os.environ.get("HSM_TRACE_FILE")
+    if not path:
+        return
+    line = json.dumps(event, separators=(",", ":")) + "\n"
+    with _write_lock:
+        with open(path, "a", encoding="utf-8") as handle:
+            handle.write(line)
+
+
+def _ids() -> Dict[str, int]:
+    return {"pid": int(os.environ.get("HSM_TRACE_PID") or os.getpid()), "tid": threading.get_native_id()}
+
+
+def start(label: str) -> Optional[Path]:
+    """Starts a trace file for this process (when HSM_TRACE=1) unless one is inherited."""
+    if not enabled():
+        if os.environ.get("HSM_TRACE") != "1":
+            return None
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", label)
+        path = TRACE_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{name}.jsonl"
+        os.environ["HSM_TRACE_FILE"] = str(path)
+        os.environ["HSM_TRACE_PID"] = str(os.getpid())
+        _write({"name": "process_name", "ph": "M", **_ids(), "args": {"name": f"hsm {label}"}})
+        print(f"Tracing to {path}", file=sys.stderr)
+    _write({"name": "thread_name", "ph": "M", **_ids(), "args": {"name": label}})
+    return Path(os.environ["HSM_TRACE_FILE"])
+
+
+@contextmanager
+def span(name: str, cat: str = "py", **args: object) -> Iterator[Dict[str, object]]:
+    """Records the enclosed block; the yielded dict becomes the span's args."""
+    if not enabled():
+        yield args
+        return
+    started = time.time_ns() // 1000
+    try:
+        yield args
+    except BaseException as exc:
+        args.setdefault("error", type(exc).__name__)
+        raise
+    finally:
+        _write({
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": started,
+            "dur": time.time_ns() // 1000 - started,
+            **_ids(),
+            "args": args,
+        })
+
+
+def detached_env() -> Dict[str, str]:
+    """Environment for a background daemon: it outlives the run, so it must not join its trace."""
+    return {key: value for key, value in os.environ.items()
+            if key not in ("HSM_TRACE", "HSM_TRACE_FILE", "HSM_TRACE_PID")}
+
+
+def run_main(script: str, main: Callable[[], int]) -> int:
+    """Runs a helper's CLI entry point inside a span named after its subcommand."""
+    if not enabled():
+        return main()
+    argv = sys.argv[1:]
+    subcommand = next((arg for arg in argv if SUBCOMMAND_RE.match(arg)), "")
+    _write({"name": "thread_name", "ph": "M", **_ids(), "args": {"name": script}})
+    with span(f"{script} {subcommand}".strip(), cat=script, detail=" ".join(argv)[:300]) as args:
+        rc = main()
+        args["rc"] = rc
+        return rc
+
+
+def load(path: Path) -> List[Dict[str, object]]:
+    events: List[Dict[str, object]] = []
+    for line in path.read_text(encoding="utf-8", errors="replace").splitlines():
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            continue  # a line cut short by a killed process
+    return events
+
+
+def latest_trace() -> Optional[Path]:
+    files = sorted(TRACE_DIR.glob("*.jsonl"), key=lambda path: path.stat().st_mtime) if TRACE_DIR.is_dir() else []
+    return files[-1] if files else None
+
+
+def parents(spans: List[Dict[str, object]]) -> List[Optional[int]]:
+    """Index of each span's parent: the innermost open span on its thread, else the
+    innermost span of any thread that contains it (a helper started by a traced script)."""
+    result: List[Optional[int]] = []
+    stacks: Dict[object, List[int]] = {}
+    open_spans: List[int] = []
+
+    def end(i: int) -> int:
+        return int(spans[i]["ts"]) + int(spans[i]["dur"])  # type: ignore[arg-type]
+
+    for i, event in enumerate(spans):
+        start = int(event["ts"])  # type: ignore[arg-type]
+        stack = stacks.setdefault(event.get("tid"), [])
+        while stack and start >= end(stack[-1]):
+            stack.pop()
+        open_spans = [j for j in open_spans if start < end(j)]
+        if stack:
+            result.append(stack[-1])
+        else:
+            outer = [j for j in open_spans if end(j) >= end(i)]
+            result.append(outer[-1] if outer else None)
+        stack.append(i)
+        open_spans.append(i)
+    return result
+
+
+def summary(path: Path, top: int) -> int:
+    events = load(path)
+    names = {(e.get("pid"), e.get("tid")): e["args"]["name"] for e in events  # type: ignore[index]
+             if e.get("ph") == "M" and e.get("name") == "thread_name"}
+    spans = sorted((e for e in events if e.get("ph") == "X"), key=lambda e: (e["ts"], -e["dur"]))  # type: ignore[operator]
+    if not spans:
+        print(f"No spans in {path}")
+        return 0
+    origin = int(spans[0]["ts"])  # type: ignore[arg-type]
+    end = max(int(e["ts"]) + int(e["dur"]) for e in spans)  # type: ignore[arg-type]
+    print(f"{path}: {len(spans)} spans, {(end - origin) / 1000:.1f} ms")
+    print()
+    parent = parents(spans)
+    depth: List[int] = []
+    own = [float(e["dur"]) for e in spans]  # type: ignore[arg-type]
+    for i, event in enumerate(spans):
+        up = parent[i]
+        depth.append(depth[up] + 1 if up is not None else 0)
+        if up is not None:
+            own[up] -= float(event["dur"])  # type: ignore[arg-type]
+        label = names.get((event.get("pid"), event.get("tid")), "")
+        if up is not None and spans[up].get("tid") == event.get("tid"):
+            label = ""
+        rc = event.get("args", {}).get("rc")  # type: ignore[union-attr]
+        status = f"  rc={rc}" if rc not in (None, 0) else ""
+        print(f"{(int(event['ts']) - origin) / 1000:>9.1f} {int(event['dur']) / 1000:>9.1f} ms  "  # type: ignore[arg-type]
+              f"{'  ' * depth[i]}{event['name']}{status}{'  [' + label + ']' if label and label != event['name'] else ''}")
+    print()
+    print(f"Slowest steps (self time, top {top}):")
+    for index in sorted(range(len(spans)), key=lambda i: -own[i])[:top]:
+        print(f"  {max(own[index], 0) / 1000:>9.1f} ms  {spans[index]['name']}")
+    return 0
+
+
+def export(path: Path, out: Optional[Path]) -> int:
+    document = json.dumps({"traceEvents": load(path), "displayTimeUnit": "ms"})
+    if out is None:
+        print(document)
+    else:
+        out.write_text(document + "\n", encoding="utf-8")
+        print(f"Wrote {out} (open in https://ui.perfetto.dev, chrome://tracing or speedscope)")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="tracing.py", description="Timing traces.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List recorded traces")
+    summary_cmd = sub.add_parser("summary", help="Print the span tree and the slowest steps")
+    summary_cmd.add_argument("trace", nargs="?", type=Path, help="default: the newest trace")
+    summary_cmd.add_argument("--top", type=int, default=10)
+    export_cmd = sub.add_parser("export", help="Write a trace as one Chrome trace JSON document")
+    export_cmd.add_argument("trace", nargs="?", type=Path, help="default: the newest trace")
+    export_cmd.add_argument("-o", "--output", type=Path, default=None)
+
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        for path in sorted(TRACE_DIR.glob("*.jsonl")) if TRACE_DIR.is_dir() else []:
+            print(f"{path.stat().st_size:>10}  {path}")
+        return 0
+    path = args.trace or latest_trace()
+    if path is None or not path.exists():
+        print("No trace found (run with HSM_TRACE=1 or manager.sh --trace).", file=sys.stderr)
+        return 1
+    if args.command == "summary":
+        return summary(path, args.top)
+    return export(path, args.output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# Opt-in timing traces, sourced by the manager scripts (HSM_TRACE=1 or manager.sh --trace).
+#
+# Spans are appended to $HSM_TRACE_FILE as Chrome trace events ("ph":"X", microsecond
+# timestamps), one JSON object per line. The first traced script creates the file under
+# .hsm/trace/; scripts and Python helpers it starts inherit it, so one file holds the
+# whole run. View it with: python3 scripts/tracing.py export <file> (Perfetto,
+# chrome://tracing, speedscope) or python3 scripts/tracing.py summary <file>.
+#
+# Without tracing every helper below returns immediately.
+
+_TRACE_NAMES=()
+_TRACE_DETAILS=()
+_TRACE_STARTS=()
+_TRACE_CAT=${0##*/}
+
+_trace_json() {
+  # _trace_json <var> <text>: JSON string literal of text, without a subshell.
+  local s=$2
+  s=${s//\\/\\\\}
+  s=${s//\"/\\\"}
+  s=${s//$'\n'/\\n}
+  s=${s//$'\r'/\\r}
+  s=${s//$'\t'/\\t}
+  printf -v "$1" '"%s"' "$s"
+}
+
+trace_init() {
+  # trace_init <label>: opens the script's root span (closed by the EXIT trap).
+  if [[ "${HSM_TRACE:-0}" != "1" && -z "${HSM_TRACE_FILE:-}" ]]; then
+    return 0
+  fi
+  local label=$1 name
+  if [[ -z "${HSM_TRACE_FILE:-}" ]]; then
+    mkdir -p "$ROOT_DIR/.hsm/trace"
+    HSM_TRACE_FILE="$ROOT_DIR/.hsm/trace/$(date +%Y%m%d-%H%M%S)-${label//[^A-Za-z0-9._-]/_}.jsonl"
+    HSM_TRACE_PID=$$
+    _trace_json name "hsm $label"
+    printf '{"name":"process_name","ph":"M","pid":%s,"tid":%s,"args":{"name":%s}}\n' \
+      "$HSM_TRACE_PID" "$$" "$name" >> "$HSM_TRACE_FILE"
+    echo "Tracing to $HSM_TRACE_FILE" >&2
+  fi
+  export HSM_TRACE_FILE HSM_TRACE_PID=${HSM_TRACE_PID:-$$}
+  _trace_json name "$label"
+  printf '{"name":"thread_name","ph":"M","pid":%s,"tid":%s,"args":{"name":%s}}\n' \
+    "$HSM_TRACE_PID" "$$" "$name" >> "$HSM_TRACE_FILE"
+  trap '_trace_exit $?' EXIT
+  trace_begin "$label"
+}
+
+trace_begin() {
+  # trace_begin <name> [detail]
+  [[ -n "${HSM_TRACE_FILE:-}" ]] || return 0
+  _TRACE_NAMES+=("$1")
+  _TRACE_DETAILS+=("${2:-}")
+  _TRACE_STARTS+=("${EPOCHREALTIME//[.,]/}")
+}
+
+trace_end() {
+  # trace_end [rc]: closes the innermost open span.
+  [[ -n "${HSM_TRACE_FILE:-}" && ${#_TRACE_NAMES[@]} -gt 0 ]] || return 0
+  local i=$(( ${#_TRACE_NAMES[@]} - 1 )) now=${EPOCHREALTIME//[.,]/} name detail
+  _trace_json name "${_TRACE_NAMES[i]}"
+  _trace_json detail "${_TRACE_DETAILS[i]:0:300}"
+  printf '{"name":%s,"cat":"%s","ph":"X","ts":%s,"dur":%s,"pid":%s,"tid":%s,"args":{"rc":%s,"depth":%s,"detail":%s}}\n' \
+    "$name" "$_TRACE_CAT" "${_TRACE_STARTS[i]}" "$(( now - _TRACE_STARTS[i] ))" "$HSM_TRACE_PID" "$$" \
+    "${1:-0}" "$i" "$detail" >> "$HSM_TRACE_FILE"
+  unset '_TRACE_NAMES[i]' '_TRACE_DETAILS[i]' '_TRACE_STARTS[i]'
+}
+
+_trace_exit() {
+  # Closes every open span (errexit can leave several) with the exit status.
+  while [[ ${#_TRACE_NAMES[@]} -gt 0 ]]; do
+    trace_end "$1"
+  done
+}
+
+_trace_call() {
+  # _trace_call <span name> <command...>; keeps the command's status and errexit behaviour.
+  local _trace_span=$1
+  shift
+  trace_begin "$_trace_span" "${*:2}"
+  "$@"
+  local rc=$?
+  trace_end "$rc"
+  return "$rc"
+}
+
+traced() {
+  # traced <command...>: runs one command inside a span named after its first words.
+  if [[ -z "${HSM_TRACE_FILE:-}" ]]; then
+    "$@"
+    return
+  fi
+  local words="${*:1:3}"
+  _trace_call "${words//"$ROOT_DIR"\//}" "$@"
+}
+
+trace_functions() {
+  # trace_functions <fn...>: wraps shell functions so every call becomes a span.
+  [[ -n "${HSM_TRACE_FILE:-}" ]] || return 0
+  local fn
+  for fn in "$@"; do
+    eval "_traced_$fn() $(declare -f "$fn" | tail -n +2)"
+    eval "$fn() { _trace_call $fn _traced_$fn \"\$@\"; }"
+  done
+}
+
+trace_trap_exit() {
+  # trace_trap_exit <command>: `trap <command> EXIT` that still closes the open spans.
+  if [[ -n "${HSM_TRACE_FILE:-}" ]]; then
+    trap "_trace_rc=\$?; $1; _trace_exit \$_trace_rc" EXIT
+  else
+    trap "$1" EXIT
+  fi
+}
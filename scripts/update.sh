@@ -2,32 +2,131 @@
 set -euo pipefail
 
 ROOT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)
+. "$ROOT_DIR/scripts/tracing.sh"
+. "$ROOT_DIR/scripts/registry.sh"
 INSTANCE_DIR=${1:-"$(pwd)"}
+shift || true
 DO_BACKUP=1
+STAGED=0
+ROLLBACK=0
 
-if [[ "${2:-}" == "--no-backup" ]]; then
-  DO_BACKUP=0
-fi
+for arg in "$@"; do
+  case "$arg" in
+    --no-backup) DO_BACKUP=0 ;;
+    # Download and stage the new build while the server keeps running; only
+    # the stop, tree swap and start happen offline.
+    --staged) STAGED=1 ;;
+    # Swap server/ and server.prev/ back (undoes the last staged update).
+    --rollback) ROLLBACK=1 ;;
+    *)
+      echo "Unknown update option: $arg" >&2
+      exit 1
+      ;;
+  esac
+done
 
 if [[ ! -f "$INSTANCE_DIR/docker-compose.yml" ]]; then
   echo "docker-compose.yml not found in $INSTANCE_DIR" >&2
   exit 1
 fi
 
+# Parsed .env (scripts/registry.sh), loaded once.
+load_instance_env "$INSTANCE_DIR"
+env_value() {
+  printf '%s\n' "${INSTANCE_ENV[$1]:-}"
+}
+
+now_ms() {
+  date +%s%3N
+}
+
+# Exchanges two directories in one rename where supported (coreutils >= 9.5),
+# so server/ always exists; otherwise uses two renames while the server is down.
+exchange_dirs() {
+  local a=$1 b=$2
+  if mv --exchange -T "$a" "$b" 2>/dev/null; then
+    return 0
+  fi
+  mv -T "$a" "$a.swap.$$"
+  mv -T "$b" "$a"
+  mv -T "$a.swap.$$" "$b"
+}
+
+swap_in_next() {
+  local key link_mode link_args
+  key=$(cat "$INSTANCE_DIR/server.next/.hsm-tree" 2>/dev/null || true)
+  if [[ -n "$key" ]]; then
+    # Catch up on instance files (configs, server-written files) changed since staging.
+    link_mode=$(env_value HT_SERVER_LINK_MODE)
+    link_args=(--mode "${link_mode:-reflink}")
+    if [[ -n "$(env_value HT_SERVER_WRITABLE)" ]]; then
+      link_args+=(--writable "$(env_value HT_SERVER_WRITABLE)")
+    fi
+    python3 "$ROOT_DIR/scripts/server_tree.py" stage "$key" "$INSTANCE_DIR/server" "$INSTANCE_DIR/server.next" "${link_args[@]}" >/dev/null
+  fi
+  exchange_dirs "$INSTANCE_DIR/server" "$INSTANCE_DIR/server.next"
+  mv -T "$INSTANCE_DIR/server.next" "$INSTANCE_DIR/server.prev"
+}
+
+swap_in_prev() {
+  exchange_dirs "$INSTANCE_DIR/server" "$INSTANCE_DIR/server.prev"
+}
+
+# Gracefully stops the server, runs the given swap, starts it again and reports
+# the downtime (until the server logs that it is ready, or the container is
+# running when readiness cannot be confirmed).
+restart_with() {
+  local action=$1 started stopped swapped running
+  started=$(now_ms)
+  "$ROOT_DIR/scripts/manager.sh" stop "$INSTANCE_DIR"
+  stopped=$(now_ms)
+  "$2"
+  swapped=$(now_ms)
+  # The manager's start also sets the server command and exported auth tokens,
+  # then waits for the ready line.
+  "$ROOT_DIR/scripts/manager.sh" start "$INSTANCE_DIR"
+  running=$(now_ms)
+  echo "Downtime: $((running - started)) ms (stop $((stopped - started)) ms, swap $((swapped - stopped)) ms, start $((running - swapped)) ms)"
+  mkdir -p "$ROOT_DIR/.hsm"
+  printf '%s\t%s\t%s\t%s\t%s\t%s\t%s\n' "$(date '+%Y-%m-%dT%H:%M:%S')" "$(basename "$INSTANCE_DIR")" "$action" \
+    "$((running - started))" "$((stopped - started))" "$((swapped - stopped))" "$((running - swapped))" \
+    >> "$ROOT_DIR/.hsm/update.log"
+}
+
+trace_init "update.sh ${INSTANCE_DIR##*/}"
+trace_functions exchange_dirs swap_in_next swap_in_prev restart_with
+
+if [[ $ROLLBACK -eq 1 ]]; then
+  if [[ ! -d "$INSTANCE_DIR/server.prev" ]]; then
+    echo "No previous server tree to roll back to ($INSTANCE_DIR/server.prev)." >&2
+    exit 1
+  fi
+  restart_with rollback swap_in_prev
+  echo "Rollback complete (the replaced tree is now server.prev/)."
+  exit 0
+fi
+
 if [[ $DO_BACKUP -eq 1 ]]; then
   "$ROOT_DIR/scripts/backup.sh" "$INSTANCE_DIR"
 fi
 
+if [[ $STAGED -eq 1 ]]; then
+  rm -rf "$INSTANCE_DIR/server.next"
+  "$ROOT_DIR/scripts/download.sh" "$INSTANCE_DIR" --stage
+  # Drop the old rollback tree now rather than while the server is down.
+  rm -rf "$INSTANCE_DIR/server.prev"
+  restart_with update swap_in_next
+  echo "Update complete. Previous server files kept in server.prev/ (roll back with: manager rollback $(basename "$INSTANCE_DIR"))."
+  exit 0
+fi
+
 (
   cd "$INSTANCE_DIR"
-  docker compose down
+  traced docker compose down
 )
 
 "$ROOT_DIR/scripts/download.sh" "$INSTANCE_DIR" --clean
 
-(
-  cd "$INSTANCE_DIR"
-  docker compose up -d
-)
+"$ROOT_DIR/scripts/manager.sh" start "$INSTANCE_DIR"
 
 echo "Update complete."
@@ -0,0 +1,211 @@
+import json
+import socket
+import socketserver
+import struct
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pytest
+
+import docker_api
+import registry
+from docker_api import DockerClient, DockerError, decode_response
+
+
+def frame(kind: int, data: bytes) -> bytes:
+    return struct.pack(">BxxxL", kind, len(data)) + data
+
+
+def chunked(parts: List[bytes]) -> bytes:
+    return b"".join(b"%x\r\n%s\r\n" % (len(part), part) for part in parts) + b"0\r\n\r\n"
+
+
+class FakeDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Just enough of the Engine API over a unix socket for the client's code paths."""
+
+    daemon_threads = True
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path, FakeHandler)
+        self.connections = 0
+        self.requests: List[Tuple[str, str]] = []
+        # Close the connection after this many responses without saying so (a stale keep-alive).
+        self.drop_after: Optional[int] = None
+        self.exec_input: List[bytes] = []
+
+
+class FakeHandler(socketserver.StreamRequestHandler):
+    server: FakeDaemon
+
+    def handle(self) -> None:
+        self.server.connections += 1
+        served = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            method, target, _ = line.decode().split(" ", 2)
+            headers: Dict[str, str] = {}
+            while True:
+                header = self.rfile.readline().decode().strip()
+                if not header:
+                    break
+                key, _, value = header.partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = self.rfile.read(int(headers.get("content-length", "0")))
+            path = target.split("?", 1)[0].replace("/" + docker_api.API_VERSION, "", 1)
+            self.server.requests.append((method, path))
+            if not self.route(method, path, body):
+                return
+            served += 1
+            if self.server.drop_after is not None and served >= self.server.drop_after:
+                return
+
+    def send(self, status: int, body: bytes, content_type: str = "application/json") -> bool:
+        self.wfile.write(
+            b"HTTP/1.1 %d X\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n%s"
+            % (status, content_type.encode(), len(body), body)
+        )
+        return True
+
+    def send_chunked(self, parts: List[bytes], content_type: str) -> bool:
+        self.wfile.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: %s\r\nTransfer-Encoding: chunked\r\n\r\n" % content_type.encode()
+        )
+        self.wfile.write(chunked(parts))
+        return True
+
+    def route(self, method: str, path: str, body: bytes) -> bool:
+        if path == "/_ping":
+            return self.send(200, b"OK", "text/plain")
+        if path == "/containers/json":
+            return self.send(200, json.dumps([{"Id": "c1", "Names": ["/one"], "State": "running"}]).encode())
+        if path == "/containers/missing/json":
+            return self.send(404, b'{"message":"No such container: missing"}')
+        if path == "/events":
+            events = [json.dumps({"Action": action}).encode() + b"\n" for action in ("start", "die")]
+            # One event split over two chunks, the other sharing nothing.
+            return self.send_chunked([events[0][:5], events[0][5:], events[1]], "application/json")
+        if path == "/containers/c1/logs":
+            stream = frame(1, b"out one\nout t") + frame(2, b"err one\n") + frame(1, b"wo\n") + frame(2, b"tail")
+            return self.send_chunked([stream[:11], stream[11:]], "application/vnd.docker.multiplexed-stream")
+        if path == "/containers/c1/exec" and method == "POST":
+            return self.send(201, b'{"Id":"e1"}')
+        if path == "/exec/e1/start":
+            # Stream bytes in the same write as the headers, as a real daemon may send them.
+            self.wfile.write(
+                b"HTTP/1.1 101 UPGRADED\r\nConnection: Upgrade\r\nUpgrade: tcp\r\n\r\n" + frame(1, b"hello\n")
+            )
+            self.wfile.flush()
+            self.server.exec_input.append(self.request.recv(1024))
+            return False
+        return self.send(404, b'{"message":"page not found"}')
+
+
+@pytest.fixture
+def daemon(tmp_path: Path) -> Iterator[FakeDaemon]:
+    server = FakeDaemon(str(tmp_path / "docker.sock"))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(daemon: FakeDaemon) -> Iterator[DockerClient]:
+    client = DockerClient(daemon.server_address, timeout=5.0)  # type: ignore[arg-type]
+    yield client
+    client.close()
+
+
+def test_requests_reuse_one_connection(client: DockerClient, daemon: FakeDaemon) -> None:
+    assert client.ping()
+    assert client.containers(all=True)[0]["Id"] == "c1"
+    assert client.ping()
+    assert daemon.connections == 1
+
+
+def test_stale_keep_alive_connection_is_retried(client: DockerClient, daemon: FakeDaemon) -> None:
+    daemon.drop_after = 1
+    assert client.ping()
+    # The daemon dropped the idle connection; the next call reconnects once and succeeds.
+    assert client.containers()[0]["Names"] == ["/one"]
+    assert daemon.connections == 2
+    assert daemon.requests == [("GET", "/_ping"), ("GET", "/containers/json")]
+
+
+def test_unreachable_socket_raises(tmp_path: Path) -> None:
+    client = DockerClient(str(tmp_path / "nothing.sock"))
+    with pytest.raises(DockerError, match="unreachable"):
+        client.version()
+    assert not client.ping()
+
+
+def test_error_status_raises_with_message(client: DockerClient) -> None:
+    with pytest.raises(DockerError) as excinfo:
+        client.inspect("missing")
+    assert excinfo.value.status == 404
+    assert "No such container: missing" in str(excinfo.value)
+
+
+def test_decode_response() -> None:
+    assert decode_response(200, b'{"a": 1}') == {"a": 1}
+    assert decode_response(200, b"OK") == "OK"
+    assert decode_response(204, b"") is None
+    with pytest.raises(DockerError, match="Docker API error 500: boom") as excinfo:
+        decode_response(500, b'{"message":"boom\\n"}')
+    assert excinfo.value.status == 500
+    with pytest.raises(DockerError, match="Docker API error 502: bad gateway"):
+        decode_response(502, b"bad gateway")
+
+
+def test_chunked_line_stream(client: DockerClient) -> None:
+    stream = client.events()
+    assert [json.loads(line)["Action"] for line in stream] == ["start", "die"]
+    assert stream.closed
+
+
+def test_multiplexed_frames_are_demuxed(client: DockerClient) -> None:
+    lines = list(client.logs("c1", tty=False))
+    # Lines split across frames are joined per stream; a trailing partial line is kept.
+    assert lines == ["out one", "err one", "out two", "tail"]
+
+
+def test_stream_error_status(client: DockerClient) -> None:
+    with pytest.raises(DockerError) as excinfo:
+        client.stream("GET", "/nope")
+    assert excinfo.value.status == 404
+
+
+def test_exec_socket_upgrade_keeps_early_bytes(client: DockerClient, daemon: FakeDaemon) -> None:
+    sock, early = client.exec_socket("c1", ["cat"])
+    try:
+        assert early == frame(1, b"hello\n")
+        sock.sendall(b"/who\n")
+        sock.shutdown(socket.SHUT_WR)
+        assert sock.recv(1) == b""
+    finally:
+        sock.close()
+    assert daemon.exec_input == [b"/who\n"]
+    assert ("POST", "/exec/e1/start") in daemon.requests
+
+
+def test_status_rows_without_socket_use_docker_ps(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    instances = tmp_path / "instances"
+    for name, env in (("alpha", "HOST_PORT=5520\nHYTALE_SERVER_SESSION_TOKEN=t\n"), ("beta", "HT_CONTAINER_NAME=b1\n")):
+        (instances / name).mkdir(parents=True)
+        (instances / name / ".env").write_text(env, encoding="utf-8")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    docker = bin_dir / "docker"
+    docker.write_text("#!/bin/sh\nprintf 'alpha-hytale-1\\trunning\\talpha\\thytale\\nb1\\texited\\t\\t\\n'\n")
+    docker.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}:/usr/bin:/bin")
+    monkeypatch.setattr(registry, "_default", registry.Registry(instances, tmp_path / "registry.json"))
+    rows = docker_api.status_rows(None, instances)
+    assert [(r["instance"], r["container"], r["status"], r["port"], r["auth"]) for r in rows] == [
+        ("alpha", "alpha-hytale-1", "running", "5520", "ok"),
+        ("beta", "b1", "exited", "", "missing"),
+    ]
@@ -0,0 +1,132 @@
+import gzip
+import os
+import shutil
+from pathlib import Path
+from typing import Iterator, List
+
+import pytest
+
+from log_index import LogIndex
+
+
+def lines(start: int, count: int) -> str:
+    return "".join(f"2026-01-01 10:00:{n:02d} INFO line {n}\n" for n in range(start, start + count))
+
+
+def texts(index: LogIndex) -> List[str]:
+    return [row[0] for row in index.conn.execute("SELECT text FROM lines ORDER BY id")]
+
+
+@pytest.fixture
+def index(tmp_path: Path) -> Iterator[LogIndex]:
+    index = LogIndex(tmp_path / "index.sqlite")
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def logs(tmp_path: Path) -> Path:
+    path = tmp_path / "logs"
+    path.mkdir()
+    return path
+
+
+def gzip_rotate(live: Path, target: Path) -> None:
+    with live.open("rb") as src, gzip.open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    live.unlink()
+
+
+def test_appended_lines_are_indexed_once(index: LogIndex, logs: Path) -> None:
+    live = logs / "server.log"
+    live.write_text(lines(0, 3))
+    assert index.update(logs) == (1, 3)
+    assert index.update(logs) == (0, 0)
+    with live.open("a") as handle:
+        handle.write(lines(3, 2) + "2026-01-01 10:00:05 INFO part")
+    assert index.update(logs) == (1, 2)
+    assert len(texts(index)) == 5
+
+
+def test_gzip_rotation_keeps_indexed_lines(index: LogIndex, logs: Path) -> None:
+    live = logs / "server.log"
+    live.write_text(lines(0, 10))
+    index.update(logs)
+    # Lines written after the last update but before rotation are picked up from the archive.
+    with live.open("a") as handle:
+        handle.write(lines(10, 2))
+    gzip_rotate(live, logs / "server.log.1.gz")
+    live.write_text(lines(20, 1))
+    index.update(logs)
+    assert sorted(texts(index)) == (lines(0, 12) + lines(20, 1)).splitlines()
+    paths = sorted(Path(row[0]).name for row in index.conn.execute("SELECT path FROM files"))
+    assert paths == ["server.log", "server.log.1.gz"]
+    assert index.update(logs) == (0, 0)
+
+
+def test_gzip_rotation_named_before_live_file(index: LogIndex, logs: Path) -> None:
+    live = logs / "server.log"
+    live.write_text(lines(0, 4))
+    index.update(logs)
+    gzip_rotate(live, logs / "server-2026-01-01.log.gz")
+    live.write_text(lines(30, 2))
+    index.update(logs)
+    assert len(texts(index)) == 6
+
+
+def test_renamed_file_resumes(index: LogIndex, logs: Path) -> None:
+    live = logs / "server.log"
+    live.write_text(lines(0, 3))
+    index.update(logs)
+    with live.open("a") as handle:
+        handle.write(lines(3, 1))
+    live.rename(logs / "server.log.1")
+    live.write_text(lines(40, 1))
+    assert index.update(logs) == (2, 2)
+    assert len(texts(index)) == 5
+
+
+def test_deleted_files_are_pruned(index: LogIndex, logs: Path) -> None:
+    (logs / "old.log").write_text(lines(0, 3))
+    (logs / "new.log").write_text(lines(10, 2))
+    index.update(logs)
+    (logs / "old.log").unlink()
+    index.update(logs)
+    assert texts(index) == lines(10, 2).splitlines()
+    assert index.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 1
+    if index.has_fts:
+        assert [r.text for r in index.search(grep="line")] == lines(10, 2).splitlines()
+
+
+def test_replaced_content_is_reindexed_from_start(index: LogIndex, logs: Path) -> None:
+    live = logs / "server.log"
+    live.write_text(lines(0, 5))
+    index.update(logs)
+    # Same inode, new content that is already longer than the stored offset.
+    with live.open("r+") as handle:
+        handle.write(lines(50, 8))
+    assert os.stat(live).st_size > len(lines(0, 5))
+    index.update(logs)
+    assert texts(index) == lines(50, 8).splitlines()
+
+
+def test_gzip_is_read_in_chunks(index: LogIndex, logs: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("log_index.READ_CHUNK", 50)
+    with gzip.open(logs / "server.log.1.gz", "wt") as handle:
+        handle.write(lines(0, 20) + "2026-01-01 10:01:00 INFO last")
+    assert index.update(logs) == (1, 21)
+    assert texts(index) == (lines(0, 20) + "2026-01-01 10:01:00 INFO last").splitlines()
+
+
+def test_oversized_line_does_not_stall(index: LogIndex, logs: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr("log_index.READ_CHUNK", 64)
+    monkeypatch.setattr("log_index.MAX_LINE", 20)
+    live = logs / "server.log"
+    live.write_text(lines(0, 1) + "2026-01-01 10:00:01 WARN " + "x" * 500 + "\n" + lines(2, 2))
+    assert index.update(logs) == (1, 4)
+    stored = texts(index)
+    assert stored[1] == "2026-01-01 10:00:01 "
+    assert stored[2:] == lines(2, 2).splitlines()
+    with live.open("a") as handle:
+        handle.write(lines(4, 1))
+    assert index.update(logs) == (1, 1)
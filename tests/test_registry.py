@@ -0,0 +1,69 @@
+import subprocess
+from pathlib import Path
+
+import registry
+
+SCRIPTS = Path(__file__).resolve().parents[1] / "scripts"
+
+ENV_TEXT = (
+    "# comment\n"
+    '  HT_SERVICE_NAME = "svc" \n'
+    "HOST_PORT=5530\r\n"
+    "QUOTED='a value'\n"
+    "EMPTY=\n"
+    "EQUALS=a=b\n"
+    "bad-key=1\n"
+    "LAST=no newline"
+)
+
+
+def shell_env(instance_dir: Path) -> dict:
+    script = (
+        f'set -euo pipefail; . "{SCRIPTS}/registry.sh"; load_instance_env "$1"; '
+        'for key in "${!INSTANCE_ENV[@]}"; do printf "%s\\0%s\\0" "$key" "${INSTANCE_ENV[$key]}"; done; '
+        'printf "%s\\0%s\\0%s\\0%s\\0" "$INSTANCE_SERVICE" "$INSTANCE_PORT" "$INSTANCE_CONTAINER" "$INSTANCE_PROJECT"'
+    )
+    out = subprocess.run(["bash", "-c", script, "bash", str(instance_dir)], check=True, capture_output=True).stdout
+    fields = out.decode().split("\0")[:-1]
+    pairs, (service, port, container, project) = fields[:-4], fields[-4:]
+    return {
+        "env": dict(zip(pairs[::2], pairs[1::2])),
+        "service": service,
+        "port": port,
+        "container": container,
+        "project": project,
+    }
+
+
+def test_shell_loader_matches_registry(tmp_path: Path) -> None:
+    instance_dir = tmp_path / "My Inst"
+    instance_dir.mkdir()
+    (instance_dir / ".env").write_text(ENV_TEXT, encoding="utf-8")
+    entry = registry.parse_instance(instance_dir, {})
+    loaded = shell_env(instance_dir)
+    assert loaded["env"] == {key: value for key, value in entry.env.items() if registry.KEY_RE.match(key)}
+    assert loaded["env"]["LAST"] == "no newline"
+    assert (loaded["service"], loaded["port"], loaded["container"], loaded["project"]) == (
+        entry.service,
+        entry.port,
+        entry.container_name,
+        entry.project,
+    )
+
+
+def test_service_defaults_to_hytale(tmp_path: Path) -> None:
+    instance_dir = tmp_path / "alpha"
+    instance_dir.mkdir()
+    (instance_dir / ".env").write_text("HOST_PORT=5520\n", encoding="utf-8")
+    (instance_dir / "docker-compose.yml").write_text("services:\n  alpha:\n    image: x\n", encoding="utf-8")
+    assert registry.parse_instance(instance_dir, {}).service == "hytale"
+    assert shell_env(instance_dir)["service"] == "hytale"
+
+
+def test_index_is_private(tmp_path: Path) -> None:
+    instance_dir = tmp_path / "instances" / "alpha"
+    instance_dir.mkdir(parents=True)
+    (instance_dir / ".env").write_text("HT_SESSION_TOKEN=secret\n", encoding="utf-8")
+    index_file = tmp_path / "registry.json"
+    registry.Registry(tmp_path / "instances", index_file).refresh()
+    assert index_file.stat().st_mode & 0o777 == 0o600
@@ -0,0 +1,65 @@
+import os
+from pathlib import Path
+
+import pytest
+
+import server_tree
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> Path:
+    source = tmp_path / "src"
+    (source / "Server").mkdir(parents=True)
+    (source / "Server" / "HytaleServer.jar").write_bytes(b"jar-v1" * 100)
+    (source / "Server" / "config.json").write_text("{}")
+    store_dir = tmp_path / "store"
+    server_tree.import_tree(source, "b1", store_dir)
+    return store_dir
+
+
+def test_default_link_mode_gives_private_files(store: Path, tmp_path: Path) -> None:
+    server_dir = tmp_path / "inst" / "server"
+    server_tree.link_tree("b1", server_dir, store_dir=store)
+    linked = server_dir / "Server" / "HytaleServer.jar"
+    assert not os.path.samefile(linked, store / "b1" / "Server" / "HytaleServer.jar")
+    assert linked.read_bytes() == b"jar-v1" * 100
+
+
+def test_same_size_edit_of_stored_file_is_refused(store: Path, tmp_path: Path) -> None:
+    stored = store / "b1" / "Server" / "HytaleServer.jar"
+    mode = stored.stat().st_mode
+    stored.chmod(0o644)
+    stored.write_bytes(b"jar-v2" * 100)
+    stored.chmod(mode)
+    with pytest.raises(ValueError, match="was modified"):
+        server_tree.link_tree("b1", tmp_path / "inst" / "server", mode="hardlink", store_dir=store)
+
+
+def test_writable_stored_file_is_made_read_only_again(store: Path, tmp_path: Path) -> None:
+    stored = store / "b1" / "Server" / "HytaleServer.jar"
+    stored.chmod(0o644)
+    server_tree.link_tree("b1", tmp_path / "inst" / "server", mode="hardlink", store_dir=store)
+    assert not stored.stat().st_mode & 0o222
+
+
+def test_import_compares_content_not_checksum(store: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(server_tree, "COPY_BLOCK", 64)
+    source = tmp_path / "src2" / "Server"
+    source.mkdir(parents=True)
+    (source / "HytaleServer.jar").write_bytes(b"jar-v1" * 99 + b"jar-v2")
+    (source / "config.json").write_text("{}")
+    tree, stats = server_tree.import_tree(source.parent, "b2", store, base_key="b1")
+    assert stats is not None and (stats.written, stats.reused) == (1, 1)
+    assert (tree / "Server" / "HytaleServer.jar").read_bytes() == b"jar-v1" * 99 + b"jar-v2"
+    assert os.path.samefile(tree / "Server" / "config.json", store / "b1" / "Server" / "config.json")
+
+
+def test_matching_crc_with_different_content_is_written(store: Path, tmp_path: Path) -> None:
+    base = store / "b1"
+    builder = server_tree.TreeBuilder(tmp_path / "tmp", base)
+    size, crc = builder.base_files["Server/HytaleServer.jar"][:2]
+    changed = tmp_path / "changed"
+    changed.write_bytes(b"x" * size)
+    builder.add_file("Server/HytaleServer.jar", 0o644, 0, size, crc, lambda: changed.open("rb"))
+    assert (builder.stats.written, builder.stats.reused) == (1, 0)
+    assert (tmp_path / "tmp" / "Server" / "HytaleServer.jar").read_bytes() == b"x" * size